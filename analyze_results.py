@@ -1,25 +1,85 @@
+import argparse
+
 import numpy as np
 import matplotlib.pyplot as plt
-from stable_baselines3 import DQN
 import gymnasium as gym
 from traffic_env02 import TrafficEnv
+from vec_traffic_env import VecTrafficEnv
+from parallel_eval import imap_episodes
+from policies import load_policy, reset_policy
+from step_recorder import StepRecorder, StepRecording
+from online_stats import EvaluationStats
 
-def detailed_model_analysis(model_path="dqn_traffic_optimized.zip", num_episodes=10):
-    """Perform detailed analysis of the trained model"""
-    
-    # Register environment
-    try:
-        gym.register(
-            id="TrafficEnv-v1",
-            entry_point="traffic_env02:TrafficEnv",
-            max_episode_steps=200,
-        )
-    except:
-        pass  # Already registered
-    
-    # Load model and create environment
-    model = DQN.load(model_path)
-    env = gym.make("TrafficEnv-v1", render_mode=None)
+# Register environment
+try:
+    gym.register(
+        id="TrafficEnv-v1",
+        entry_point="traffic_env02:TrafficEnv",
+        max_episode_steps=200,
+    )
+except:
+    pass  # Already registered
+
+REWARD_COMPONENTS = ['throughput', 'queue_penalty', 'wait_penalty', 'phase_change', 'efficiency_bonus', 'balance_bonus']
+
+# Columns of an analysis recording (see step_recorder.py)
+STEP_COLUMNS = {
+    'vehicles_passed_per_step': np.int32,
+    'rewards_per_step': np.float64,
+    'queue_lengths': np.int32,
+    'wait_times': np.int32,
+    'phase_changes': np.uint8,  # 1 where the action differs from the previous step of the episode
+    **{f'reward_{component}': np.float64 for component in REWARD_COMPONENTS},
+}
+EPISODE_COLUMNS = {
+    'total_reward': np.float64,
+    'total_vehicles_passed': np.int64,
+    'total_phase_changes': np.int64,
+    'max_queue': np.int64,
+    'max_wait': np.int64,
+    'steps': np.int64,
+    'efficiency_score': np.float64,
+}
+
+def detailed_model_analysis(model_path="dqn_traffic_optimized.zip", num_episodes=10, batched=False,
+                            episode_lengths=None, seed=None, n_workers=1, record_path=None):
+    """
+    Perform detailed analysis of the trained model
+    
+    Args:
+        model_path: Path to the saved model, or any policy policies.load_policy
+                    accepts (e.g. a baseline controller such as "max_pressure")
+        num_episodes: Number of episodes to run
+        batched: Run all episodes at once in a VecTrafficEnv with one batched
+                 predict per step instead of one episode after another
+        episode_lengths: List of per-episode lengths, or None for 200 steps each
+        seed: Base seed, episode i is seeded with seed + i (sequential mode)
+              or the whole batch with seed (batched mode)
+        n_workers: Processes to shard the episodes over (sequential mode).
+                   Results are identical for any worker count; seed defaults
+                   to 0 when n_workers > 1
+        record_path: Stream the step and episode data to a columnar recording
+                     in this directory instead of keeping it in Python lists;
+                     plots and statistics then read it back lazily, and
+                     analyze_recording can redo them without re-simulating
+    """
+    if episode_lengths is None:
+        episode_lengths = [200] * num_episodes
+    
+    if batched:
+        model = load_policy(model_path)
+        if record_path:
+            with StepRecorder(record_path, STEP_COLUMNS, EPISODE_COLUMNS) as recorder:
+                run_batched_episodes(model, episode_lengths, seed, recorder)
+            return analyze_recording(record_path)
+        episode_data, step_by_step_data = run_batched_episodes(model, episode_lengths, seed)
+        create_detailed_plots(episode_data, step_by_step_data, num_episodes)
+        print_detailed_statistics(episode_data, step_by_step_data)
+        return episode_data, step_by_step_data
+    
+    if n_workers > 1 and seed is None:
+        seed = 0  # every episode must be seeded for the shards to be reproducible
+    seeds = [None if seed is None else seed + episode for episode in range(num_episodes)]
     
     # Detailed metrics storage
     episode_data = []
@@ -39,61 +99,24 @@ def detailed_model_analysis(model_path="dqn_traffic_optimized.zip", num_episodes
         }
     }
     
-    print("Running detailed analysis...")
-    
-    for episode in range(num_episodes):
-        obs, _ = env.reset()
-        done = False
-        episode_metrics = {
-            'total_reward': 0,
-            'total_vehicles_passed': 0,
-            'total_phase_changes': 0,
-            'max_queue': 0,
-            'max_wait': 0,
-            'steps': 0,
-            'efficiency_score': 0
-        }
-        
-        episode_step_data = {
-            'vehicles_per_step': [],
-            'rewards': [],
-            'queues': [],
-            'waits': [],
-            'actions': []
-        }
-        
-        while not done:
-            action, _ = model.predict(obs, deterministic=True)
-            obs, reward, terminated, truncated, info = env.step(action)
-            
-            # Update episode metrics
-            episode_metrics['total_reward'] += reward
-            episode_metrics['total_vehicles_passed'] += info.get('vehicles_passed', 0)
-            episode_metrics['total_phase_changes'] += info.get('phase_changes', 0)
-            episode_metrics['max_queue'] = max(episode_metrics['max_queue'], info.get('total_queues', 0))
-            episode_metrics['max_wait'] = max(episode_metrics['max_wait'], info.get('max_wait_time', 0))
-            episode_metrics['steps'] += 1
-            
-            # Store step-by-step data
-            episode_step_data['vehicles_per_step'].append(info.get('vehicles_passed', 0))
-            episode_step_data['rewards'].append(reward)
-            episode_step_data['queues'].append(info.get('total_queues', 0))
-            episode_step_data['waits'].append(info.get('max_wait_time', 0))
-            episode_step_data['actions'].append(action)
-            
-            # Store reward components if available
-            if 'reward_components' in info:
-                for component, value in info['reward_components'].items():
-                    if component in step_by_step_data['reward_components']:
-                        step_by_step_data['reward_components'][component].append(value)
-            
-            done = terminated or truncated
-        
-        # Calculate efficiency score
-        episode_metrics['efficiency_score'] = (
-            episode_metrics['total_vehicles_passed'] / episode_metrics['steps'] * 100
-        )
-        
+    print("Running detailed analysis..." if n_workers <= 1 else f"Running detailed analysis on {n_workers} workers...")
+    
+    # Episodes come back in seed order whatever the number of workers
+    results = imap_episodes(run_analysis_episode, model_path, zip(seeds, episode_lengths[:num_episodes]),
+                            make_analysis_env, (max(episode_lengths),), n_workers=n_workers)
+    
+    # Statistics are accumulated as the episodes arrive
+    stats = EvaluationStats(REWARD_COMPONENTS)
+    
+    if record_path:
+        with StepRecorder(record_path, STEP_COLUMNS, EPISODE_COLUMNS) as recorder:
+            for episode_metrics, episode_step_data in results:
+                accumulate_episode(stats, episode_metrics, episode_step_data)
+                record_analysis_episode(recorder, episode_metrics, episode_step_data)
+        return analyze_recording(record_path, stats)
+    
+    for episode_metrics, episode_step_data in results:
+        accumulate_episode(stats, episode_metrics, episode_step_data)
         episode_data.append(episode_metrics)
         
         # Add episode data to step-by-step collection
@@ -103,12 +126,225 @@ def detailed_model_analysis(model_path="dqn_traffic_optimized.zip", num_episodes
         step_by_step_data['wait_times'].extend(episode_step_data['waits'])
         step_by_step_data['phase_changes'].extend([1 if a != episode_step_data['actions'][i-1] else 0 
                                                   for i, a in enumerate(episode_step_data['actions']) if i > 0])
-    
-    env.close()
+        for component, values in episode_step_data['reward_components'].items():
+            if component in step_by_step_data['reward_components']:
+                step_by_step_data['reward_components'][component].extend(values)
     
     # Create comprehensive analysis plots
     create_detailed_plots(episode_data, step_by_step_data, num_episodes)
-    print_detailed_statistics(episode_data, step_by_step_data)
+    print_detailed_statistics(stats=stats)
+    return episode_data, step_by_step_data
+
+def record_analysis_episode(recorder, episode_metrics, episode_step_data):
+    """Append one run_analysis_episode result to a StepRecorder"""
+    actions = np.asarray(episode_step_data['actions']).reshape(-1)
+    phase_switches = np.zeros(len(actions), dtype=np.uint8)
+    phase_switches[1:] = actions[1:] != actions[:-1]
+    components = episode_step_data['reward_components']
+    recorder.append_steps(
+        vehicles_passed_per_step=episode_step_data['vehicles_per_step'],
+        rewards_per_step=episode_step_data['rewards'],
+        queue_lengths=episode_step_data['queues'],
+        wait_times=episode_step_data['waits'],
+        phase_changes=phase_switches,
+        **{f'reward_{component}': components[component] for component in REWARD_COMPONENTS},
+    )
+    recorder.append_episode(**episode_metrics)
+
+def load_analysis_recording(path):
+    """
+    Open a recording made with detailed_model_analysis(record_path=...)
+    
+    Returns:
+        (episode_data, step_data) in the format of detailed_model_analysis,
+        with every step series a read-only memory map
+    """
+    recording = StepRecording(path)
+    steps, episodes = recording.steps, recording.episodes
+    step_data = {name: steps[name] for name in STEP_COLUMNS if not name.startswith('reward_')}
+    step_data['reward_components'] = {component: steps[f'reward_{component}'] for component in REWARD_COMPONENTS}
+    columns = list(episodes.columns)
+    episode_data = [dict(zip(columns, row)) for row in zip(*(episodes[name].tolist() for name in columns))]
+    return episode_data, step_data
+
+def analyze_recording(path, stats=None):
+    """Plots and statistics of a recorded analysis run, without re-simulating it"""
+    episode_data, step_data = load_analysis_recording(path)
+    create_detailed_plots(episode_data, step_data, len(episode_data))
+    print_detailed_statistics(episode_data, step_data, stats)
+    return episode_data, step_data
+
+def accumulate_episode(stats, episode_metrics, episode_step_data):
+    """Add one run_analysis_episode result to an EvaluationStats"""
+    actions = np.asarray(episode_step_data['actions']).reshape(-1)
+    stats.add_episode(**episode_metrics)
+    stats.add_steps(
+        episode_step_data['vehicles_per_step'],
+        episode_step_data['rewards'],
+        episode_step_data['queues'],
+        episode_step_data['waits'],
+        phase_switches=np.sum(actions[1:] != actions[:-1]),
+        components=episode_step_data['reward_components'],
+    )
+
+def make_analysis_env(max_steps=200):
+    """TrafficEnv used by detailed_model_analysis, built once per evaluation worker"""
+    return gym.make("TrafficEnv-v1", render_mode=None, max_steps=max_steps, max_episode_steps=max_steps)
+
+def run_analysis_episode(model, env, seed, max_steps):
+    """
+    Run one episode of detailed_model_analysis
+    
+    Returns:
+        (episode_metrics, episode_step_data) for that episode
+    """
+    obs, _ = env.reset(seed=seed)
+    reset_policy(model)
+    done = False
+    episode_metrics = {
+        'total_reward': 0,
+        'total_vehicles_passed': 0,
+        'total_phase_changes': 0,
+        'max_queue': 0,
+        'max_wait': 0,
+        'steps': 0,
+        'efficiency_score': 0
+    }
+    
+    episode_step_data = {
+        'vehicles_per_step': [],
+        'rewards': [],
+        'queues': [],
+        'waits': [],
+        'actions': [],
+        'reward_components': {}
+    }
+    
+    while not done:
+        action, _ = model.predict(obs, deterministic=True)
+        obs, reward, terminated, truncated, info = env.step(action)
+        
+        # Update episode metrics
+        episode_metrics['total_reward'] += reward
+        episode_metrics['total_vehicles_passed'] += info.get('vehicles_passed', 0)
+        episode_metrics['total_phase_changes'] += info.get('phase_changes', 0)
+        episode_metrics['max_queue'] = max(episode_metrics['max_queue'], info.get('total_queues', 0))
+        episode_metrics['max_wait'] = max(episode_metrics['max_wait'], info.get('max_wait_time', 0))
+        episode_metrics['steps'] += 1
+        
+        # Store step-by-step data
+        episode_step_data['vehicles_per_step'].append(info.get('vehicles_passed', 0))
+        episode_step_data['rewards'].append(reward)
+        episode_step_data['queues'].append(info.get('total_queues', 0))
+        episode_step_data['waits'].append(info.get('max_wait_time', 0))
+        episode_step_data['actions'].append(action)
+        
+        # Store reward components if available
+        if 'reward_components' in info:
+            for component, value in info['reward_components'].items():
+                episode_step_data['reward_components'].setdefault(component, []).append(value)
+        
+        done = terminated or truncated or episode_metrics['steps'] >= max_steps
+    
+    # Calculate efficiency score
+    episode_metrics['efficiency_score'] = (
+        episode_metrics['total_vehicles_passed'] / episode_metrics['steps'] * 100
+    )
+    return episode_metrics, episode_step_data
+
+def run_batched_episodes(model, episode_lengths, seed=None, recorder=None):
+    """
+    Run all episodes in lockstep in one VecTrafficEnv
+    
+    Every timestep is a single batched model.predict over all episodes.
+    Episodes shorter than the longest are masked out once they finish
+    (their env auto-resets and keeps stepping, but nothing is recorded).
+    The episodes share one random stream, so results match the sequential
+    mode statistically rather than seed for seed.
+    
+    Returns:
+        (episode_data, step_by_step_data) in the format detailed_model_analysis
+        passes to create_detailed_plots and print_detailed_statistics. With a
+        StepRecorder the episodes are written to it instead and
+        step_by_step_data is None
+    """
+    lengths = np.asarray(episode_lengths, dtype=np.int64)
+    num_episodes = len(lengths)
+    horizon = int(lengths.max())
+    env = VecTrafficEnv(num_episodes, max_steps=lengths, seed=seed)
+    
+    # (timestep, episode) arrays of everything the sequential loop records
+    rewards = np.zeros((horizon, num_episodes))
+    vehicles = np.zeros((horizon, num_episodes), dtype=np.int64)
+    queues = np.zeros((horizon, num_episodes), dtype=np.int64)
+    waits = np.zeros((horizon, num_episodes), dtype=np.int64)
+    phase_changes = np.zeros((horizon, num_episodes), dtype=np.int64)
+    actions = np.zeros((horizon, num_episodes), dtype=np.int64)
+    components = {component: np.zeros((horizon, num_episodes)) for component in REWARD_COMPONENTS}
+    
+    print(f"Running {num_episodes} episodes in lockstep ({horizon} batched steps)...")
+    obs = env.reset()
+    reset_policy(model)
+    for t in range(horizon):
+        actions[t], _ = model.predict(obs, deterministic=True)
+        obs, rewards[t], _, _ = env.step(actions[t])
+        info = env.batch_info
+        vehicles[t] = info['vehicles_passed']
+        queues[t] = info['total_queues']
+        waits[t] = info['max_wait_time']
+        phase_changes[t] = info['phase_changes']
+        for component in REWARD_COMPONENTS:
+            components[component][t] = info['reward_components'][component]
+    env.close()
+    
+    # Mask out the steps after each episode ended
+    active = np.arange(horizon)[:, None] < lengths[None, :]
+    total_rewards = np.where(active, rewards, 0).sum(axis=0)
+    total_vehicles = np.where(active, vehicles, 0).sum(axis=0)
+    total_phase_changes = np.where(active, phase_changes, 0).sum(axis=0)
+    max_queues = np.where(active, queues, 0).max(axis=0)
+    max_waits = np.where(active, waits, 0).max(axis=0)
+    
+    episode_data = [{
+        'total_reward': float(total_rewards[i]),
+        'total_vehicles_passed': int(total_vehicles[i]),
+        'total_phase_changes': int(total_phase_changes[i]),
+        'max_queue': int(max_queues[i]),
+        'max_wait': int(max_waits[i]),
+        'steps': int(lengths[i]),
+        'efficiency_score': total_vehicles[i] / lengths[i] * 100,
+    } for i in range(num_episodes)]
+    
+    if recorder is not None:
+        for i, n in enumerate(lengths):
+            phase_switches = np.zeros(n, dtype=np.uint8)
+            phase_switches[1:] = actions[1:n, i] != actions[:n - 1, i]
+            recorder.append_steps(
+                vehicles_passed_per_step=vehicles[:n, i],
+                rewards_per_step=rewards[:n, i],
+                queue_lengths=queues[:n, i],
+                wait_times=waits[:n, i],
+                phase_changes=phase_switches,
+                **{f'reward_{component}': values[:n, i] for component, values in components.items()},
+            )
+            recorder.append_episode(**episode_data[i])
+        return episode_data, None
+    
+    # Step series are concatenated episode by episode, as in the sequential loop
+    step_by_step_data = {
+        'vehicles_passed_per_step': np.concatenate([vehicles[:n, i] for i, n in enumerate(lengths)]).tolist(),
+        'rewards_per_step': np.concatenate([rewards[:n, i] for i, n in enumerate(lengths)]).tolist(),
+        'queue_lengths': np.concatenate([queues[:n, i] for i, n in enumerate(lengths)]).tolist(),
+        'wait_times': np.concatenate([waits[:n, i] for i, n in enumerate(lengths)]).tolist(),
+        'phase_changes': np.concatenate([
+            (actions[1:n, i] != actions[:n - 1, i]).astype(np.int64) for i, n in enumerate(lengths)
+        ]).tolist(),
+        'reward_components': {
+            component: np.concatenate([values[:n, i] for i, n in enumerate(lengths)]).tolist()
+            for component, values in components.items()
+        },
+    }
+    return episode_data, step_by_step_data
 
 def create_detailed_plots(episode_data, step_data, num_episodes):
     """Create comprehensive visualization plots"""
@@ -161,8 +397,8 @@ def create_detailed_plots(episode_data, step_data, num_episodes):
     
     # Plot 5: Vehicles Passed Distribution
     ax5 = plt.subplot(4, 3, 5)
-    if step_data['vehicles_passed_per_step']:
-        ax5.hist(step_data['vehicles_passed_per_step'], bins=range(0, max(step_data['vehicles_passed_per_step'])+2), 
+    if len(step_data['vehicles_passed_per_step']):
+        ax5.hist(step_data['vehicles_passed_per_step'], bins=range(0, np.max(step_data['vehicles_passed_per_step'])+2), 
                  alpha=0.7, edgecolor='black')
     ax5.set_xlabel('Vehicles Passed per Step')
     ax5.set_ylabel('Frequency')
@@ -196,10 +432,10 @@ def create_detailed_plots(episode_data, step_data, num_episodes):
     
     # Plot 9: Reward Components (if available)
     ax9 = plt.subplot(4, 3, 9)
-    if step_data['reward_components']['throughput']:
+    if len(step_data['reward_components']['throughput']):
         components = ['throughput', 'queue_penalty', 'wait_penalty', 'efficiency_bonus']
         component_labels = ['Throughput\nReward', 'Queue\nPenalty', 'Wait\nPenalty', 'Efficiency\nBonus']
-        means = [np.mean(step_data['reward_components'][comp]) for comp in components if step_data['reward_components'][comp]]
+        means = [np.mean(step_data['reward_components'][comp]) for comp in components if len(step_data['reward_components'][comp])]
         if means:
             bars = ax9.bar(range(len(means)), means, color=['green', 'red', 'orange', 'blue'])
             ax9.set_xticks(range(len(means)))
@@ -242,64 +478,95 @@ def create_detailed_plots(episode_data, step_data, num_episodes):
     plt.subplots_adjust(hspace=0.5, wspace=0.5)  # Increased both vertical and horizontal spacing
     plt.show()
 
-def print_detailed_statistics(episode_data, step_data):
-    """Print comprehensive statistics"""
-    
-    total_rewards = [ep['total_reward'] for ep in episode_data]
-    vehicles_passed = [ep['total_vehicles_passed'] for ep in episode_data]
-    phase_changes = [ep['total_phase_changes'] for ep in episode_data]
-    efficiency_scores = [ep['efficiency_score'] for ep in episode_data]
+def accumulate_statistics(episode_data, step_data, chunk_size=1 << 20):
+    """EvaluationStats of episode and step data in the detailed_model_analysis format, read in chunks"""
+    stats = EvaluationStats(REWARD_COMPONENTS)
+    for episode in episode_data:
+        stats.add_episode(**episode)
+    components = step_data['reward_components']
+    for start in range(0, len(step_data['vehicles_passed_per_step']), chunk_size):
+        end = start + chunk_size
+        stats.add_steps(
+            step_data['vehicles_passed_per_step'][start:end],
+            step_data['rewards_per_step'][start:end],
+            step_data['queue_lengths'][start:end],
+            step_data['wait_times'][start:end],
+            components={component: values[start:end] for component, values in components.items()},
+        )
+    stats.phase_switches = int(np.sum(step_data['phase_changes']))
+    return stats
+
+def print_detailed_statistics(episode_data=None, step_data=None, stats=None):
+    """
+    Print comprehensive statistics
+    
+    The report is computed from an EvaluationStats accumulator alone, either
+    given as stats (e.g. filled while the episodes ran) or accumulated here
+    from episode_data and step_data in one pass.
+    """
+    if stats is None:
+        stats = accumulate_statistics(episode_data, step_data)
+    
+    rewards = stats.episodes['total_reward']
+    vehicles = stats.episodes['total_vehicles_passed']
+    phase_changes = stats.episodes['total_phase_changes']
+    efficiency = stats.episodes['efficiency_score']
+    num_episodes = rewards.count
     
     print("\n" + "="*60)
     print("DETAILED MODEL PERFORMANCE ANALYSIS")
     print("="*60)
     
-    print(f"\n[STATS] EPISODE-LEVEL STATISTICS ({len(episode_data)} episodes)")
+    print(f"\n[STATS] EPISODE-LEVEL STATISTICS ({num_episodes} episodes)")
     print("-" * 40)
-    print(f"Average Total Reward: {np.mean(total_rewards):.2f} ± {np.std(total_rewards):.2f}")
-    print(f"Best Episode Reward: {np.max(total_rewards):.2f}")
-    print(f"Worst Episode Reward: {np.min(total_rewards):.2f}")
+    print(f"Average Total Reward: {rewards.mean:.2f} ± {rewards.std:.2f}")
+    print(f"Best Episode Reward: {rewards.max:.2f}")
+    print(f"Worst Episode Reward: {rewards.min:.2f}")
     
     print(f"\n[TRAFFIC] TRAFFIC THROUGHPUT ANALYSIS")
     print("-" * 40)
-    print(f"Average Vehicles per Episode: {np.mean(vehicles_passed):.1f} ± {np.std(vehicles_passed):.1f}")
-    print(f"Best Episode Throughput: {np.max(vehicles_passed)} vehicles")
-    print(f"Average Vehicles per Step: {np.mean(step_data['vehicles_passed_per_step']):.2f}")
-    print(f"Peak Vehicles in Single Step: {np.max(step_data['vehicles_passed_per_step'])}")
+    print(f"Average Vehicles per Episode: {vehicles.mean:.1f} ± {vehicles.std:.1f}")
+    print(f"Best Episode Throughput: {vehicles.max:.0f} vehicles")
+    print(f"Average Vehicles per Step: {stats.vehicles.mean:.2f}")
+    print(f"Peak Vehicles in Single Step: {stats.vehicles.max:.0f}")
     
     print(f"\n[EFFICIENCY] EFFICIENCY METRICS")
     print("-" * 40)
-    print(f"Average Efficiency Score: {np.mean(efficiency_scores):.2f}%")
-    print(f"Best Efficiency Score: {np.max(efficiency_scores):.2f}%")
-    print(f"Efficiency Consistency (std): {np.std(efficiency_scores):.2f}%")
+    print(f"Average Efficiency Score: {efficiency.mean:.2f}%")
+    print(f"Best Efficiency Score: {efficiency.max:.2f}%")
+    print(f"Efficiency Consistency (std): {efficiency.std:.2f}%")
     
     print(f"\n[LIGHTS] PHASE CHANGE ANALYSIS")
     print("-" * 40)
-    print(f"Average Phase Changes per Episode: {np.mean(phase_changes):.1f}")
-    print(f"Phase Change Range: {np.min(phase_changes)} - {np.max(phase_changes)}")
-    phase_change_rate = np.sum(step_data['phase_changes']) / len(step_data['vehicles_passed_per_step']) * 100
+    print(f"Average Phase Changes per Episode: {phase_changes.mean:.1f}")
+    print(f"Phase Change Range: {phase_changes.min:.0f} - {phase_changes.max:.0f}")
+    phase_change_rate = stats.phase_switches / stats.vehicles.count * 100
     print(f"Phase Change Rate: {phase_change_rate:.1f}% of steps")
     
     print(f"\n[QUEUES] QUEUE MANAGEMENT")
     print("-" * 40)
-    print(f"Average Queue Length: {np.mean(step_data['queue_lengths']):.2f}")
-    print(f"Peak Queue Length: {np.max(step_data['queue_lengths'])}")
-    print(f"Queue Length Std Dev: {np.std(step_data['queue_lengths']):.2f}")
+    print(f"Average Queue Length: {stats.queues.mean:.2f}")
+    print(f"Peak Queue Length: {stats.queues.max:.0f}")
+    print(f"Queue Length Std Dev: {stats.queues.std:.2f}")
+    print(f"Queue Length Median / 95th Percentile: "
+          f"{stats.queue_histogram.quantile(0.5):.0f} / {stats.queue_histogram.quantile(0.95):.0f}")
     
     print(f"\n[TIME] WAIT TIME ANALYSIS")
     print("-" * 40)
-    print(f"Average Max Wait Time: {np.mean(step_data['wait_times']):.2f} steps")
-    print(f"Longest Wait Time: {np.max(step_data['wait_times'])} steps")
-    print(f"Wait Time Consistency: {np.std(step_data['wait_times']):.2f}")
+    print(f"Average Max Wait Time: {stats.waits.mean:.2f} steps")
+    print(f"Longest Wait Time: {stats.waits.max:.0f} steps")
+    print(f"Wait Time Consistency: {stats.waits.std:.2f}")
+    print(f"Max Wait Time Median / 95th Percentile: "
+          f"{stats.wait_histogram.quantile(0.5):.0f} / {stats.wait_histogram.quantile(0.95):.0f} steps")
     
     print(f"\n[REWARDS] REWARD ANALYSIS")
     print("-" * 40)
-    print(f"Average Reward per Step: {np.mean(step_data['rewards_per_step']):.2f}")
-    print(f"Reward Range: {np.min(step_data['rewards_per_step']):.2f} to {np.max(step_data['rewards_per_step']):.2f}")
-    print(f"Reward Volatility (std): {np.std(step_data['rewards_per_step']):.2f}")
+    print(f"Average Reward per Step: {stats.rewards.mean:.2f}")
+    print(f"Reward Range: {stats.rewards.min:.2f} to {stats.rewards.max:.2f}")
+    print(f"Reward Volatility (std): {stats.rewards.std:.2f}")
     
     # Reward components analysis (if available)
-    if step_data['reward_components']['throughput']:
+    if stats.components['throughput'].count:
         print(f"\n[COMPONENTS] REWARD COMPONENTS BREAKDOWN")
         print("-" * 40)
         
@@ -313,17 +580,17 @@ def print_detailed_statistics(episode_data, step_data):
             'balance_bonus': 'Balance Bonus'
         }
         
-        for component, values in step_data['reward_components'].items():
-            if values:
+        for component, values in stats.components.items():
+            if values.count:
                 display_name = component_display_names.get(component, component.replace('_', ' ').title())
-                print(f"{display_name:20}: {np.mean(values):8.3f} ± {np.std(values):6.3f} (range: {np.min(values):6.2f} to {np.max(values):6.2f})")
+                print(f"{display_name:20}: {values.mean:8.3f} ± {values.std:6.3f} (range: {values.min:6.2f} to {values.max:6.2f})")
     
     # Performance correlations
     print(f"\n[CORRELATION] PERFORMANCE CORRELATIONS")
     print("-" * 40)
-    vehicles_reward_corr = np.corrcoef(vehicles_passed, total_rewards)[0, 1]
-    efficiency_reward_corr = np.corrcoef(efficiency_scores, total_rewards)[0, 1]
-    phase_efficiency_corr = np.corrcoef(phase_changes, efficiency_scores)[0, 1]
+    vehicles_reward_corr = stats.correlations[('total_vehicles_passed', 'total_reward')].correlation
+    efficiency_reward_corr = stats.correlations[('efficiency_score', 'total_reward')].correlation
+    phase_efficiency_corr = stats.correlations[('total_phase_changes', 'efficiency_score')].correlation
     
     print(f"Vehicles <-> Reward correlation: {vehicles_reward_corr:.3f}")
     print(f"Efficiency <-> Reward correlation: {efficiency_reward_corr:.3f}")
@@ -332,13 +599,11 @@ def print_detailed_statistics(episode_data, step_data):
     # Performance classification
     print(f"\n[CLASSIFICATION] PERFORMANCE CLASSIFICATION")
     print("-" * 40)
-    excellent_episodes = sum(1 for r in total_rewards if r > np.mean(total_rewards) + np.std(total_rewards))
-    good_episodes = sum(1 for r in total_rewards if np.mean(total_rewards) <= r <= np.mean(total_rewards) + np.std(total_rewards))
-    poor_episodes = sum(1 for r in total_rewards if r < np.mean(total_rewards) - np.std(total_rewards))
+    excellent_episodes, good_episodes, poor_episodes = stats.classify_episodes()
     
-    print(f"Excellent episodes (>mean+std): {excellent_episodes}/{len(episode_data)} ({excellent_episodes/len(episode_data)*100:.1f}%)")
-    print(f"Good episodes (mean±std): {good_episodes}/{len(episode_data)} ({good_episodes/len(episode_data)*100:.1f}%)")
-    print(f"Poor episodes (<mean-std): {poor_episodes}/{len(episode_data)} ({poor_episodes/len(episode_data)*100:.1f}%)")
+    print(f"Excellent episodes (>mean+std): {excellent_episodes}/{num_episodes} ({excellent_episodes/num_episodes*100:.1f}%)")
+    print(f"Good episodes (mean±std): {good_episodes}/{num_episodes} ({good_episodes/num_episodes*100:.1f}%)")
+    print(f"Poor episodes (<mean-std): {poor_episodes}/{num_episodes} ({poor_episodes/num_episodes*100:.1f}%)")
 
 def analyze_evaluation_results():
     """Analyze the evaluation results from training"""
@@ -419,6 +684,21 @@ def analyze_evaluation_results():
         print(f"Error loading evaluation data: {e}")
 
 if __name__ == "__main__":
-    # Automatically run detailed model analysis without user input
-    print("Running detailed model performance analysis...")
-    detailed_model_analysis()
+    parser = argparse.ArgumentParser(description="Detailed analysis of a trained traffic light model")
+    parser.add_argument("--model", default="dqn_traffic_optimized.zip",
+                        help="Saved model, policy file or baseline controller (e.g. max_pressure), see policies.py")
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--batched", action="store_true", help="Run all episodes in lockstep in one VecTrafficEnv")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1, help="Evaluation processes (sequential mode)")
+    parser.add_argument("--record", default=None, help="Stream step data to a columnar recording in this directory")
+    parser.add_argument("--from-recording", default=None, help="Analyze an existing recording instead of simulating")
+    args = parser.parse_args()
+    
+    if args.from_recording:
+        analyze_recording(args.from_recording)
+    else:
+        # Automatically run detailed model analysis without user input
+        print("Running detailed model performance analysis...")
+        detailed_model_analysis(args.model, args.episodes, batched=args.batched, seed=args.seed,
+                                n_workers=args.workers, record_path=args.record)
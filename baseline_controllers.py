@@ -0,0 +1,182 @@
+import argparse
+import time
+
+import numpy as np
+
+
+class BaselineController:
+    """
+    Base class of the classical signal controllers
+
+    Controllers read TrafficEnv observations ([N, S, E, W] queues divided
+    by max_queue, then the current phase) and decide for a whole batch with
+    array operations. predict matches SB3's model.predict, so a controller
+    can stand in for a trained model in any evaluation loop; a single
+    observation gives a single action.
+
+    Controllers that need the time spent in the current phase keep one
+    counter per batch row. Call reset() at the start of an episode, or pass
+    episode_start like SB3 recurrent policies do for auto-resetting vector
+    envs. Rows must keep their order from call to call, so only the
+    stateless controllers (longest-queue, max-pressure) suit callers that
+    batch arbitrary requests, such as signal_service.
+    """
+
+    def __init__(self, max_queue=10):
+        self.max_queue = max_queue
+        self.elapsed = np.zeros(0, dtype=np.int64)  # steps since the phase last changed, per row
+
+    def reset(self):
+        self.elapsed = np.zeros(0, dtype=np.int64)
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        """Actions for one observation or a batch, in the (actions, state) form of model.predict"""
+        observation = np.asarray(observation, dtype=np.float32)
+        single = observation.ndim == 1
+        observation = observation.reshape(-1, 5)
+        if len(self.elapsed) != len(observation):
+            self.elapsed = np.zeros(len(observation), dtype=np.int64)
+        if episode_start is not None:
+            self.elapsed[np.asarray(episode_start, dtype=bool).reshape(-1)] = 0
+
+        queues = np.rint(observation[:, :4] * self.max_queue)
+        phase = (observation[:, 4] > 0.5).astype(np.int64)
+        actions = self.decide(queues, phase)
+        # The counters follow the decisions, so they are right whether or
+        # not the env starts each episode in phase 0
+        self.elapsed = np.where(actions == phase, self.elapsed + 1, 1)
+        return (np.array(actions[0]) if single else actions), None
+
+    def decide(self, queues, phase):
+        """
+        Args:
+            queues: (B, 4) vehicles per approach [N, S, E, W]
+            phase: (B,) current phase, 0 = NS green, 1 = EW green
+
+        Returns:
+            (B,) int64 phases to show next
+        """
+        raise NotImplementedError
+
+
+class FixedTimeController(BaselineController):
+    """
+    Fixed cycle: ns_green steps of NS green, then ew_green steps of EW green
+
+    Ignores the queues entirely. The cycle position of each row is the
+    time in its current phase, so a controller attached mid-episode picks
+    up the cycle from the phase the intersection is showing.
+    """
+
+    def __init__(self, ns_green=8, ew_green=8, max_queue=10):
+        super().__init__(max_queue)
+        self.green = np.array([ns_green, ew_green])
+
+    def decide(self, queues, phase):
+        expired = self.elapsed >= self.green[phase]
+        return np.where(expired, 1 - phase, phase)
+
+
+class ActuatedController(BaselineController):
+    """
+    Gap-actuated control between a minimum and a maximum green
+
+    After min_green steps the green ends as soon as the served approaches
+    run out of vehicles (queues <= gap, the "gap-out") while the other side
+    is waiting, and at max_green it ends regardless if the other side has
+    any demand ("max-out").
+    """
+
+    def __init__(self, min_green=3, max_green=15, gap=0, max_queue=10):
+        super().__init__(max_queue)
+        self.min_green = min_green
+        self.max_green = max_green
+        self.gap = gap
+
+    def decide(self, queues, phase):
+        ns = np.maximum(queues[:, 0], queues[:, 1])
+        ew = np.maximum(queues[:, 2], queues[:, 3])
+        served = np.where(phase == 0, ns, ew)
+        waiting = np.where(phase == 0, ew, ns)
+        gap_out = (self.elapsed >= self.min_green) & (served <= self.gap) & (waiting > 0)
+        max_out = (self.elapsed >= self.max_green) & (waiting > 0)
+        return np.where(gap_out | max_out, 1 - phase, phase)
+
+
+class LongestQueueController(BaselineController):
+    """Green for the phase serving the single longest queue; ties keep the current phase"""
+
+    def decide(self, queues, phase):
+        ns = np.maximum(queues[:, 0], queues[:, 1])
+        ew = np.maximum(queues[:, 2], queues[:, 3])
+        return np.where(ns > ew, 0, np.where(ew > ns, 1, phase))
+
+
+class MaxPressureController(BaselineController):
+    """
+    Max-pressure control: green for the phase with the largest pressure
+
+    A phase's pressure is the sum over the movements it serves of upstream
+    minus downstream queue. Vehicles leave an isolated TrafficEnv
+    intersection once served, so the downstream queues are zero and the
+    pressure is the total queue on each side. The phase only changes when
+    the other side leads by more than threshold vehicles (0 = pure max
+    pressure), which also keeps it from flapping on ties.
+    """
+
+    def __init__(self, threshold=0, max_queue=10):
+        super().__init__(max_queue)
+        self.threshold = threshold
+
+    def decide(self, queues, phase):
+        ns = queues[:, 0] + queues[:, 1]
+        ew = queues[:, 2] + queues[:, 3]
+        lead = np.where(phase == 0, ew - ns, ns - ew)  # pressure advantage of the other phase
+        return np.where(lead > self.threshold, 1 - phase, phase)
+
+
+CONTROLLERS = {
+    "fixed_time": FixedTimeController,
+    "actuated": ActuatedController,
+    "longest_queue": LongestQueueController,
+    "max_pressure": MaxPressureController,
+}
+
+
+def make_controller(spec):
+    """
+    Build a controller from a name with optional parameters
+
+    Args:
+        spec: "max_pressure", or with parameters "fixed_time:ns_green=10,ew_green=6"
+
+    Returns:
+        BaselineController
+    """
+    name, _, params = spec.partition(":")
+    if name not in CONTROLLERS:
+        raise ValueError(f"Unknown controller {name}; choose from {', '.join(CONTROLLERS)}")
+    kwargs = {}
+    for param in filter(None, params.split(",")):
+        key, _, value = param.partition("=")
+        kwargs[key.strip()] = float(value) if "." in value else int(value)
+    return CONTROLLERS[name](**kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decision rate of the baseline controllers")
+    parser.add_argument("--batch-size", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    observations = np.concatenate([rng.integers(0, 11, size=(args.batch_size, 4)) / 10,
+                                   rng.integers(0, 2, size=(args.batch_size, 1))], axis=1).astype(np.float32)
+    for name in CONTROLLERS:
+        controller = make_controller(name)
+        controller.predict(observations)
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            controller.predict(observations)
+        rate = args.batch_size * args.repeats / (time.perf_counter() - start)
+        print(f"{name:>14}: {rate / 1e6:.1f}M decisions/s")
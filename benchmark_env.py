@@ -0,0 +1,58 @@
+import argparse
+import time
+
+import numpy as np
+
+from traffic_env02 import TrafficEnv
+
+
+def run_steps(env, num_steps, seed=0, policy_seed=1):
+    """Step the env with a seeded random policy and return (trajectory, steps/sec)"""
+    actions = np.random.default_rng(policy_seed).integers(0, 2, size=num_steps)
+    trajectory = []
+    env.reset(seed=seed)
+
+    start = time.perf_counter()
+    for action in actions:
+        obs, reward, terminated, truncated, info = env.step(action)
+        trajectory.append((obs, reward))
+        if terminated or truncated:
+            env.reset()
+    elapsed = time.perf_counter() - start
+    return trajectory, num_steps / elapsed
+
+
+def benchmark_step_modes(num_steps=200_000, repeats=3):
+    """Compare TrafficEnv.step in the default and fast modes"""
+    results = {}
+    trajectories = {}
+    for fast in (False, True):
+        env = TrafficEnv(render_mode=None, fast=fast)
+        rates = []
+        for _ in range(repeats):
+            trajectory, rate = run_steps(env, num_steps)
+            rates.append(rate)
+        env.close()
+        results[fast] = max(rates)
+        trajectories[fast] = trajectory
+
+    identical = all(
+        np.array_equal(obs_a, obs_b) and reward_a == reward_b
+        for (obs_a, reward_a), (obs_b, reward_b) in zip(trajectories[False], trajectories[True])
+    )
+
+    print(f"Steps per run: {num_steps:,} (best of {repeats})")
+    print(f"  Default step: {results[False]:>12,.0f} steps/sec")
+    print(f"  Fast step:    {results[True]:>12,.0f} steps/sec")
+    print(f"  Speedup:      {results[True] / results[False]:.2f}x")
+    print(f"  Identical transitions and rewards: {identical}")
+    return results, identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark TrafficEnv.step")
+    parser.add_argument("--steps", type=int, default=200_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    benchmark_step_modes(args.steps, args.repeats)
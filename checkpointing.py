@@ -0,0 +1,199 @@
+import json
+import os
+import pickle
+import random
+
+import numpy as np
+import torch
+from stable_baselines3 import DQN
+from stable_baselines3.common.callbacks import BaseCallback
+
+CHECKPOINT_FILE = "checkpoint.json"
+MODEL_FILE = "model.zip"
+RNG_FILE = "rng_state.pkl"
+
+
+def _env_rngs(env):
+    """Per-env random generators of a VecEnv, or None if they can't be read"""
+    for attr_name in ("np_random", "rng"):
+        try:
+            return attr_name, env.get_attr(attr_name)
+        except AttributeError:
+            continue
+    return None, None
+
+
+def capture_rng_state(env=None):
+    """Python, NumPy, torch and env RNG states as one picklable dict"""
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "torch_cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+    if env is not None:
+        state["env_attr"], state["env"] = _env_rngs(env)
+    return state
+
+
+def restore_rng_state(state, env=None):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["torch_cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["torch_cuda"])
+    if env is not None and state.get("env") is not None and len(state["env"]) == env.num_envs:
+        for i, generator in enumerate(state["env"]):
+            env.set_attr(state["env_attr"], generator, indices=[i])
+
+
+def _atomic_write(path, write):
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_checkpoint(model, checkpoint_dir, **metadata):
+    """
+    Save everything needed to continue training where it stopped
+
+    The model archive holds the network, optimizer state, step counters and
+    exploration schedule. A memory-mapped replay buffer is flushed in place.
+    checkpoint.json is written last, so a checkpoint only counts once all of
+    its files are complete.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    model_path = os.path.join(checkpoint_dir, MODEL_FILE)
+    _atomic_write(model_path, model.save)
+
+    env = model.get_env()
+
+    def write_rng(path):
+        with open(path, "wb") as f:
+            pickle.dump(capture_rng_state(env), f)
+
+    _atomic_write(os.path.join(checkpoint_dir, RNG_FILE), write_rng)
+
+    replay_buffer = getattr(model, "replay_buffer", None)
+    if hasattr(replay_buffer, "flush"):
+        replay_buffer.flush()
+
+    info = {
+        "num_timesteps": model.num_timesteps,
+        "replay_buffer_kwargs": model.replay_buffer_kwargs if hasattr(replay_buffer, "flush") else None,
+        **metadata,
+    }
+
+    def write_info(path):
+        with open(path, "w") as f:
+            json.dump(info, f, indent=2)
+
+    _atomic_write(os.path.join(checkpoint_dir, CHECKPOINT_FILE), write_info)
+    return info
+
+
+def read_checkpoint(checkpoint_dir):
+    """Metadata of the checkpoint in checkpoint_dir, or None if there is none"""
+    path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_checkpoint(checkpoint_dir, env, **kwargs):
+    """
+    Rebuild a DQN from save_checkpoint's files, ready for learn(reset_num_timesteps=False)
+
+    A memory-mapped replay buffer is reopened with its saved contents, so
+    training continues without another learning_starts warm-up. Any other
+    buffer comes back empty and the warm-up is repeated from this point.
+
+    env is reset once to use up the seeds it was created with, then the
+    saved RNG states are restored and env is reset again, so training
+    resumes at the start of the episode an uninterrupted run would have
+    started next (the rest of the interrupted episode is skipped). learn()
+    keeps that reset as long as it is called with reset_num_timesteps=False.
+
+    Returns:
+        (model, metadata) where metadata is the saved checkpoint.json
+    """
+    info = read_checkpoint(checkpoint_dir)
+    if info is None:
+        raise FileNotFoundError(f"No checkpoint in {checkpoint_dir}")
+
+    if info["replay_buffer_kwargs"] is not None:
+        kwargs["replay_buffer_kwargs"] = {**info["replay_buffer_kwargs"], "resume": True}
+    model = DQN.load(os.path.join(checkpoint_dir, MODEL_FILE), env=env, **kwargs)
+    if info["replay_buffer_kwargs"] is None:
+        model.learning_starts += model.num_timesteps
+
+    # learn() would otherwise reset env itself, after the restore, and
+    # re-apply the seeds of make_env over the restored generators
+    env = model.get_env()
+    env.reset()
+    with open(os.path.join(checkpoint_dir, RNG_FILE), "rb") as f:
+        restore_rng_state(pickle.load(f), env)
+    model._last_obs = env.reset()
+    model._last_episode_starts = np.ones(env.num_envs, dtype=bool)
+    return model, info
+
+
+class TrainingCheckpointCallback(BaseCallback):
+    """
+    Periodically save a resumable checkpoint with save_checkpoint
+
+    Args:
+        checkpoint_dir: Directory holding the latest checkpoint
+        save_freq: Env steps between checkpoints
+        eval_callback: Optional EvalCallback whose best mean reward is kept
+                       in the checkpoint so a resumed run doesn't forget it
+    """
+
+    def __init__(self, checkpoint_dir, save_freq=50000, eval_callback=None, verbose=0):
+        super().__init__(verbose)
+        self.checkpoint_dir = checkpoint_dir
+        self.save_freq = save_freq
+        self.eval_callback = eval_callback
+
+    def _on_training_start(self):
+        self._last_save = self.num_timesteps
+
+    def _save(self):
+        metadata = {}
+        if self.eval_callback is not None:
+            metadata["best_mean_reward"] = float(self.eval_callback.best_mean_reward)
+        save_checkpoint(self.model, self.checkpoint_dir, **metadata)
+        self._last_save = self.num_timesteps
+        if self.verbose > 0:
+            print(f"Saved checkpoint at {self.num_timesteps:,} steps to {self.checkpoint_dir}")
+
+    def _on_step(self):
+        if self.num_timesteps - self._last_save >= self.save_freq:
+            self._save()
+        return True
+
+    def _on_training_end(self):
+        self._save()
+
+
+if __name__ == "__main__":
+    # Check that a resumed run draws the traffic an uninterrupted run would have drawn next
+    import tempfile
+
+    from train_dqn import build_model, make_env
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        env = make_env(seed=0)
+        model = build_model(env, seed=0, tensorboard_log=None, verbose=0, learning_starts=1000)
+        model.learn(total_timesteps=1300)  # stops in the middle of an episode
+        save_checkpoint(model, checkpoint_dir)
+        env.reset()  # where the uninterrupted run's next episode starts
+        expected = env.get_attr("_arrival_block")[0]
+
+        resumed, _ = load_checkpoint(checkpoint_dir, make_env(seed=0))
+        actual = resumed.get_env().get_attr("_arrival_block")[0]
+        resumed.learn(total_timesteps=100, reset_num_timesteps=False)
+        print(f"Resumed episode continues the RNG stream: {np.array_equal(expected, actual)}")
+        print(f"learn() kept the resumed episode: "
+              f"{np.array_equal(actual, resumed.get_env().get_attr('_arrival_block')[0])}")
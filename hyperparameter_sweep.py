@@ -0,0 +1,282 @@
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.evaluation import evaluate_policy
+
+from checkpointing import load_checkpoint, save_checkpoint
+from replay_buffers import MemmapReplayBuffer
+from train_dqn import DQN_PARAMS, build_model, make_env
+
+# Sampling distribution of every tuned DQN hyperparameter:
+# ("log_uniform", low, high), ("uniform", low, high) or ("choice", [values])
+SEARCH_SPACE = {
+    "learning_rate": ("log_uniform", 1e-4, 3e-3),
+    "buffer_size": ("choice", [25_000, 50_000, 100_000, 200_000]),
+    "batch_size": ("choice", [32, 64, 128, 256]),
+    "gamma": ("choice", [0.95, 0.97, 0.98, 0.99]),
+    "target_update_interval": ("choice", [500, 1000, 2000, 5000]),
+    "exploration_fraction": ("uniform", 0.1, 0.5),
+    "exploration_final_eps": ("uniform", 0.01, 0.1),
+}
+
+
+def sample_config(rng, space=SEARCH_SPACE):
+    """One hyperparameter configuration drawn from space, as JSON-friendly Python values"""
+    config = {}
+    for name, (kind, *params) in space.items():
+        if kind == "log_uniform":
+            config[name] = float(math.exp(rng.uniform(math.log(params[0]), math.log(params[1]))))
+        elif kind == "uniform":
+            config[name] = float(rng.uniform(params[0], params[1]))
+        elif kind == "choice":
+            config[name] = params[0][rng.integers(len(params[0]))]
+        else:
+            raise ValueError(f"Unknown distribution {kind} for {name}")
+    return config
+
+
+def rung_budgets(min_steps, max_steps, eta):
+    """Training steps at each successive-halving rung: min_steps * eta**k, capped by max_steps"""
+    budgets = []
+    budget = min_steps
+    while budget < max_steps:
+        budgets.append(int(budget))
+        budget *= eta
+    return budgets + [max_steps]
+
+
+class SweepStore:
+    """
+    SQLite results store of a sweep: one row per trial and one per evaluation
+
+    Only the parent process writes to it, so workers never contend for the
+    database file.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS trials (
+                trial_id INTEGER PRIMARY KEY,
+                config TEXT NOT NULL,
+                status TEXT NOT NULL,
+                steps INTEGER NOT NULL DEFAULT 0,
+                mean_reward REAL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                trial_id INTEGER NOT NULL,
+                rung INTEGER NOT NULL,
+                steps INTEGER NOT NULL,
+                mean_reward REAL NOT NULL,
+                std_reward REAL NOT NULL,
+                train_seconds REAL NOT NULL,
+                PRIMARY KEY (trial_id, rung)
+            );
+        """)
+
+    def add_trial(self, trial_id, config):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO trials (trial_id, config, status) VALUES (?, ?, ?)",
+                                    (trial_id, json.dumps(config), "running"))
+
+    def add_result(self, rung, result):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                                    (result["trial_id"], rung, result["steps"], result["mean_reward"],
+                                     result["std_reward"], result["train_seconds"]))
+            self.connection.execute("UPDATE trials SET steps = ?, mean_reward = ? WHERE trial_id = ?",
+                                    (result["steps"], result["mean_reward"], result["trial_id"]))
+
+    def set_status(self, trial_ids, status):
+        with self.connection:
+            self.connection.executemany("UPDATE trials SET status = ? WHERE trial_id = ?",
+                                        [(status, trial_id) for trial_id in trial_ids])
+
+    def leaderboard(self, limit=10):
+        """Trials by their latest eval reward, furthest-trained first"""
+        rows = self.connection.execute(
+            "SELECT trial_id, status, steps, mean_reward, config FROM trials "
+            "ORDER BY steps DESC, mean_reward DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [{"trial_id": trial_id, "status": status, "steps": steps, "mean_reward": mean_reward,
+                 "config": json.loads(config)} for trial_id, status, steps, mean_reward, config in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+class _StopAtSteps(BaseCallback):
+    """Stop learn() once the model has taken max_steps env steps in total"""
+
+    def __init__(self, max_steps):
+        super().__init__()
+        self.max_steps = max_steps
+
+    def _on_step(self):
+        return self.num_timesteps < self.max_steps
+
+
+def _init_worker(cores_per_trial, slots):
+    """Pin each pool worker to its own block of cores_per_trial cores"""
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        first = slot * cores_per_trial % len(cores)
+        os.sched_setaffinity(0, [cores[(first + i) % len(cores)] for i in range(cores_per_trial)])
+    import torch
+    torch.set_num_threads(cores_per_trial)
+
+
+def _run_segment(task):
+    """
+    Train one trial up to the rung budget and evaluate it
+
+    The first segment builds the model, later ones continue from the
+    trial's checkpoint (weights, optimizer, replay buffer and step count).
+    learn() is always given the trial's full max_steps horizon and stopped
+    at the rung budget, so the exploration schedule of a promoted trial is
+    the one a single uninterrupted run of max_steps would have.
+    """
+    trial_dir = task["trial_dir"]
+    env = make_env("dummy", task["n_envs"], seed=task["seed"])
+    eval_env = make_env("dummy", 1, seed=task["eval_seed"])
+    start = time.perf_counter()
+    try:
+        if task["rung"] == 0:
+            model = build_model(env, seed=task["seed"], tensorboard_log=None, verbose=0, device="cpu",
+                                replay_buffer_class=MemmapReplayBuffer,
+                                replay_buffer_kwargs=dict(path=os.path.join(trial_dir, "replay_buffer")),
+                                **{**task["fixed"], **task["config"]})
+        else:
+            model, _ = load_checkpoint(trial_dir, env, device="cpu", verbose=0)
+        model.learn(total_timesteps=task["max_steps"] - model.num_timesteps, callback=_StopAtSteps(task["budget"]),
+                    reset_num_timesteps=task["rung"] == 0)
+        train_seconds = time.perf_counter() - start
+        # Every trial is evaluated on the same seeded episodes, so rewards
+        # differ by the policies rather than by the traffic they met
+        mean_reward, std_reward = evaluate_policy(model, eval_env, n_eval_episodes=task["n_eval_episodes"],
+                                                  deterministic=True)
+        save_checkpoint(model, trial_dir, trial_id=task["trial_id"], config=task["config"])
+        return {"trial_id": task["trial_id"], "steps": int(model.num_timesteps), "mean_reward": float(mean_reward),
+                "std_reward": float(std_reward), "train_seconds": train_seconds}
+    finally:
+        env.close()
+        eval_env.close()
+
+
+def run_sweep(sweep_dir, n_trials=27, min_steps=25_000, max_steps=500_000, eta=3, n_workers=None,
+              cores_per_trial=1, n_envs=1, n_eval_episodes=5, seed=0, eval_seed=10_000, fixed=None,
+              include_default=True, verbose=True):
+    """
+    Successive-halving hyperparameter sweep over SEARCH_SPACE
+
+    All trials train for min_steps and are evaluated; the best 1/eta are
+    promoted and continue from their checkpoints to eta times as many
+    steps, and so on until the survivors reach max_steps. Each rung costs
+    about n_trials * min_steps steps, so the whole sweep costs about as
+    much as (number of rungs) * n_trials * min_steps / max_steps full runs.
+    Trials of a rung run in parallel on a process pool whose workers are
+    pinned to cores_per_trial cores each. Stopped trials keep their model
+    and results but lose their replay buffer files.
+
+    Args:
+        sweep_dir: Directory of the results store (results.sqlite) and the
+                   per-trial checkpoints
+        n_trials: Sampled configurations
+        min_steps: Steps of the first rung
+        max_steps: Steps of a trial that survives every rung
+        eta: Promotion ratio between rungs
+        n_workers: Trials trained at once (default: cores // cores_per_trial)
+        cores_per_trial: Cores (and torch threads) per worker
+        n_envs: Training envs per trial
+        n_eval_episodes: Evaluation episodes per check
+        seed: Seed of the sampler; trial i trains with seed + i
+        eval_seed: Seed of the evaluation env, shared by all trials
+        fixed: DQN parameters applied to every trial, e.g. learning_starts
+        include_default: Make trial 0 the current DQN_PARAMS configuration
+
+    Returns:
+        SweepStore.leaderboard() of the finished sweep
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    budgets = rung_budgets(min_steps, max_steps, eta)
+    store = SweepStore(os.path.join(sweep_dir, "results.sqlite"))
+    rng = np.random.default_rng(seed)
+    configs = [sample_config(rng) for _ in range(n_trials)]
+    if include_default and configs:
+        configs[0] = {name: DQN_PARAMS[name] for name in SEARCH_SPACE}
+    for trial_id, config in enumerate(configs):
+        store.add_trial(trial_id, config)
+    if n_workers is None:
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        n_workers = max(1, cores // cores_per_trial)
+
+    start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+    ctx = mp.get_context(start_method)
+    alive = list(range(n_trials))
+    try:
+        with ctx.Pool(min(n_workers, n_trials), initializer=_init_worker,
+                      initargs=(cores_per_trial, ctx.Value("i", 0))) as pool:
+            for rung, budget in enumerate(budgets):
+                tasks = [{
+                    "trial_id": trial_id, "config": configs[trial_id], "fixed": fixed or {}, "rung": rung,
+                    "budget": budget, "max_steps": max_steps,
+                    "trial_dir": os.path.join(sweep_dir, f"trial_{trial_id:04d}"), "seed": seed + trial_id,
+                    "eval_seed": eval_seed, "n_envs": n_envs, "n_eval_episodes": n_eval_episodes,
+                } for trial_id in alive]
+                rewards = {}
+                for result in pool.imap_unordered(_run_segment, tasks):
+                    store.add_result(rung, result)
+                    rewards[result["trial_id"]] = result["mean_reward"]
+                    if verbose:
+                        print(f"[rung {rung}, {budget:,} steps] trial {result['trial_id']}: "
+                              f"reward {result['mean_reward']:.2f} ({result['train_seconds']:.0f}s)")
+                if rung == len(budgets) - 1:
+                    store.set_status(alive, "completed")
+                    break
+                ranked = sorted(alive, key=lambda trial_id: rewards[trial_id], reverse=True)
+                alive, stopped = ranked[:max(1, len(alive) // eta)], ranked[max(1, len(alive) // eta):]
+                store.set_status(stopped, "stopped")
+                for trial_id in stopped:
+                    shutil.rmtree(os.path.join(sweep_dir, f"trial_{trial_id:04d}", "replay_buffer"),
+                                  ignore_errors=True)
+                if verbose:
+                    print(f"Rung {rung} done: promoting trials {sorted(alive)}")
+        return store.leaderboard()
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Successive-halving DQN hyperparameter sweep")
+    parser.add_argument("--sweep-dir", default="./sweeps/sweep/")
+    parser.add_argument("--trials", type=int, default=27)
+    parser.add_argument("--min-steps", type=int, default=25_000)
+    parser.add_argument("--max-steps", type=int, default=500_000)
+    parser.add_argument("--eta", type=int, default=3, help="Keep the best 1/eta trials at every rung")
+    parser.add_argument("--workers", type=int, default=None, help="Trials trained at once")
+    parser.add_argument("--cores-per-trial", type=int, default=1)
+    parser.add_argument("--n-envs", type=int, default=1)
+    parser.add_argument("--n-eval-episodes", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--learning-starts", type=int, default=None,
+                        help="Override learning_starts for every trial (should be below --min-steps)")
+    args = parser.parse_args()
+
+    fixed = {} if args.learning_starts is None else {"learning_starts": args.learning_starts}
+    leaderboard = run_sweep(args.sweep_dir, args.trials, args.min_steps, args.max_steps, args.eta, args.workers,
+                            args.cores_per_trial, args.n_envs, args.n_eval_episodes, args.seed, fixed=fixed)
+    print("\nBest trials:")
+    for trial in leaderboard:
+        print(f"  trial {trial['trial_id']:>4} {trial['status']:>9} {trial['steps']:>9,} steps  "
+              f"reward {trial['mean_reward']:10.2f}  {trial['config']}")
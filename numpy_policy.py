@@ -0,0 +1,123 @@
+import argparse
+import time
+
+import numpy as np
+
+# Activations of the exported MLP, by the name of the torch module they replace
+ACTIVATIONS = {
+    "ReLU": lambda x: np.maximum(x, 0, out=x),
+    "Tanh": lambda x: np.tanh(x, out=x),
+    "Identity": lambda x: x,
+}
+
+
+def export_q_network(model, path):
+    """
+    Write the Q-network weights of a trained SB3 DQN to a NumPy .npz file
+
+    Only Linear layers and the activations in ACTIVATIONS are supported,
+    which covers SB3's MlpPolicy with any net_arch. Layer i is stored as
+    weight_i (out, in), bias_i and the name of the activation after it.
+
+    Args:
+        model: Trained DQN, or the path of a saved one
+        path: Output .npz file
+    """
+    from torch import nn
+
+    if isinstance(model, str):
+        from stable_baselines3 import DQN
+        model = DQN.load(model, device="cpu")
+
+    arrays = {}
+    activations = []
+    for module in model.policy.q_net.q_net:
+        if isinstance(module, nn.Linear):
+            i = len(activations)
+            arrays[f"weight_{i}"] = module.weight.detach().cpu().numpy().astype(np.float32)
+            arrays[f"bias_{i}"] = module.bias.detach().cpu().numpy().astype(np.float32)
+            activations.append("Identity")
+        elif type(module).__name__ in ACTIVATIONS and activations:
+            activations[-1] = type(module).__name__
+        else:
+            raise ValueError(f"Unsupported Q-network layer: {module}")
+    np.savez(path, activations=np.array(activations), **arrays)
+
+
+class NumpyQPolicy:
+    """
+    Greedy policy of an exported DQN Q-network, evaluated with NumPy only
+
+    The forward pass is the same chain of float32 matrix products as the
+    torch network, so Q-values agree to float32 rounding and predict
+    returns the same argmax as model.predict(obs, deterministic=True).
+    """
+
+    def __init__(self, weights, biases, activations):
+        # Transposed once so the forward pass is obs @ weight + bias
+        self.weights = [np.ascontiguousarray(w.T) for w in weights]
+        self.biases = list(biases)
+        self.activations = [ACTIVATIONS[name] for name in activations]
+
+    @property
+    def obs_dim(self):
+        return self.weights[0].shape[0]
+
+    def q_values(self, observation):
+        """Q-values of one observation (n_actions,) or a batch (batch, n_actions)"""
+        x = np.asarray(observation, dtype=np.float32)
+        single = x.ndim == 1
+        x = x.reshape(-1, self.obs_dim)
+        for weight, bias, activation in zip(self.weights, self.biases, self.activations):
+            x = activation(x @ weight + bias)
+        return x[0] if single else x
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        """Greedy actions in the (actions, state) form of model.predict"""
+        return np.argmax(self.q_values(observation), axis=-1), None
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        activations = [str(name) for name in data["activations"]]
+        weights = [data[f"weight_{i}"] for i in range(len(activations))]
+        biases = [data[f"bias_{i}"] for i in range(len(activations))]
+        return cls(weights, biases, activations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained DQN to a NumPy-only policy")
+    parser.add_argument("model", nargs="?", default="dqn_traffic_optimized")
+    parser.add_argument("-o", "--output", default="dqn_weights.npz")
+    parser.add_argument("--samples", type=int, default=100000, help="Random observations to check")
+    args = parser.parse_args()
+
+    from stable_baselines3 import DQN
+    import torch
+
+    model = DQN.load(args.model, device="cpu")
+    export_q_network(model, args.output)
+    policy = NumpyQPolicy.load(args.output)
+    print(f"Exported {len(policy.weights)} layers to {args.output}")
+
+    # Compare with the torch network on random observations in the observation space
+    rng = np.random.default_rng(0)
+    observations = rng.random((args.samples, policy.obs_dim), dtype=np.float32)
+    with torch.no_grad():
+        expected_q = model.policy.q_net(torch.as_tensor(observations)).numpy()
+    q_values = policy.q_values(observations)
+    expected, _ = model.predict(observations, deterministic=True)
+    actions, _ = policy.predict(observations)
+    print(f"Max |Q difference|: {np.max(np.abs(q_values - expected_q)):.2e}")
+    print(f"Action agreement: {np.sum(actions == expected):,}/{len(actions):,}")
+
+    samples = observations[:2000]
+    start = time.perf_counter()
+    for obs in samples:
+        model.predict(obs, deterministic=True)
+    model_time = (time.perf_counter() - start) / len(samples)
+    start = time.perf_counter()
+    for obs in samples:
+        policy.predict(obs)
+    numpy_time = (time.perf_counter() - start) / len(samples)
+    print(f"Per-decision latency: model.predict {model_time * 1e6:.1f} us, NumPy {numpy_time * 1e6:.1f} us")
@@ -0,0 +1,31 @@
+import numpy as np
+
+
+def encode_observations(obs, max_queue=10):
+    """
+    Pack normalized TrafficEnv observations into integer state indices
+
+    The four queue lengths (0..max_queue) are read as base max_queue + 1
+    digits and the phase bit is the lowest digit, so every observation maps
+    to one index in range(num_observations(max_queue)).
+    """
+    obs = np.asarray(obs, dtype=np.float32)
+    base = max_queue + 1
+    levels = np.clip(np.rint(obs[..., :4] * max_queue), 0, max_queue).astype(np.int64)
+    queue_index = ((levels[..., 0] * base + levels[..., 1]) * base + levels[..., 2]) * base + levels[..., 3]
+    return queue_index * 2 + (obs[..., 4] > 0.5)
+
+
+def num_observations(max_queue=10):
+    """Number of distinct TrafficEnv observations"""
+    return (max_queue + 1)**4 * 2
+
+
+def observation_table(max_queue=10):
+    """All distinct TrafficEnv observations as a float32 array, row i has index i"""
+    index = np.arange(num_observations(max_queue))
+    levels = np.stack(np.unravel_index(index // 2, (max_queue + 1,) * 4), axis=1)
+    table = np.empty((len(index), 5), dtype=np.float32)
+    table[:, :4] = levels / max_queue
+    table[:, 4] = index % 2
+    return table
@@ -0,0 +1,310 @@
+import bisect
+import math
+
+import numpy as np
+
+
+class RunningStats:
+    """
+    Count, mean, variance and extrema of a stream in O(1) memory
+
+    Uses Welford's update for single values and Chan et al.'s pairwise
+    merge for batches, so feeding values one at a time, in arrays or from
+    several merged accumulators gives the same moments up to rounding.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def update_batch(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        batch = RunningStats()
+        batch.count = len(values)
+        batch.mean = float(values.mean())
+        batch.m2 = float(np.sum((values - batch.mean)**2))
+        batch.total = float(values.sum())
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        self.merge(batch)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        """Population variance, as np.var"""
+        return self.m2 / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count else math.nan
+
+
+class RunningCovariance:
+    """Streaming covariance and Pearson correlation of paired values"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+    def update(self, x, y):
+        x, y = float(x), float(y)
+        self.count += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.count
+        self.mean_y += dy / self.count
+        self.c_xy += dx * (y - self.mean_y)
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        dx = other.mean_x - self.mean_x
+        dy = other.mean_y - self.mean_y
+        weight = self.count * other.count / count
+        self.c_xy += other.c_xy + dx * dy * weight
+        self.m2_x += other.m2_x + dx * dx * weight
+        self.m2_y += other.m2_y + dy * dy * weight
+        self.mean_x += dx * other.count / count
+        self.mean_y += dy * other.count / count
+        self.count = count
+
+    @property
+    def covariance(self):
+        return self.c_xy / self.count if self.count else math.nan
+
+    @property
+    def correlation(self):
+        """Pearson correlation, as np.corrcoef(x, y)[0, 1]; nan if either side is constant"""
+        denominator = math.sqrt(self.m2_x * self.m2_y)
+        return self.c_xy / denominator if denominator > 0 else math.nan
+
+
+class Histogram:
+    """
+    Fixed-width histogram over [low, high) with under/overflow counts
+
+    With unit-width bins over small integer data (queue lengths, vehicles
+    per step) the counts are exact, and so are the quantiles.
+    """
+
+    def __init__(self, low, high, num_bins=None):
+        self.low = low
+        self.high = high
+        self.num_bins = int(high - low) if num_bins is None else num_bins
+        self.width = (high - low) / self.num_bins
+        self.counts = np.zeros(self.num_bins + 2, dtype=np.int64)  # [underflow, bins..., overflow]
+
+    def _bins(self, values):
+        index = np.floor((np.asarray(values, dtype=np.float64) - self.low) / self.width).astype(np.int64) + 1
+        return np.clip(index, 0, self.num_bins + 1)
+
+    def update(self, value):
+        self.counts[self._bins(value)] += 1
+
+    def update_batch(self, values):
+        self.counts += np.bincount(self._bins(values).ravel(), minlength=len(self.counts))
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    @property
+    def edges(self):
+        return self.low + self.width * np.arange(self.num_bins + 1)
+
+    def quantile(self, q):
+        """Lower edge of the bin holding quantile q (the value itself for unit integer bins)"""
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank, side="right"))
+        if index == 0:
+            return -math.inf
+        if index > self.num_bins:
+            return math.inf
+        return self.low + self.width * (index - 1)
+
+
+class StreamingHistogram:
+    """
+    Quantile sketch with a bounded number of centroids (Ben-Haim & Tom-Tov)
+
+    Every value becomes a (value, count) centroid; once there are more than
+    max_bins, the two closest centroids are merged. Up to max_bins distinct
+    values the sketch is exact; beyond that counts and quantiles are
+    interpolated between centroids.
+    """
+
+    def __init__(self, max_bins=1024):
+        self.max_bins = max_bins
+        self.values = []
+        self.counts = []
+        self.count = 0
+        self.exact = True  # False once centroids have been merged
+
+    def update(self, value, count=1):
+        value = float(value)
+        self.count += count
+        i = bisect.bisect_left(self.values, value)
+        if i < len(self.values) and self.values[i] == value:
+            self.counts[i] += count
+            return
+        self.values.insert(i, value)
+        self.counts.insert(i, count)
+        if len(self.values) > self.max_bins:
+            self._merge_closest()
+
+    def _merge_closest(self):
+        gaps = np.diff(self.values)
+        i = int(np.argmin(gaps))
+        count = self.counts[i] + self.counts[i + 1]
+        value = (self.values[i] * self.counts[i] + self.values[i + 1] * self.counts[i + 1]) / count
+        self.values[i:i + 2] = [value]
+        self.counts[i:i + 2] = [count]
+        self.exact = False
+
+    def merge(self, other):
+        for value, count in zip(other.values, other.counts):
+            self.update(value, count)
+        self.exact = self.exact and other.exact
+
+    def count_below(self, x, inclusive=False):
+        """Number of values < x (or <= x), exact while the sketch is exact"""
+        i = bisect.bisect_right(self.values, x) if inclusive else bisect.bisect_left(self.values, x)
+        return sum(self.counts[:i])
+
+    def quantile(self, q):
+        """Value at quantile q, interpolated between centroids"""
+        if self.count == 0:
+            return math.nan
+        cumulative = np.cumsum(self.counts) - np.asarray(self.counts) / 2
+        return float(np.interp(q * self.count, cumulative, self.values))
+
+
+class EvaluationStats:
+    """
+    Streaming statistics of TrafficEnv evaluation runs
+
+    Feed it episodes (add_episode) and steps (add_steps, one call per
+    episode or per batch of steps) as they are produced; everything the
+    analysis report needs is kept in accumulators, so memory does not grow
+    with the number of steps. Accumulators from several processes can be
+    combined with merge.
+    """
+
+    EPISODE_FIELDS = ["total_reward", "total_vehicles_passed", "total_phase_changes", "efficiency_score",
+                      "max_queue", "max_wait"]
+    CORRELATIONS = [("total_vehicles_passed", "total_reward"), ("efficiency_score", "total_reward"),
+                    ("total_phase_changes", "efficiency_score")]
+
+    def __init__(self, components=(), max_total_queue=40, max_bins=1024):
+        self.episodes = {name: RunningStats() for name in self.EPISODE_FIELDS}
+        self.correlations = {pair: RunningCovariance() for pair in self.CORRELATIONS}
+        self.episode_rewards = StreamingHistogram(max_bins)
+        self.vehicles = RunningStats()
+        self.rewards = RunningStats()
+        self.queues = RunningStats()
+        self.waits = RunningStats()
+        self.phase_switches = 0
+        self.components = {component: RunningStats() for component in components}
+        self.vehicles_histogram = Histogram(0, 64)
+        self.queue_histogram = Histogram(0, max_total_queue + 1)
+        self.wait_histogram = Histogram(0, 1024)
+
+    def add_episode(self, **metrics):
+        for name, stats in self.episodes.items():
+            stats.update(metrics[name])
+        for (x, y), covariance in self.correlations.items():
+            covariance.update(metrics[x], metrics[y])
+        self.episode_rewards.update(metrics["total_reward"])
+
+    def add_steps(self, vehicles_passed, rewards, queues, waits, phase_switches=0, components=None):
+        """
+        Args:
+            vehicles_passed, rewards, queues, waits: Per-step values
+            phase_switches: Number of steps whose action differs from the
+                            previous step of the same episode
+            components: Optional mapping of reward component to per-step values
+        """
+        self.vehicles.update_batch(vehicles_passed)
+        self.rewards.update_batch(rewards)
+        self.queues.update_batch(queues)
+        self.waits.update_batch(waits)
+        self.phase_switches += int(phase_switches)
+        self.vehicles_histogram.update_batch(vehicles_passed)
+        self.queue_histogram.update_batch(queues)
+        self.wait_histogram.update_batch(waits)
+        for component, values in (components or {}).items():
+            if component in self.components:
+                self.components[component].update_batch(values)
+
+    def merge(self, other):
+        for name, stats in self.episodes.items():
+            stats.merge(other.episodes[name])
+        for pair, covariance in self.correlations.items():
+            covariance.merge(other.correlations[pair])
+        self.episode_rewards.merge(other.episode_rewards)
+        for name in ("vehicles", "rewards", "queues", "waits"):
+            getattr(self, name).merge(getattr(other, name))
+        self.phase_switches += other.phase_switches
+        for component, stats in self.components.items():
+            stats.merge(other.components[component])
+        self.vehicles_histogram.merge(other.vehicles_histogram)
+        self.queue_histogram.merge(other.queue_histogram)
+        self.wait_histogram.merge(other.wait_histogram)
+
+    def classify_episodes(self):
+        """
+        Episodes above mean + std, within [mean, mean + std] and below mean - std
+
+        Returns:
+            (excellent, good, poor) counts, exact while the episode reward
+            sketch is exact (up to max_bins distinct rewards)
+        """
+        rewards = self.episodes["total_reward"]
+        upper = rewards.mean + rewards.std
+        lower = rewards.mean - rewards.std
+        sketch = self.episode_rewards
+        excellent = sketch.count - sketch.count_below(upper, inclusive=True)
+        good = sketch.count_below(upper, inclusive=True) - sketch.count_below(rewards.mean)
+        poor = sketch.count_below(lower)
+        return excellent, good, poor
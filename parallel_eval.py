@@ -0,0 +1,71 @@
+import multiprocessing as mp
+
+from policies import load_policy
+
+# Per-worker model and env, created once by _init_worker
+_model = None
+_env = None
+
+
+def _load(model_path, make_env, env_args):
+    return load_policy(model_path, device="cpu"), make_env(*env_args)
+
+
+def _init_worker(model_path, make_env, env_args, torch_threads):
+    global _model, _env
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass  # NumPy-only policies don't need torch
+    _model, _env = _load(model_path, make_env, env_args)
+
+
+def _run_task(job):
+    episode_fn, task = job
+    return episode_fn(_model, _env, *task)
+
+
+def imap_episodes(episode_fn, model_path, tasks, make_env, env_args=(), n_workers=1, torch_threads=1,
+                  start_method=None):
+    """
+    Run episode_fn(model, env, *task) for every task, sharded over a process pool
+
+    Each worker loads the model and builds its env once, then runs its
+    share of the tasks. Results are yielded in task order as they become
+    available, whatever the worker count, so as long as every task seeds
+    its own episode the merged results are identical for any n_workers.
+
+    Args:
+        episode_fn: Module-level function (model, env, *task) -> result
+        model_path: Saved DQN, or any policy file policies.load_policy accepts,
+                    loaded in every worker
+        tasks: Argument tuples, one per episode
+        make_env: Module-level env factory, called as make_env(*env_args)
+        n_workers: Worker processes; 1 runs everything in this process
+        torch_threads: Torch threads per worker
+        start_method: multiprocessing start method, forkserver by default
+    """
+    tasks = list(tasks)
+    if n_workers <= 1:
+        model, env = _load(model_path, make_env, env_args)
+        try:
+            for task in tasks:
+                yield episode_fn(model, env, *task)
+        finally:
+            env.close()
+        return
+
+    if start_method is None:
+        start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+    ctx = mp.get_context(start_method)
+    n_workers = min(n_workers, len(tasks))
+    chunksize = max(1, len(tasks) // (4 * n_workers))
+    with ctx.Pool(n_workers, initializer=_init_worker,
+                  initargs=(model_path, make_env, env_args, torch_threads)) as pool:
+        yield from pool.imap(_run_task, [(episode_fn, task) for task in tasks], chunksize=chunksize)
+
+
+def map_episodes(*args, **kwargs):
+    """imap_episodes collected into a list"""
+    return list(imap_episodes(*args, **kwargs))
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+
+
+def load_policy(spec, device="cpu"):
+    """
+    Load any deployable traffic light policy from a file, or a baseline controller
+
+    Args:
+        spec: A saved SB3 DQN (.zip, extension optional), a policy table
+              from policy_table.py, a weight file from numpy_policy.py or
+              a baseline controller name, optionally with parameters
+              (see baseline_controllers.make_controller)
+        device: Torch device for SB3 models
+
+    Returns:
+        An object with predict(obs, deterministic=True) -> (actions, state)
+        that accepts single observations and batches. Stateful policies
+        also have reset(), see reset_policy
+    """
+    from baseline_controllers import CONTROLLERS, make_controller
+    if spec.partition(":")[0] in CONTROLLERS:
+        return make_controller(spec)
+
+    if spec.endswith(".npz"):
+        with np.load(spec) as data:
+            keys = set(data.files)
+        if "actions" in keys:
+            from policy_table import PolicyTable
+            return PolicyTable.load(spec)
+        if "weight_0" in keys:
+            from numpy_policy import NumpyQPolicy
+            return NumpyQPolicy.load(spec)
+        raise ValueError(f"{spec} is neither a policy table nor exported Q-network weights")
+
+    if spec.endswith(".zip") or os.path.exists(spec + ".zip"):
+        from stable_baselines3 import DQN
+        return DQN.load(spec, device=device)
+    raise ValueError(f"Unknown policy: {spec}")
+
+
+def reset_policy(policy):
+    """Start a new episode for policies that keep per-episode state (baseline controllers)"""
+    reset = getattr(policy, "reset", None)
+    if callable(reset):
+        reset()
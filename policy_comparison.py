@@ -0,0 +1,199 @@
+import argparse
+import math
+
+import gymnasium as gym
+from scipy import stats as scipy_stats
+
+from online_stats import RunningStats
+from parallel_eval import imap_episodes
+from policies import reset_policy
+
+gym.register(
+    id="TrafficEnv-v1",
+    entry_point="traffic_env02:TrafficEnv",
+    max_episode_steps=200,
+)
+
+METRICS = ["total_reward", "vehicles_passed", "mean_queue", "max_wait"]
+
+
+def make_comparison_env(max_steps):
+    """
+    TrafficEnv whose whole episode of random draws is fixed by the reset seed
+
+    With rng_block_size = max_steps every arrival and discharge offset of
+    the episode is drawn at reset, before the policy acts, so all policies
+    run on the same seed see exactly the same traffic (common random
+    numbers).
+    """
+    return gym.make("TrafficEnv-v1", render_mode=None, max_steps=max_steps, max_episode_steps=max_steps,
+                    fast=True, rng_block_size=max_steps)
+
+
+def run_comparison_episode(model, env, seed, max_steps):
+    """One seeded episode; returns the METRICS of the episode"""
+    obs, _ = env.reset(seed=seed)
+    reset_policy(model)
+    total_reward = 0.0
+    vehicles = 0
+    queue_total = 0
+    max_wait = 0
+    steps = 0
+    done = False
+    while not done and steps < max_steps:
+        action, _ = model.predict(obs, deterministic=True)
+        obs, reward, terminated, truncated, info = env.step(action)
+        total_reward += reward
+        vehicles += info["vehicles_passed"]
+        queue_total += info["total_queues"]
+        max_wait = max(max_wait, info["max_wait_time"])
+        steps += 1
+        done = terminated or truncated
+    return {
+        "total_reward": float(total_reward),
+        "vehicles_passed": int(vehicles),
+        "mean_queue": queue_total / max(steps, 1),
+        "max_wait": int(max_wait),
+    }
+
+
+def paired_interval(differences, confidence):
+    """Mean and t confidence interval (low, high) of paired differences in a RunningStats"""
+    n = differences.count
+    if n < 2:
+        return differences.mean, -math.inf, math.inf
+    sample_std = math.sqrt(differences.m2 / (n - 1))
+    half_width = scipy_stats.t.ppf(0.5 + confidence / 2, n - 1) * sample_std / math.sqrt(n)
+    return differences.mean, differences.mean - half_width, differences.mean + half_width
+
+
+def compare_policies(policy_specs, baseline=0, metric="total_reward", episode_length=200, max_episodes=2000,
+                     min_episodes=20, batch_size=20, confidence=0.95, tolerance=0.0, seed=0, n_workers=1,
+                     verbose=True):
+    """
+    Compare policies on common random numbers, stopping once the result is decisive
+
+    Every policy runs the same seeded episodes (see make_comparison_env),
+    so per seed the policies differ only by their decisions. The statistic
+    is the paired difference policy - baseline per episode; traffic
+    variation cancels out of it, which makes its variance, and so the
+    number of episodes needed, far smaller than for independent runs (the
+    reported variance_reduction is var(a) + var(b) over var(a - b)).
+
+    Episodes are run in batches of batch_size seeds. After each batch
+    (from min_episodes on) the comparison stops when, for every policy,
+    the t confidence interval of the mean difference excludes zero, or
+    lies within +-tolerance (practically equivalent). Looking repeatedly
+    makes the stated confidence slightly optimistic; min_episodes and a
+    higher confidence level keep that small.
+
+    Args:
+        policy_specs: Policies in the form policies.load_policy accepts
+        baseline: Index of the policy the others are compared against
+        metric: One of METRICS
+        episode_length: Steps per episode
+        max_episodes: Upper bound on seeds per policy
+        min_episodes: Seeds before the first stopping check
+        batch_size: Seeds between stopping checks
+        confidence: Confidence level of the intervals
+        tolerance: Differences within +-tolerance count as equivalent
+        seed: First episode seed
+        n_workers: Evaluation processes per policy (see parallel_eval)
+
+    Returns:
+        Dict with "episodes", "decisive" and per policy "results": mean,
+        std, and for the non-baseline policies the mean difference, its
+        interval, "verdict" ("better"/"worse"/"equivalent"/"undecided"
+        for a higher-is-better reading of the difference) and
+        variance_reduction
+    """
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {METRICS}")
+    values = [RunningStats() for _ in policy_specs]
+    differences = [RunningStats() for _ in policy_specs]
+    episodes = 0
+    decisive = False
+
+    while episodes < max_episodes and not decisive:
+        count = min(batch_size, max_episodes - episodes)
+        seeds = range(seed + episodes, seed + episodes + count)
+        batch = []
+        for spec in policy_specs:
+            results = imap_episodes(run_comparison_episode, spec, [(s, episode_length) for s in seeds],
+                                    make_comparison_env, (episode_length,), n_workers=n_workers)
+            batch.append([result[metric] for result in results])
+        for i, policy_values in enumerate(batch):
+            for value, base_value in zip(policy_values, batch[baseline]):
+                values[i].update(value)
+                differences[i].update(value - base_value)
+        episodes += count
+
+        if episodes >= min_episodes:
+            decisive = True
+            for i in range(len(policy_specs)):
+                if i == baseline:
+                    continue
+                _, low, high = paired_interval(differences[i], confidence)
+                if not (low > 0 or high < 0 or (tolerance > 0 and -tolerance <= low and high <= tolerance)):
+                    decisive = False
+        if verbose:
+            print(f"{episodes} episodes per policy" + (", decisive" if decisive else ""))
+
+    report = []
+    for i, spec in enumerate(policy_specs):
+        result = {"policy": spec, "mean": values[i].mean, "std": values[i].std}
+        if i != baseline:
+            mean, low, high = paired_interval(differences[i], confidence)
+            if low > 0:
+                verdict = "better"
+            elif high < 0:
+                verdict = "worse"
+            elif tolerance > 0 and -tolerance <= low and high <= tolerance:
+                verdict = "equivalent"
+            else:
+                verdict = "undecided"
+            independent_variance = values[i].variance + values[baseline].variance
+            result.update({
+                "difference": mean,
+                "interval": (low, high),
+                "verdict": verdict,
+                "variance_reduction": (independent_variance / differences[i].variance
+                                       if differences[i].variance > 0 else math.inf),
+            })
+        report.append(result)
+    return {"episodes": episodes, "decisive": decisive, "metric": metric, "baseline": policy_specs[baseline],
+            "results": report}
+
+
+def print_comparison(comparison, confidence=0.95):
+    print(f"\n{comparison['metric']} over {comparison['episodes']} common-random-number episodes "
+          f"(baseline: {comparison['baseline']})")
+    for result in comparison["results"]:
+        line = f"  {result['policy']:<40} mean {result['mean']:10.2f} (std {result['std']:.2f})"
+        if "difference" in result:
+            low, high = result["interval"]
+            line += (f"  diff {result['difference']:+9.2f} [{low:+.2f}, {high:+.2f}] ({confidence:.0%})"
+                     f"  {result['verdict']}, variance reduction x{result['variance_reduction']:.1f}")
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paired policy comparison on common random numbers")
+    parser.add_argument("policies", nargs="+", help="Models, policy files or controllers (see policies.py); "
+                                                    "the first is the baseline")
+    parser.add_argument("--metric", default="total_reward", choices=METRICS)
+    parser.add_argument("--episode-length", type=int, default=200)
+    parser.add_argument("--max-episodes", type=int, default=2000)
+    parser.add_argument("--min-episodes", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--tolerance", type=float, default=0.0, help="Differences within +-tolerance are "
+                                                                     "treated as equivalent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    comparison = compare_policies(args.policies, 0, args.metric, args.episode_length, args.max_episodes,
+                                  args.min_episodes, args.batch_size, args.confidence, args.tolerance, args.seed,
+                                  args.workers)
+    print_comparison(comparison, args.confidence)
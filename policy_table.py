@@ -0,0 +1,131 @@
+import argparse
+import time
+
+import numpy as np
+
+from observation_codec import encode_observations, num_observations, observation_table
+
+
+def compile_policy_table(model, max_queue=10, include_q_values=False):
+    """
+    Enumerate every TrafficEnv observation and record the model's greedy action
+
+    All num_observations(max_queue) observations go through the Q-network in
+    one batched forward pass, so the table reproduces
+    model.predict(obs, deterministic=True) for every observation the env
+    can produce.
+
+    Args:
+        model: Trained SB3 DQN
+        max_queue: Queue cap of the env the model was trained on
+        include_q_values: Also keep the float32 Q-values of every observation
+
+    Returns:
+        PolicyTable
+    """
+    import torch  # only needed to compile the table, not to use it
+
+    obs_tensor, _ = model.policy.obs_to_tensor(observation_table(max_queue))
+    with torch.no_grad():
+        q_values = model.policy.q_net(obs_tensor)
+    actions = q_values.argmax(dim=1).cpu().numpy().astype(np.uint8)
+    q_values = q_values.cpu().numpy().astype(np.float32) if include_q_values else None
+    return PolicyTable(actions, q_values, max_queue)
+
+
+class PolicyTable:
+    """
+    Greedy DQN policy as a lookup table over encoded observations
+
+    Selecting an action is an index into a uint8 array, so the controller
+    only needs NumPy at run time. predict matches the SB3 signature and
+    handles single observations as well as batches.
+    """
+
+    def __init__(self, actions, q_values=None, max_queue=10):
+        if len(actions) != num_observations(max_queue):
+            raise ValueError(f"Expected {num_observations(max_queue)} actions for max_queue={max_queue}, "
+                             f"got {len(actions)}")
+        self.actions = actions
+        self.q_values = q_values
+        self.max_queue = max_queue
+        self._actions = actions.tolist()  # plain list for the scalar path in act
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        """Actions for one observation or a batch, in the (actions, state) form of model.predict"""
+        observation = np.asarray(observation)
+        if observation.ndim == 1:
+            return np.array(self.act(observation)), None
+        return self.actions[encode_observations(observation, self.max_queue)].astype(np.int64), None
+
+    def act(self, observation):
+        """
+        Action for a single env observation as a Python int
+
+        Plain float arithmetic on the five values avoids NumPy's per-call
+        overhead. Observations must come from the env (queues within
+        0..max_queue); use predict for anything that may need clipping.
+        """
+        q0, q1, q2, q3, phase = observation.tolist()
+        n, base = self.max_queue, self.max_queue + 1
+        index = ((round(q0 * n) * base + round(q1 * n)) * base + round(q2 * n)) * base + round(q3 * n)
+        return self._actions[index * 2 + (phase > 0.5)]
+
+    def action_values(self, observation):
+        """Stored Q-values of one observation or a batch"""
+        if self.q_values is None:
+            raise ValueError("This table was compiled without Q-values")
+        return self.q_values[encode_observations(observation, self.max_queue)]
+
+    def save(self, path):
+        arrays = {"actions": self.actions, "max_queue": self.max_queue}
+        if self.q_values is not None:
+            arrays["q_values"] = self.q_values
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        q_values = data["q_values"] if "q_values" in data else None
+        return cls(data["actions"], q_values, int(data["max_queue"]))
+
+
+def _time_per_call(fn, observations):
+    start = time.perf_counter()
+    for obs in observations:
+        fn(obs)
+    return (time.perf_counter() - start) / len(observations)
+
+
+if __name__ == "__main__":
+    from stable_baselines3 import DQN
+
+    parser = argparse.ArgumentParser(description="Compile a trained DQN into an action lookup table")
+    parser.add_argument("model", nargs="?", default="dqn_traffic_optimized")
+    parser.add_argument("-o", "--output", default="policy_table.npz")
+    parser.add_argument("--max-queue", type=int, default=10)
+    parser.add_argument("--q-values", action="store_true", help="Store the Q-values as well")
+    parser.add_argument("--timing-samples", type=int, default=2000)
+    args = parser.parse_args()
+
+    model = DQN.load(args.model, device="cpu")
+    start = time.perf_counter()
+    table = compile_policy_table(model, args.max_queue, include_q_values=args.q_values)
+    print(f"Compiled {len(table.actions):,} observations in {time.perf_counter() - start:.2f}s")
+    table.save(args.output)
+
+    # Check the table against the model on every observation
+    observations = observation_table(args.max_queue)
+    expected, _ = model.predict(observations, deterministic=True)
+    actions, _ = table.predict(observations)
+    mismatches = int(np.sum(actions != expected))
+    print(f"Agreement with model.predict: {len(actions) - mismatches:,}/{len(actions):,}")
+
+    rng = np.random.default_rng(0)
+    samples = observations[rng.integers(0, len(observations), args.timing_samples)]
+    model_time = _time_per_call(lambda obs: model.predict(obs, deterministic=True), samples)
+    predict_time = _time_per_call(table.predict, samples)
+    act_time = _time_per_call(table.act, samples)
+    print(f"Per-decision latency: model.predict {model_time * 1e6:.1f} us, "
+          f"table.predict {predict_time * 1e6:.2f} us, table.act {act_time * 1e6:.2f} us")
+    print(f"Table saved to {args.output}")
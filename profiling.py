@@ -0,0 +1,436 @@
+import argparse
+import json
+import time
+
+from stable_baselines3.common.callbacks import BaseCallback
+
+# Latency histograms have SUB_BINS bins per power of two of nanoseconds,
+# so a quantile is read to within 1 / SUB_BINS of its value
+SUB_BINS = 4
+_SUB_SHIFT = SUB_BINS.bit_length() - 1
+
+
+class LatencyHistogram:
+    """
+    Nanosecond durations in log-spaced bins, updated in a few integer operations
+
+    Keeps the sample count, sum and max exactly; quantiles come from the
+    bins. weight is the number of calls each sample stands for, so
+    estimated_total is the time of all calls, sampled or not.
+    """
+
+    def __init__(self, weight=1):
+        self.weight = weight
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+        self.bins = [0] * (64 * SUB_BINS)
+
+    def record(self, ns):
+        bits = ns.bit_length()
+        if bits > _SUB_SHIFT:
+            # Octave from the bit length, sub-bin from the next bits below the leading one
+            index = bits * SUB_BINS + ((ns >> (bits - 1 - _SUB_SHIFT)) & (SUB_BINS - 1))
+        else:
+            index = ns
+        self.bins[index] += 1
+        self.samples += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    @staticmethod
+    def bin_edges(index):
+        """[low, high) nanoseconds of a bin"""
+        bits, sub = divmod(index, SUB_BINS)
+        if bits <= _SUB_SHIFT:
+            return index, index + 1
+        width = 1 << (bits - 1 - _SUB_SHIFT)
+        low = (SUB_BINS + sub) * width
+        return low, low + width
+
+    def quantile(self, q):
+        """Midpoint of the bin holding the q-quantile, in nanoseconds"""
+        if self.samples == 0:
+            return 0.0
+        rank = q * (self.samples - 1)
+        cumulative = 0
+        for index, count in enumerate(self.bins):
+            cumulative += count
+            if cumulative > rank:
+                low, high = self.bin_edges(index)
+                return min((low + high) / 2, self.max)
+        return float(self.max)
+
+    @property
+    def mean(self):
+        return self.total / self.samples if self.samples else 0.0
+
+    @property
+    def estimated_total(self):
+        return self.total * self.weight
+
+    def merge(self, other):
+        self.samples += other.samples
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.bins = [a + b for a, b in zip(self.bins, other.bins)]
+
+
+class StageTimer:
+    """Times consecutive stages of one sampled call; lap(stage) ends the current one"""
+
+    __slots__ = ("profiler", "last")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.last = time.perf_counter_ns()
+
+    def lap(self, stage):
+        now = time.perf_counter_ns()
+        self.profiler.record(stage, now - self.last)
+        self.last = time.perf_counter_ns()  # the next stage starts after the bookkeeping
+
+
+class _Timed:
+    """Context manager adding the duration of a block to a stage"""
+
+    __slots__ = ("profiler", "stage", "start")
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.stage, time.perf_counter_ns() - self.start, weight=1)
+
+
+class _Alias:
+    __slots__ = ("profiler", "stage", "alias")
+
+    def __init__(self, profiler, stage, alias):
+        self.profiler = profiler
+        self.stage = stage
+        self.alias = alias
+
+    def __enter__(self):
+        self.profiler._aliases[self.stage] = self.alias
+
+    def __exit__(self, *exc_info):
+        del self.profiler._aliases[self.stage]
+
+
+class StageProfiler:
+    """
+    Opt-in, sampled wall-clock timing of named stages
+
+    Only one in sample_every calls is timed, so the cost of an unsampled
+    call is a counter decrement (plus an `is not None` check per stage in
+    instrumented code). Hot loops ask for a StageTimer with sample() and
+    mark the end of each stage with lap(); methods of other objects are
+    timed by wrap(). Every stage keeps a LatencyHistogram; summary() turns
+    them into mean/quantiles and the share of wall time each stage takes.
+
+    Stages are named "<group>.<stage>", e.g. "env.discharge". A stage that
+    runs inside another one is declared with nest(), so that summary()
+    only adds up the shares of the outermost stages.
+
+    Args:
+        sample_every: Time one call in this many (1 times every call)
+    """
+
+    def __init__(self, sample_every=100):
+        self.sample_every = sample_every
+        self.stages = {}
+        self._countdown = 1  # the first call is sampled
+        self._wrapped = []
+        self._aliases = {}  # stage -> stage its wrapped calls are recorded under for now
+        self.parents = {}  # stage or group -> enclosing stage
+        self.start_time = time.perf_counter_ns()
+
+    def sample(self):
+        """StageTimer on every sample_every-th call, None otherwise"""
+        self._countdown -= 1
+        if self._countdown:
+            return None
+        self._countdown = self.sample_every
+        return StageTimer(self)
+
+    def record(self, stage, ns, weight=None):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = LatencyHistogram(self.sample_every if weight is None else weight)
+        histogram.record(ns)
+
+    def time(self, stage):
+        """Context manager timing every execution of a block (for rare, long stages)"""
+        return _Timed(self, stage)
+
+    def wrap(self, obj, method_name, stage):
+        """
+        Time one in sample_every calls of obj.method_name under stage
+
+        The wrapper is set as an instance attribute and removed again by
+        unwrap_all. Don't wrap objects that get pickled while wrapped (a
+        DQN model is saved with its instance attributes; wrap its policy,
+        env and replay buffer instead).
+        """
+        method = getattr(obj, method_name)
+        countdown = [1]
+
+        def wrapper(*args, **kwargs):
+            countdown[0] -= 1
+            if countdown[0]:
+                return method(*args, **kwargs)
+            countdown[0] = self.sample_every
+            start = time.perf_counter_ns()
+            result = method(*args, **kwargs)
+            self.record(self._aliases.get(stage, stage), time.perf_counter_ns() - start)
+            return result
+
+        self._wrapped.append((obj, method_name, method_name in vars(obj), method))
+        setattr(obj, method_name, wrapper)
+
+    def record_as(self, stage, alias):
+        """Context manager recording the wrapped calls of stage under alias instead"""
+        return _Alias(self, stage, alias)
+
+    def nest(self, stage, parent):
+        """Declare that stage (or every stage of a group, e.g. "env") runs inside parent"""
+        self.parents[stage] = parent
+
+    def parent_of(self, stage):
+        return self.parents.get(stage, self.parents.get(stage.partition(".")[0]))
+
+    def unwrap_all(self):
+        for obj, method_name, had_attribute, method in reversed(self._wrapped):
+            if had_attribute:
+                setattr(obj, method_name, method)
+            else:
+                delattr(obj, method_name)
+        self._wrapped = []
+
+    def reset(self):
+        self.stages = {}
+        self.start_time = time.perf_counter_ns()
+
+    def summary(self):
+        """
+        Returns:
+            Dict of wall_seconds, the share of the wall time spent in the
+            outermost stages and, per stage, samples, mean/p50/p90/p99/max
+            in microseconds, the estimated total seconds over all calls,
+            its share of the wall time and its enclosing stage (None for
+            the outermost ones)
+        """
+        wall = max(time.perf_counter_ns() - self.start_time, 1)
+        stages = {}
+        for stage, histogram in sorted(self.stages.items()):
+            stages[stage] = {
+                "samples": histogram.samples,
+                "mean_us": histogram.mean / 1e3,
+                "p50_us": histogram.quantile(0.5) / 1e3,
+                "p90_us": histogram.quantile(0.9) / 1e3,
+                "p99_us": histogram.quantile(0.99) / 1e3,
+                "max_us": histogram.max / 1e3,
+                "total_s": histogram.estimated_total / 1e9,
+                "share": histogram.estimated_total / wall,
+                "parent": self.parent_of(stage),
+            }
+        top_level_share = sum(row["share"] for row in stages.values() if row["parent"] is None)
+        return {"wall_seconds": wall / 1e9, "sample_every": self.sample_every, "top_level_share": top_level_share,
+                "stages": stages}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\nStage timings over {summary['wall_seconds']:.1f}s (1 in {self.sample_every} calls sampled)")
+        print(f"  {'stage':<26}{'samples':>9}{'mean us':>12}{'p50':>12}{'p99':>12}{'max':>12}{'share':>8}")
+        stages = summary["stages"]
+
+        def print_stage(stage, depth):
+            row = stages[stage]
+            name = "  " * depth + stage  # nested stages are indented under their parent
+            print(f"  {name:<26}{row['samples']:>9,}{row['mean_us']:>12.2f}{row['p50_us']:>12.2f}"
+                  f"{row['p99_us']:>12.2f}{row['max_us']:>12.1f}{row['share']:>8.1%}")
+            for child, child_row in stages.items():
+                if child_row["parent"] == stage:
+                    print_stage(child, depth + 1)
+
+        for stage, row in stages.items():
+            if row["parent"] is None or row["parent"] not in stages:
+                print_stage(stage, 0)
+        print(f"  Outermost stages: {summary['top_level_share']:.1%} of the wall time")
+
+
+def attach_env_profiler(env, profiler):
+    """
+    Give the TrafficEnvs of a (vectorized, wrapped) env the profiler
+
+    Only envs living in this process can be reached (DummyVecEnv or a
+    plain env); returns how many were attached.
+    """
+    while hasattr(env, "venv"):
+        env = env.venv
+    envs = env.envs if hasattr(env, "envs") else [env]
+    attached = 0
+    for sub_env in envs:
+        sub_env = getattr(sub_env, "unwrapped", sub_env)
+        if hasattr(sub_env, "profiler"):
+            sub_env.profiler = profiler
+            attached += 1
+    return attached
+
+
+class ProfilingCallback(BaseCallback):
+    """
+    Time the stages of DQN training with a StageProfiler
+
+    Stages: train.predict (Q-network forward of rollouts, exploration steps
+    skip it), train.env_step (VecEnv step), train.replay_add,
+    train.gradient_updates (the whole train() call between two rollouts)
+    and eval.evaluation (every EvalCallback evaluation, never sampled).
+    Nested inside them are the env.* stages of the training TrafficEnvs,
+    train.replay_sample and eval.predict (the predictions made during
+    evaluations, which train.predict leaves out). The env.* stages need
+    TrafficEnvs in this process (the "dummy" backend); with other backends
+    only the outer stages are timed. Every log_interval steps the stage
+    means, p99s and wall-time shares are recorded as profile/* scalars,
+    which end up in TensorBoard when the model has a tensorboard_log.
+
+    Args:
+        profiler: StageProfiler, its sample_every sets the sampling rate
+        log_interval: Env steps between scalar dumps
+        report_path: Optional JSON file for the final summary
+        eval_callback: Optional EvalCallback whose evaluations are timed
+    """
+
+    def __init__(self, profiler, log_interval=10000, report_path=None, eval_callback=None, verbose=0):
+        super().__init__(verbose)
+        self.profiler = profiler
+        self.log_interval = log_interval
+        self.report_path = report_path
+        self.eval_callback = eval_callback
+        self._rollouts = 0
+        self._train_start = None
+
+    def _on_training_start(self):
+        profiler = self.profiler
+        profiler.reset()
+        self._last_log = self.num_timesteps
+        if not attach_env_profiler(self.training_env, profiler):
+            print("Warning: no TrafficEnv runs in this process (non-dummy vec env backend), "
+                  "the env.* stages won't be timed")
+        profiler.nest("env", "train.env_step")
+        profiler.nest("train.replay_sample", "train.gradient_updates")
+        profiler.nest("eval.predict", "eval.evaluation")
+        profiler.wrap(self.model.policy, "predict", "train.predict")
+        profiler.wrap(self.training_env, "step", "train.env_step")
+        profiler.wrap(self.model.replay_buffer, "add", "train.replay_add")
+        profiler.wrap(self.model.replay_buffer, "sample", "train.replay_sample")
+        if self.eval_callback is not None:
+            self._wrap_evaluation(self.eval_callback)
+
+    def _wrap_evaluation(self, eval_callback):
+        on_step = eval_callback._on_step
+        profiler = self.profiler
+
+        def timed_on_step():
+            # on_step has already counted this call, so this matches EvalCallback's own check
+            if eval_callback.eval_freq > 0 and eval_callback.n_calls % eval_callback.eval_freq == 0:
+                with profiler.time("eval.evaluation"), profiler.record_as("train.predict", "eval.predict"):
+                    return on_step()
+            return on_step()
+
+        profiler._wrapped.append((eval_callback, "_on_step", False, on_step))
+        eval_callback._on_step = timed_on_step
+
+    def _on_rollout_start(self):
+        # train() runs between the end of one rollout and the start of the next
+        if self._train_start is not None:
+            self.profiler.record("train.gradient_updates", time.perf_counter_ns() - self._train_start)
+            self._train_start = None
+
+    def _on_rollout_end(self):
+        self._rollouts += 1
+        if self._rollouts % self.profiler.sample_every == 0 and self.num_timesteps > self.model.learning_starts:
+            self._train_start = time.perf_counter_ns()
+
+    def _on_step(self):
+        if self.num_timesteps - self._last_log >= self.log_interval:
+            self._last_log = self.num_timesteps
+            self._log()
+        return True
+
+    def _log(self):
+        for stage, row in self.profiler.summary()["stages"].items():
+            self.logger.record(f"profile/{stage}/mean_us", row["mean_us"])
+            self.logger.record(f"profile/{stage}/p99_us", row["p99_us"])
+            self.logger.record(f"profile/{stage}/share", row["share"])
+
+    def _on_training_end(self):
+        self._log()
+        self.profiler.unwrap_all()
+        attach_env_profiler(self.training_env, None)
+        if self.report_path:
+            self.profiler.write_json(self.report_path)
+        if self.verbose > 0:
+            self.profiler.print_summary()
+
+
+def profile_evaluation(model_path, num_episodes=20, max_steps=200, seed=0, sample_every=1, fast=False,
+                       vehicle_level=False):
+    """
+    Time the stages of a sequential evaluation loop (policy predict and the env.* stages)
+
+    Returns:
+        The StageProfiler
+    """
+    from policies import load_policy, reset_policy
+    from traffic_env02 import TrafficEnv
+
+    profiler = StageProfiler(sample_every)
+    model = load_policy(model_path, device="cpu")
+    env = TrafficEnv(render_mode=None, fast=fast, max_steps=max_steps, vehicle_level=vehicle_level,
+                     profiler=profiler)
+    profiler.wrap(model, "predict", "eval.predict")
+    profiler.wrap(env, "step", "eval.env_step")
+    profiler.nest("env", "eval.env_step")
+    profiler.reset()  # wall time starts with the first episode
+    for episode in range(num_episodes):
+        obs, _ = env.reset(seed=seed + episode)
+        reset_policy(model)
+        done = False
+        while not done:
+            action, _ = model.predict(obs, deterministic=True)
+            obs, reward, terminated, truncated, info = env.step(action)
+            done = terminated or truncated
+    profiler.unwrap_all()
+    env.close()
+    return profiler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage timings of an evaluation loop")
+    parser.add_argument("--model", default="dqn_traffic_optimized.zip",
+                        help="Saved model, policy file or baseline controller, see policies.py")
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--max-steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample-every", type=int, default=1)
+    parser.add_argument("--fast", action="store_true", help="Profile TrafficEnv's fast step")
+    parser.add_argument("--vehicle-level", action="store_true")
+    parser.add_argument("--report", default=None, help="Write the summary to this JSON file")
+    args = parser.parse_args()
+
+    profiler = profile_evaluation(args.model, args.episodes, args.max_steps, args.seed, args.sample_every,
+                                  args.fast, args.vehicle_level)
+    profiler.print_summary()
+    if args.report:
+        profiler.write_json(args.report)
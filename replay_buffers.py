@@ -0,0 +1,197 @@
+import json
+import os
+
+import numpy as np
+from stable_baselines3.common.buffers import BaseBuffer, ReplayBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+
+from observation_codec import encode_observations, num_observations, observation_table
+
+# Bits of the packed per-transition flags
+DONE_FLAG = 1
+TIMEOUT_FLAG = 2
+
+
+class CompactReplayBuffer(ReplayBuffer):
+    """
+    DQN replay buffer that stores TrafficEnv transitions as small integers
+
+    Each observation is packed into one uint16 state index (see
+    observation_codec.encode_observations), actions into uint8 and the done and
+    timeout flags into the bits of a single uint8. Sampled batches are
+    decoded back to normalized float observations through a lookup table,
+    so the learner sees exactly what the default float32 buffer would
+    return while a transition takes 10 bytes instead of about 60.
+
+    Pass it to DQN with replay_buffer_class=CompactReplayBuffer; the
+    queue cap can be set through replay_buffer_kwargs=dict(max_queue=...).
+    """
+
+    def __init__(
+        self,
+        buffer_size,
+        observation_space,
+        action_space,
+        device="auto",
+        n_envs=1,
+        optimize_memory_usage=False,
+        handle_timeout_termination=True,
+        max_queue=10,
+    ):
+        # Skip ReplayBuffer.__init__, which would allocate the float32 arrays
+        BaseBuffer.__init__(self, buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        if optimize_memory_usage and handle_timeout_termination:
+            raise ValueError(
+                "ReplayBuffer does not support optimize_memory_usage = True "
+                "and handle_timeout_termination = True simultaneously."
+            )
+        if num_observations(max_queue) > np.iinfo(np.uint16).max + 1:
+            raise ValueError(f"max_queue={max_queue} does not fit uint16 state indices")
+
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.optimize_memory_usage = optimize_memory_usage
+        self.handle_timeout_termination = handle_timeout_termination
+        self.max_queue = max_queue
+        self.obs_table = observation_table(max_queue)
+        self._allocate()
+
+    def _allocate(self):
+        shape = (self.buffer_size, self.n_envs)
+        self.observations = np.zeros(shape, dtype=np.uint16)
+        if not self.optimize_memory_usage:
+            # When optimizing memory, `observations` contains also the next observation
+            self.next_observations = np.zeros(shape, dtype=np.uint16)
+        self.actions = np.zeros(shape, dtype=np.uint8)
+        self.rewards = np.zeros(shape, dtype=np.float32)
+        self.flags = np.zeros(shape, dtype=np.uint8)
+
+    @property
+    def nbytes(self):
+        """Memory held by the transition arrays"""
+        arrays = [self.observations, self.actions, self.rewards, self.flags]
+        if not self.optimize_memory_usage:
+            arrays.append(self.next_observations)
+        return sum(array.nbytes for array in arrays)
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        self.observations[self.pos] = encode_observations(obs, self.max_queue)
+        if self.optimize_memory_usage:
+            self.observations[(self.pos + 1) % self.buffer_size] = encode_observations(next_obs, self.max_queue)
+        else:
+            self.next_observations[self.pos] = encode_observations(next_obs, self.max_queue)
+
+        self.actions[self.pos] = np.asarray(action).reshape(self.n_envs)
+        self.rewards[self.pos] = np.asarray(reward)
+        flags = np.asarray(done, dtype=np.uint8) * DONE_FLAG
+        if self.handle_timeout_termination:
+            timeouts = np.array([info.get("TimeLimit.truncated", False) for info in infos], dtype=np.uint8)
+            flags |= timeouts * TIMEOUT_FLAG
+        self.flags[self.pos] = flags
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+    def _get_samples(self, batch_inds, env=None):
+        # Sample randomly the env idx
+        env_indices = np.random.randint(0, high=self.n_envs, size=(len(batch_inds),))
+
+        if self.optimize_memory_usage:
+            next_index = self.observations[(batch_inds + 1) % self.buffer_size, env_indices]
+        else:
+            next_index = self.next_observations[batch_inds, env_indices]
+
+        flags = self.flags[batch_inds, env_indices]
+        # Only use dones that are not due to timeouts
+        dones = ((flags & DONE_FLAG) > 0) & ((flags & TIMEOUT_FLAG) == 0)
+
+        data = (
+            self._normalize_obs(self.obs_table[self.observations[batch_inds, env_indices]], env),
+            self.actions[batch_inds, env_indices].astype(np.int64).reshape(-1, 1),
+            self._normalize_obs(self.obs_table[next_index], env),
+            dones.astype(np.float32).reshape(-1, 1),
+            self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env),
+        )
+        return ReplayBufferSamples(*tuple(map(self.to_torch, data)))
+
+
+class MemmapReplayBuffer(CompactReplayBuffer):
+    """
+    CompactReplayBuffer whose arrays live in memory-mapped .npy files
+
+    Transitions are written straight into files under `path`, so saving the
+    buffer for a checkpoint is a flush plus a small state.json holding the
+    write position. With resume=True the files and position from the last
+    flush are reopened instead of starting empty. Transitions added after
+    that flush may already be in the files; they are overwritten as the
+    buffer refills.
+
+    Use it through DQN's replay_buffer_kwargs=dict(path=..., resume=...).
+    """
+
+    def __init__(
+        self,
+        buffer_size,
+        observation_space,
+        action_space,
+        device="auto",
+        n_envs=1,
+        optimize_memory_usage=False,
+        handle_timeout_termination=True,
+        max_queue=10,
+        path="replay_buffer",
+        resume=False,
+    ):
+        self.path = path
+        self.resume = resume
+        super().__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device=device,
+            n_envs=n_envs,
+            optimize_memory_usage=optimize_memory_usage,
+            handle_timeout_termination=handle_timeout_termination,
+            max_queue=max_queue,
+        )
+        if resume:
+            with open(os.path.join(path, "state.json")) as f:
+                state = json.load(f)
+            self.pos = state["pos"]
+            self.full = state["full"]
+
+    def _open(self, name, dtype):
+        shape = (self.buffer_size, self.n_envs)
+        file_path = os.path.join(self.path, f"{name}.npy")
+        if not self.resume:
+            return np.lib.format.open_memmap(file_path, mode="w+", dtype=dtype, shape=shape)
+        array = np.load(file_path, mmap_mode="r+")
+        if array.shape != shape or array.dtype != dtype:
+            raise ValueError(
+                f"{file_path} holds {array.dtype}{array.shape}, expected {np.dtype(dtype)}{shape}"
+            )
+        return array
+
+    def _allocate(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.observations = self._open("observations", np.uint16)
+        if not self.optimize_memory_usage:
+            self.next_observations = self._open("next_observations", np.uint16)
+        self.actions = self._open("actions", np.uint8)
+        self.rewards = self._open("rewards", np.float32)
+        self.flags = self._open("flags", np.uint8)
+
+    def flush(self):
+        """Write pending transitions to disk and record the write position"""
+        arrays = [self.observations, self.actions, self.rewards, self.flags]
+        if not self.optimize_memory_usage:
+            arrays.append(self.next_observations)
+        for array in arrays:
+            array.flush()
+
+        state = {"pos": self.pos, "full": self.full, "buffer_size": self.buffer_size, "n_envs": self.n_envs}
+        tmp_path = os.path.join(self.path, "state.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.path, "state.json"))
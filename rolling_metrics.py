@@ -0,0 +1,126 @@
+import collections
+
+import numpy as np
+
+from online_stats import RunningStats
+
+
+class RingBuffer:
+    """The most recent `size` values with an O(1) running sum"""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0] * size
+        self.pos = 0
+        self.count = 0
+        self.total = 0
+
+    def push(self, value):
+        if self.count == self.size:
+            self.total -= self.values[self.pos]
+        else:
+            self.count += 1
+        self.values[self.pos] = value
+        self.total += value
+        self.pos = (self.pos + 1) % self.size
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class RollingMax:
+    """Maximum over the last `size` values, amortized O(1) per value (monotonic deque)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.index = 0
+        self._candidates = collections.deque()  # (index, value), values decreasing
+
+    def push(self, value):
+        candidates = self._candidates
+        while candidates and candidates[-1][1] <= value:
+            candidates.pop()
+        candidates.append((self.index, value))
+        if candidates[0][0] <= self.index - self.size:
+            candidates.popleft()
+        self.index += 1
+
+    @property
+    def value(self):
+        return self._candidates[0][1] if self._candidates else 0
+
+
+class RollingMetrics:
+    """
+    Per-step traffic metrics with rolling windows in O(1) time per step
+
+    Throughput comes straight from info['vehicles_passed']. Episode-wide
+    statistics are running accumulators and the series kept for plotting
+    are thinned as the episode grows (every 2nd point dropped whenever
+    history_points is exceeded), so memory stays bounded for episodes of
+    any length.
+
+    Args:
+        window: Steps in the rolling windows
+        history_points: Approximate cap on the points kept per plotted series
+    """
+
+    def __init__(self, window=20, history_points=5000):
+        self.window = window
+        self.history_points = history_points
+        self.steps = 0
+        self.total_vehicles = 0
+        self.vehicles = RingBuffer(window)
+        self.queues = RingBuffer(window)
+        self.waits = RollingMax(window)
+        self.vehicle_stats = RunningStats()
+        self.queue_stats = RunningStats()
+        self.wait_stats = RunningStats()
+        self._stride = 1
+        self._history = {name: [] for name in ("step", "vehicles_passed", "total_queue", "max_wait",
+                                               "rolling_efficiency")}
+
+    def update(self, vehicles_passed, total_queue, max_wait):
+        self.steps += 1
+        self.total_vehicles += vehicles_passed
+        self.vehicles.push(vehicles_passed)
+        self.queues.push(total_queue)
+        self.waits.push(max_wait)
+        self.vehicle_stats.update(vehicles_passed)
+        self.queue_stats.update(total_queue)
+        self.wait_stats.update(max_wait)
+
+        if self.steps % self._stride == 0:
+            history = self._history
+            history["step"].append(self.steps)
+            history["vehicles_passed"].append(vehicles_passed)
+            history["total_queue"].append(total_queue)
+            history["max_wait"].append(max_wait)
+            history["rolling_efficiency"].append(self.rolling_efficiency)
+            if len(history["step"]) >= 2 * self.history_points:
+                for name, values in history.items():
+                    del values[::2]  # keep the points on multiples of the doubled stride
+                self._stride *= 2
+
+    @property
+    def efficiency(self):
+        """Vehicles per step over the whole run, in percent"""
+        return self.total_vehicles / self.steps * 100 if self.steps else 0.0
+
+    @property
+    def rolling_efficiency(self):
+        """Vehicles per step over the last `window` steps, in percent"""
+        return self.vehicles.mean * 100
+
+    @property
+    def rolling_queue(self):
+        return self.queues.mean
+
+    @property
+    def rolling_max_wait(self):
+        return self.waits.value
+
+    def history(self):
+        """Thinned per-step series as arrays, keyed by metric, plus the step numbers"""
+        return {name: np.array(values) for name, values in self._history.items()}
@@ -0,0 +1,270 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import threading
+
+import numpy as np
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
+from traffic_env02 import TrafficEnv
+
+# Commands written to the shared control block before the start barrier
+CMD_STEP = 0
+CMD_RESET = 1
+CMD_CALL = 2
+CMD_CLOSE = 3
+
+NO_SEED = -1
+
+
+def _array_offsets(layout):
+    """Byte offset of every array in the shared block and the total size"""
+    offsets = []
+    size = 0
+    for _, shape, dtype in layout:
+        offsets.append(size)
+        size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size += -size % 8  # keep every array 8-byte aligned
+    return offsets, size
+
+
+def _shared_arrays(buffer, layout):
+    """Carve named arrays out of one shared memory buffer"""
+    offsets, _ = _array_offsets(layout)
+    return {
+        name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+        for (name, shape, dtype), offset in zip(layout, offsets)
+    }
+
+
+def _buffer_layout(num_envs, obs_shape, obs_dtype, ring_size):
+    return [
+        ("control", (2,), np.int64),  # [command, ring slot]
+        ("actions", (num_envs,), np.int64),
+        ("seeds", (num_envs,), np.int64),
+        ("obs", (ring_size, num_envs, *obs_shape), obs_dtype),
+        ("rewards", (ring_size, num_envs), np.float32),
+        ("dones", (ring_size, num_envs), np.bool_),
+        ("truncated", (ring_size, num_envs), np.bool_),
+        ("terminal_obs", (num_envs, *obs_shape), obs_dtype),
+    ]
+
+
+def _worker(shm_name, layout, env_indices, env_kwargs, start_barrier, done_barrier, pipe):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = _shared_arrays(shm.buf, layout)
+    control, actions, seeds = arrays["control"], arrays["actions"], arrays["seeds"]
+    obs_ring, reward_ring, done_ring = arrays["obs"], arrays["rewards"], arrays["dones"]
+    truncated_ring, terminal_obs = arrays["truncated"], arrays["terminal_obs"]
+    envs = [TrafficEnv(**env_kwargs) for _ in env_indices]
+
+    try:
+        while True:
+            start_barrier.wait()
+            command, slot = control
+            if command == CMD_STEP:
+                for env, i in zip(envs, env_indices):
+                    obs, reward, terminated, truncated, _ = env.step(actions[i])
+                    done = terminated or truncated
+                    if done:
+                        terminal_obs[i] = obs
+                        obs, _ = env.reset()
+                    obs_ring[slot, i] = obs
+                    reward_ring[slot, i] = reward
+                    done_ring[slot, i] = done
+                    truncated_ring[slot, i] = truncated and not terminated
+            elif command == CMD_RESET:
+                for env, i in zip(envs, env_indices):
+                    seed = None if seeds[i] == NO_SEED else int(seeds[i])
+                    obs_ring[slot, i], _ = env.reset(seed=seed)
+            elif command == CMD_CALL:
+                method, local, args, kwargs = pipe.recv()
+                pipe.send([method(envs[j], *args, **kwargs) for j in local])
+            elif command == CMD_CLOSE:
+                break
+            done_barrier.wait()
+    except BaseException:
+        # Wake the learner instead of leaving it blocked on a barrier
+        start_barrier.abort()
+        done_barrier.abort()
+        raise
+    finally:
+        for env in envs:
+            env.close()
+        del arrays, control, actions, seeds, obs_ring, reward_ring, done_ring, truncated_ring, terminal_obs
+        shm.close()
+
+
+def _get_attr(env, name):
+    return getattr(env, name)
+
+
+def _set_attr(env, name, value):
+    setattr(env, name, value)
+
+
+def _call_method(env, name, *args, **kwargs):
+    return getattr(env, name)(*args, **kwargs)
+
+
+def _is_wrapped(env, wrapper_class):
+    return isinstance(env, wrapper_class)
+
+
+class ShmVecEnv(VecEnv):
+    """
+    TrafficEnv rollout workers that exchange data through shared memory
+
+    Worker processes step their share of the envs and write observations,
+    rewards and done flags straight into ring buffers in one
+    multiprocessing.shared_memory block. The learner returns views of
+    those buffers, so nothing is pickled on the step path: the only
+    cross-process traffic per step is a pair of barrier waits. get_attr,
+    env_method and similar rare calls still go through pipes.
+
+    The arrays returned by step_wait and reset are views into the ring and
+    stay valid for ring_size - 1 further steps; copy them to keep them
+    longer. SB3's off-policy algorithms only need the previous observation,
+    which any ring_size >= 2 keeps intact.
+
+    Args:
+        num_envs: Number of TrafficEnv copies
+        n_workers: Worker processes, envs are split between them evenly
+        env_kwargs: TrafficEnv keyword arguments
+        seed: Base seed, env i is seeded with seed + i on the first reset
+        ring_size: Steps of observations kept in the ring buffers
+        start_method: multiprocessing start method, forkserver by default
+        timeout: Seconds to wait on a barrier before failing
+    """
+
+    def __init__(self, num_envs, n_workers=None, env_kwargs=None, seed=None, ring_size=4,
+                 start_method=None, timeout=None):
+        if ring_size < 2:
+            raise ValueError("ring_size must be at least 2")
+        env_kwargs = {"render_mode": None, "fast": True, **(env_kwargs or {})}
+        n_workers = min(n_workers or mp.cpu_count(), num_envs)
+
+        probe = TrafficEnv(**env_kwargs)
+        observation_space, action_space = probe.observation_space, probe.action_space
+        probe.close()
+
+        self.ring_size = ring_size
+        self.timeout = timeout
+        self._slot = 0
+        self._closed = False
+
+        layout = _buffer_layout(num_envs, observation_space.shape, observation_space.dtype, ring_size)
+        _, size = _array_offsets(layout)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._arrays = _shared_arrays(self._shm.buf, layout)
+        self._arrays["seeds"][:] = NO_SEED if seed is None else seed + np.arange(num_envs)
+
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+        self._start_barrier = ctx.Barrier(n_workers + 1)
+        self._done_barrier = ctx.Barrier(n_workers + 1)
+        self._worker_envs = np.array_split(np.arange(num_envs), n_workers)
+        self._pipes = []
+        self._processes = []
+        for env_indices in self._worker_envs:
+            parent, child = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(self._shm.name, layout, env_indices.tolist(), env_kwargs,
+                      self._start_barrier, self._done_barrier, child),
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self._pipes.append(parent)
+            self._processes.append(process)
+
+        self.render_mode = env_kwargs.get("render_mode")
+        super().__init__(num_envs, observation_space, action_space)
+
+    def _wait(self, barrier):
+        try:
+            barrier.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A ShmVecEnv worker failed or timed out") from None
+
+    def _run(self, command, slot=0):
+        self._arrays["control"][:] = (command, slot)
+        self._wait(self._start_barrier)
+        if command != CMD_CLOSE:
+            self._wait(self._done_barrier)
+
+    def reset(self):
+        seeds = self._arrays["seeds"]
+        for i, seed in enumerate(self._seeds):
+            if seed is not None:
+                seeds[i] = seed
+        self._slot = (self._slot + 1) % self.ring_size
+        self._run(CMD_RESET, self._slot)
+        seeds[:] = NO_SEED  # later resets continue each env's RNG stream
+        self._reset_seeds()
+        self._reset_options()
+        return self._arrays["obs"][self._slot]
+
+    def step_async(self, actions):
+        self._arrays["actions"][:] = np.asarray(actions).reshape(self.num_envs)
+
+    def step_wait(self):
+        self._slot = (self._slot + 1) % self.ring_size
+        self._run(CMD_STEP, self._slot)
+
+        obs = self._arrays["obs"][self._slot]
+        dones = self._arrays["dones"][self._slot]
+        truncated = self._arrays["truncated"][self._slot]
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(dones):
+            infos[i]["terminal_observation"] = self._arrays["terminal_obs"][i].copy()
+            infos[i]["TimeLimit.truncated"] = bool(truncated[i])
+        return obs, self._arrays["rewards"][self._slot], dones, infos
+
+    def _call(self, method, args=(), kwargs=None, indices=None):
+        indices = set(self._get_indices(indices))
+        self._arrays["control"][:] = (CMD_CALL, self._slot)
+        self._wait(self._start_barrier)
+        results = {}
+        for pipe, env_indices in zip(self._pipes, self._worker_envs):
+            local = [j for j, i in enumerate(env_indices) if i in indices]
+            pipe.send((method, local, args, kwargs or {}))
+        for pipe, env_indices in zip(self._pipes, self._worker_envs):
+            for i, result in zip([i for i in env_indices if i in indices], pipe.recv()):
+                results[i] = result
+        self._wait(self._done_barrier)
+        return [results[i] for i in sorted(results)]
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call(_get_attr, (attr_name,), indices=indices)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call(_set_attr, (attr_name, value), indices=indices)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call(_call_method, (method_name, *method_args), method_kwargs, indices=indices)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._call(_is_wrapped, (wrapper_class,), indices=indices)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._run(CMD_CLOSE)
+        except RuntimeError:
+            pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for pipe in self._pipes:
+            pipe.close()
+        self._arrays = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # views handed out by step_wait are still alive; unmapped when they go
+        self._shm.unlink()
@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+from policies import load_policy
+
+
+class LatencyStats:
+    """Request latencies over a sliding window plus batch counters"""
+
+    def __init__(self, window=100000):
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+
+    def record_batch(self, latencies):
+        self.latencies.extend(latencies)
+        self.requests += len(latencies)
+        self.batches += 1
+
+    def summary(self):
+        """p50/p99/max latency in milliseconds and the mean batch size"""
+        latencies = np.array(self.latencies) * 1000
+        if len(latencies) == 0:
+            return {"requests": self.requests, "batches": self.batches}
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / max(self.batches, 1),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+        }
+
+
+class MicroBatcher:
+    """
+    Group concurrent predict requests into batches
+
+    The first request of a batch opens a window of max_delay seconds; the
+    batch runs when the window closes or max_batch_size observations have
+    arrived, whichever comes first. Each batch is a single policy.predict
+    call on the event loop, so the policy should be cheap per batch (a
+    policy table or NumPy policy; an SB3 model also works).
+
+    Args:
+        policy: Object with predict(observations, deterministic=True)
+        max_batch_size: Observations per batch
+        max_delay: Seconds the first request of a batch may wait for others
+    """
+
+    def __init__(self, policy, max_batch_size=1024, max_delay=0.002, stats=None):
+        self.policy = policy
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.stats = stats or LatencyStats()
+        self._pending = []
+        self._full = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def submit(self, observation, received=None):
+        """Queue one observation; returns a future resolving to its action"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((observation, future, time.perf_counter() if received is None else received))
+        self._ready.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return future
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            if len(self._pending) < self.max_batch_size:
+                self._full.clear()
+            if not self._pending:
+                self._ready.clear()
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            # A malformed batch fails its own requests, never the batcher loop
+            observations = np.array([obs for obs, _, _ in batch], dtype=np.float32)
+            actions, _ = self.policy.predict(observations, deterministic=True)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        done = time.perf_counter()
+        for (_, future, _), action in zip(batch, actions.tolist()):
+            if not future.done():
+                future.set_result(action)
+        self.stats.record_batch([done - received for _, _, received in batch])
+
+
+class SignalService:
+    """
+    Newline-delimited JSON signal-control server
+
+    Each request line is {"id": ..., "obs": [5 floats]} with obs shaped
+    like a TrafficEnv observation; the reply is {"id": ..., "phase": 0|1}
+    (0 = NS green, 1 = EW green). Requests on one connection may be
+    pipelined and replies come back as their batches finish, so clients
+    match them by id. {"cmd": "stats"} returns the latency summary.
+
+    Args:
+        policy: Object with a batched predict, see policies.load_policy
+        host, port: TCP address, or unix_path for a Unix domain socket
+        max_batch_size, max_delay: MicroBatcher settings
+    """
+
+    def __init__(self, policy, host="127.0.0.1", port=8765, unix_path=None, max_batch_size=1024,
+                 max_delay=0.002):
+        self.policy = policy
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.stats = LatencyStats()
+        self.batcher = None
+        self.server = None
+
+    async def start(self):
+        self.batcher = MicroBatcher(self.policy, self.max_batch_size, self.max_delay, self.stats)
+        self.batcher.start()
+        if self.unix_path:
+            self.server = await asyncio.start_unix_server(self._handle, path=self.unix_path)
+        else:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]  # resolve port=0
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self, report_interval=None):
+        await self.start()
+        print(f"Serving on {self.unix_path or f'{self.host}:{self.port}'}")
+        try:
+            while True:
+                await asyncio.sleep(report_interval or 3600)
+                if report_interval:
+                    print(json.dumps(self.stats.summary()))
+        finally:
+            await self.stop()
+
+    async def _handle(self, reader, writer):
+        def reply(message):
+            writer.write(json.dumps(message).encode() + b"\n")
+
+        def on_result(request_id, future):
+            if writer.is_closing():
+                return
+            if future.exception() is not None:
+                reply({"id": request_id, "error": str(future.exception())})
+            else:
+                reply({"id": request_id, "phase": future.result()})
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                received = time.perf_counter()
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                    request_id = request.get("id")
+                    if request.get("cmd") == "stats":
+                        reply({"id": request_id, "stats": self.stats.summary()})
+                        continue
+                    obs = np.asarray(request["obs"], dtype=np.float32)
+                    if obs.shape != (5,):
+                        raise ValueError("obs must hold 5 values")
+                    if not np.isfinite(obs).all():
+                        raise ValueError("obs values must be finite")
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    # The id lets the client fail the right request; it is
+                    # only missing when the line was not a JSON object
+                    reply({"id": request_id, "error": f"bad request: {e}"})
+                    continue
+                future = self.batcher.submit(obs, received)
+                future.add_done_callback(lambda f, request_id=request_id: on_result(request_id, f))
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class SignalClient:
+    """Pipelining client for SignalService, used by the load generator"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self._pending = {}
+        self._next_id = 0
+        self._reader_task = asyncio.get_running_loop().create_task(self._read())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765, unix_path=None):
+        if unix_path:
+            reader, writer = await asyncio.open_unix_connection(unix_path, limit=1 << 20)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+        return cls(reader, writer)
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message.get("id") is None and "error" in message:
+                # An error that can't be matched to its request: no pending
+                # request can be trusted to get a reply any more
+                self._fail_pending(RuntimeError(f"SignalService error without a request id: {message['error']}"))
+                continue
+            future = self._pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        self._fail_pending(ConnectionError("SignalService closed the connection"))
+
+    def _fail_pending(self, error):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending = {}
+
+    def request(self, message):
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.writer.write(json.dumps({**message, "id": request_id}).encode() + b"\n")
+        return future
+
+    async def phase(self, obs):
+        response = await self.request({"obs": [float(x) for x in obs]})
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["phase"]
+
+    async def stats(self):
+        return (await self.request({"cmd": "stats"}))["stats"]
+
+    async def close(self):
+        self.writer.close()
+        self._reader_task.cancel()
+
+
+async def generate_load(num_intersections=2000, ticks=20, period=1.0, n_connections=8, host="127.0.0.1",
+                        port=8765, unix_path=None, seed=0):
+    """
+    Drive SignalService with simulated intersections
+
+    The intersections are a VecTrafficEnv. Every tick each of them sends
+    its observation at a fixed offset within the period, like controllers
+    reporting on their own clocks, and the env steps once all phases for
+    the tick have come back.
+
+    Returns:
+        (client-side latency summary, server stats, mean episode reward)
+    """
+    from vec_traffic_env import VecTrafficEnv
+
+    env = VecTrafficEnv(num_intersections, seed=seed)
+    obs = env.reset()
+    clients = [await SignalClient.connect(host, port, unix_path) for _ in range(n_connections)]
+    offsets = np.arange(num_intersections) / num_intersections * period
+    latencies = LatencyStats(window=num_intersections * ticks)
+    rewards = np.zeros(num_intersections)
+
+    async def intersection(i, tick_start):
+        await asyncio.sleep(max(0.0, tick_start + offsets[i] - time.perf_counter()))
+        sent = time.perf_counter()
+        phase = await clients[i % n_connections].phase(obs[i])
+        return phase, time.perf_counter() - sent
+
+    for _ in range(ticks):
+        tick_start = time.perf_counter()
+        results = await asyncio.gather(*(intersection(i, tick_start) for i in range(num_intersections)))
+        actions, tick_latencies = zip(*results)
+        latencies.record_batch(tick_latencies)
+        obs, reward, _, _ = env.step(np.array(actions))
+        rewards += reward
+        await asyncio.sleep(max(0.0, tick_start + period - time.perf_counter()))
+
+    server_stats = await clients[0].stats()
+    for client in clients:
+        await client.close()
+    return latencies.summary(), server_stats, float(rewards.mean())
+
+
+def _format(stats):
+    if "p50_ms" not in stats:
+        return f"{stats['requests']:,} requests"
+    return (f"{stats['requests']:,} requests, p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+            f"max {stats['max_ms']:.2f} ms")
+
+
+async def _bench(args):
+    service = await SignalService(load_policy(args.policy), args.host, 0, args.unix_path,
+                                  args.max_batch_size, args.max_delay_ms / 1000).start()
+    try:
+        client_stats, server_stats, _ = await generate_load(
+            args.intersections, args.ticks, args.period, args.connections, args.host, service.port,
+            args.unix_path,
+        )
+    finally:
+        await service.stop()
+    return client_stats, server_stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batched traffic signal control service")
+    parser.add_argument("mode", choices=["serve", "load", "bench"],
+                        help="serve: run the service, load: drive a running service, "
+                             "bench: both in one process (the load generator shares the event loop, "
+                             "so latencies read higher than with serve + load)")
+    parser.add_argument("--policy", default="policy_table.npz", help="Model or policy file, see policies.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-path", default=None, help="Serve on a Unix domain socket instead of TCP")
+    parser.add_argument("--max-batch-size", type=int, default=1024)
+    parser.add_argument("--max-delay-ms", type=float, default=2.0, help="Micro-batch deadline")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between stats lines")
+    parser.add_argument("--intersections", type=int, default=2000)
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--period", type=float, default=1.0, help="Seconds between readings per intersection")
+    parser.add_argument("--connections", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        service = SignalService(load_policy(args.policy), args.host, args.port, args.unix_path,
+                                args.max_batch_size, args.max_delay_ms / 1000)
+        try:
+            asyncio.run(service.serve_forever(args.report_interval))
+        except KeyboardInterrupt:
+            pass
+    else:
+        if args.mode == "load":
+            client_stats, server_stats, mean_reward = asyncio.run(generate_load(
+                args.intersections, args.ticks, args.period, args.connections, args.host, args.port,
+                args.unix_path,
+            ))
+            print(f"Mean reward per intersection over {args.ticks} ticks: {mean_reward:.2f}")
+        else:
+            client_stats, server_stats = asyncio.run(_bench(args))
+        print(f"Client round trip: {_format(client_stats)}")
+        print(f"Server queue+batch: {_format(server_stats)}, "
+              f"mean batch {server_stats.get('mean_batch_size', 0):.1f}")
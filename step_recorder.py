@@ -0,0 +1,169 @@
+import json
+import os
+
+import numpy as np
+
+META_FILE = "meta.json"
+
+
+class ColumnWriter:
+    """
+    Append-only columnar table backed by one raw binary file per column
+
+    Rows are written into preallocated typed chunks and each full chunk is
+    appended to the column files, so memory stays at chunk_size rows per
+    column however many rows are recorded. meta.json holds the schema and
+    row count and is rewritten after every flush, so a ColumnReader can
+    open the table while it is still being written.
+
+    Args:
+        path: Directory of the table, created if missing
+        columns: Mapping of column name to NumPy dtype
+        chunk_size: Rows buffered in memory between flushes
+    """
+
+    def __init__(self, path, columns, chunk_size=65536):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self.chunk_size = chunk_size
+        self.num_rows = 0
+        self._chunks = {name: np.empty(chunk_size, dtype=dtype) for name, dtype in self.columns.items()}
+        self._pos = 0
+        self._files = {name: open(os.path.join(path, f"{name}.bin"), "wb") for name in self.columns}
+        self._write_meta()
+
+    def append(self, **values):
+        """Append one row, given as one scalar per column"""
+        pos = self._pos
+        for name, chunk in self._chunks.items():
+            chunk[pos] = values[name]
+        self._pos += 1
+        if self._pos == self.chunk_size:
+            self.flush()
+
+    def append_rows(self, **arrays):
+        """Append equal-length arrays (or lists), one per column"""
+        arrays = {name: np.asarray(arrays[name], dtype=dtype) for name, dtype in self.columns.items()}
+        num_rows = len(next(iter(arrays.values())))
+        start = 0
+        while start < num_rows:
+            count = min(self.chunk_size - self._pos, num_rows - start)
+            for name, chunk in self._chunks.items():
+                chunk[self._pos:self._pos + count] = arrays[name][start:start + count]
+            self._pos += count
+            start += count
+            if self._pos == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """Write the buffered rows to disk and update meta.json"""
+        for name, chunk in self._chunks.items():
+            chunk[:self._pos].tofile(self._files[name])
+            self._files[name].flush()
+        self.num_rows += self._pos
+        self._pos = 0
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            "num_rows": self.num_rows,
+            "columns": {name: dtype.str for name, dtype in self.columns.items()},
+        }
+        tmp_path = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def close(self):
+        if self._files is None:
+            return
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ColumnReader:
+    """
+    Lazy reader of a ColumnWriter table
+
+    Columns are opened as read-only memory maps on first access, so only
+    the pages a computation touches are loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.num_rows = meta["num_rows"]
+        self.columns = {name: np.dtype(dtype) for name, dtype in meta["columns"].items()}
+        self._arrays = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            dtype = self.columns[name]
+            if self.num_rows == 0:
+                self._arrays[name] = np.empty(0, dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=dtype, mode="r",
+                                               shape=(self.num_rows,))
+        return self._arrays[name]
+
+
+class StepRecorder:
+    """
+    Per-step and per-episode columns of an evaluation run on disk
+
+    Steps go to `path/steps`, one row per env step, and episode summaries to
+    `path/episodes`, one row per episode. Read them back with
+    StepRecording.
+
+    Args:
+        path: Directory of the recording
+        step_columns: Mapping of step column name to dtype
+        episode_columns: Mapping of episode column name to dtype
+        chunk_size: Step rows buffered in memory between flushes
+    """
+
+    def __init__(self, path, step_columns, episode_columns, chunk_size=65536):
+        self.path = path
+        self.steps = ColumnWriter(os.path.join(path, "steps"), step_columns, chunk_size)
+        self.episodes = ColumnWriter(os.path.join(path, "episodes"), episode_columns, max(chunk_size // 256, 16))
+
+    def append_steps(self, **arrays):
+        self.steps.append_rows(**arrays)
+
+    def append_episode(self, **metrics):
+        self.episodes.append(**metrics)
+
+    def close(self):
+        self.steps.close()
+        self.episodes.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StepRecording:
+    """Lazy view of a StepRecorder directory"""
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = ColumnReader(os.path.join(path, "steps"))
+        self.episodes = ColumnReader(os.path.join(path, "episodes"))
@@ -0,0 +1,202 @@
+import argparse
+import math
+import time
+
+import numpy as np
+
+from traffic_env02 import ARRIVAL_SCALE, TrafficEnv, dynamic_arrival_rates
+
+NUM_APPROACHES = 4
+
+
+def arrival_matrix(rate, max_queue=10):
+    """P[q, q_next] of a queue after Poisson(rate) arrivals, capped at max_queue"""
+    pmf = np.array([math.exp(-rate) * rate**k / math.factorial(k) for k in range(max_queue + 1)])
+    matrix = np.zeros((max_queue + 1, max_queue + 1))
+    for q in range(max_queue + 1):
+        matrix[q, q:max_queue] = pmf[:max_queue - q]
+        matrix[q, max_queue] = 1.0 - matrix[q, :max_queue].sum()
+    return matrix
+
+
+def discharge_kernel(max_queue=10):
+    """
+    Discharge on the green pair of approaches
+
+    Returns:
+        (kernel, throughput): kernel[a, b, a', b'] is the probability that
+        green queues (a, b) become (a', b'); throughput[a, b] is the
+        expected throughput reward plus efficiency bonus for that step
+    """
+    size = max_queue + 1
+    kernel = np.zeros((size, size, size, size))
+    throughput = np.zeros((size, size))
+    offsets = np.arange(3)  # randint(base, base + 3)
+    for a in range(size):
+        for b in range(size):
+            base_passing = 2 + int(a > 5) + int(b > 5)
+            passed = base_passing + offsets
+            for pa in passed:
+                for pb in passed:
+                    kernel[a, b, max(0, a - pa), max(0, b - pb)] += 1 / 9
+                    throughput[a, b] += (5.0 * (pa + pb) + (2.0 if pa + pb >= 6 else 0)) / 9
+    return kernel, throughput
+
+
+def _post_step_terms(max_queue):
+    """Reward terms that depend only on the queues after the step, shape (Q+1,)*4"""
+    levels = np.arange(max_queue + 1)
+    q0, q1, q2, q3 = np.meshgrid(levels, levels, levels, levels, indexing="ij")
+    queue_penalty = 0.1 * sum(np.maximum(0, q - 5)**2 for q in (q0, q1, q2, q3))
+    ns_queue, ew_queue = q0 + q1, q2 + q3
+    balance_bonus = 1.0 / (1.0 + np.abs(ns_queue - ew_queue))
+    # Phase change penalty, waived when the new green side has 3+ more vehicles
+    switch_cost = [0.5 * ~(ns_queue > ew_queue + 3), 0.5 * ~(ew_queue > ns_queue + 3)]
+    return balance_bonus - queue_penalty, switch_cost
+
+
+def _apply_arrivals(values, matrices):
+    """E[values(q_next)] over independent arrivals on each of the four queue axes"""
+    for axis, matrix in enumerate(matrices):
+        values = np.moveaxis(np.tensordot(values, matrix, axes=([axis + 1], [1])), -1, axis + 1)
+    return values
+
+
+def _apply_discharge(values, kernel, throughput, action):
+    """E[values(q_next)] + expected throughput reward over green-pair discharge"""
+    size = values.shape[1]
+    pairs = size * size
+    flat = values.reshape(len(values), pairs, pairs)
+    kernel = kernel.reshape(pairs, pairs)
+    if action == 0:  # NS green: queue axes 0 and 1
+        out = kernel @ flat + throughput.reshape(1, pairs, 1)
+    else:  # EW green: queue axes 2 and 3
+        out = flat @ kernel.T + throughput.reshape(1, 1, pairs)
+    return out.reshape(values.shape)
+
+
+def solve_traffic_mdp(max_queue=10, max_steps=200, wait_cap=12, gamma=1.0, verbose=False):
+    """
+    Optimal TrafficEnv policy by backward induction over the episode
+
+    The state is (step, phase, red wait, four queues). The green pair's wait
+    is always 0 and both red approaches share one counter, so a single wait
+    value k covers wait_times; it is truncated at wait_cap, beyond which the
+    wait penalty stops growing. Arrival rates follow the demand schedule,
+    so the optimal policy depends on the step and is solved exactly over the
+    finite horizon, batched over every (wait, queues) state per action.
+
+    Returns:
+        (policy, values): policy[t, phase, k, index] is the optimal action at
+        step count t, with index the flattened queue state; values holds
+        the optimal expected return from step 0 for every start state
+    """
+    size = max_queue + 1
+    kernel, throughput = discharge_kernel(max_queue)
+    post_terms, switch_cost = _post_step_terms(max_queue)
+    waits = np.arange(wait_cap + 1)
+    wait_penalty = 0.05 * 2 * waits**1.5  # two red approaches
+    schedule = dynamic_arrival_rates(np.arange(max_steps + 1)) * ARRIVAL_SCALE
+
+    queue_shape = (size,) * NUM_APPROACHES
+    next_values = np.zeros((2, wait_cap + 1) + queue_shape)
+    policy = np.zeros((max_steps, 2, wait_cap + 1, size**NUM_APPROACHES), dtype=np.uint8)
+    start = time.perf_counter()
+
+    for t in reversed(range(max_steps)):
+        matrices = [arrival_matrix(rate, max_queue) for rate in schedule[t + 1]]
+        q_values = np.empty((2, 2, wait_cap + 1) + queue_shape)  # [phase, action, k]
+        for action in (0, 1):
+            # Value after the step for each next wait k' = 1..K (staying) and for a switch (k' = 1)
+            stay = gamma * next_values[action, 1:] + post_terms
+            switch = stay[:1] - switch_cost[action]
+            expected = _apply_arrivals(
+                _apply_discharge(np.concatenate([stay, switch]), kernel, throughput, action), matrices
+            )
+            expected[:-1] -= wait_penalty[1:, None, None, None, None]
+            expected[-1] -= wait_penalty[1]
+
+            # Keeping the phase moves k to min(k + 1, K); switching resets it to 1
+            stay_next = np.minimum(waits + 1, wait_cap) - 1
+            q_values[action, action] = expected[stay_next]
+            q_values[1 - action, action] = expected[-1]
+
+        policy[t] = np.argmax(q_values, axis=1).reshape(2, wait_cap + 1, -1)
+        next_values = q_values.max(axis=1)
+        if verbose and t % 50 == 0:
+            print(f"  step {t:>4}: V(empty) = {next_values[0, 0, 0, 0, 0, 0]:.2f} "
+                  f"({time.perf_counter() - start:.1f}s)")
+    return policy, next_values
+
+
+class TabularController:
+    """
+    Lookup-table controller from solve_traffic_mdp
+
+    The table is indexed by the env's full state (step count, phase, red
+    wait and queues), which the DQN only sees partially, so it is an upper
+    reference for what the observation-based agent can reach.
+    """
+
+    def __init__(self, policy, max_queue=10):
+        self.policy = policy
+        self.max_queue = max_queue
+        self.wait_cap = policy.shape[2] - 1
+
+    def predict_state(self, queues, phase, wait, step_count):
+        """Optimal actions for (batches of) raw env states"""
+        queues = np.asarray(queues)
+        base = self.max_queue + 1
+        index = ((queues[..., 0] * base + queues[..., 1]) * base + queues[..., 2]) * base + queues[..., 3]
+        t = np.minimum(step_count, len(self.policy) - 1)
+        return self.policy[t, phase, np.minimum(wait, self.wait_cap), index]
+
+    def act(self, env):
+        """Action for a TrafficEnv (or the unwrapped env of a wrapper)"""
+        env = getattr(env, "unwrapped", env)
+        return int(self.predict_state(env.queues, env.current_phase, int(np.max(env.wait_times)), env.step_count))
+
+    def save(self, path):
+        np.savez_compressed(path, policy=self.policy, max_queue=self.max_queue)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["policy"], int(data["max_queue"]))
+
+
+def evaluate_controller(controller, num_episodes=100, seed=0):
+    """Mean and std of episode returns of a TabularController in TrafficEnv"""
+    env = TrafficEnv(render_mode=None, fast=True)
+    returns = []
+    for episode in range(num_episodes):
+        env.reset(seed=seed + episode)
+        done = False
+        total_reward = 0
+        while not done:
+            _, reward, terminated, truncated, _ = env.step(controller.act(env))
+            total_reward += reward
+            done = terminated or truncated
+        returns.append(total_reward)
+    return float(np.mean(returns)), float(np.std(returns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve TrafficEnv exactly as a finite-horizon MDP")
+    parser.add_argument("--wait-cap", type=int, default=12)
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--episodes", type=int, default=100, help="Episodes to check the policy on")
+    parser.add_argument("-o", "--output", default="tabular_policy.npz")
+    args = parser.parse_args()
+
+    print("Solving TrafficEnv MDP...")
+    start = time.perf_counter()
+    policy, values = solve_traffic_mdp(wait_cap=args.wait_cap, gamma=args.gamma, verbose=True)
+    print(f"Solved in {time.perf_counter() - start:.1f}s")
+    print(f"Optimal expected return from an empty intersection: {values[0, 0, 0, 0, 0, 0]:.2f}")
+
+    controller = TabularController(policy)
+    controller.save(args.output)
+    mean_reward, std_reward = evaluate_controller(controller, args.episodes)
+    print(f"Simulated return over {args.episodes} episodes: {mean_reward:.2f} ± {std_reward:.2f}")
+    print(f"Policy table saved to {args.output}")
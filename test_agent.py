@@ -1,9 +1,15 @@
+import os
+
 import gymnasium as gym
 from stable_baselines3 import DQN
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from traffic_env02 import TrafficEnv  # Make sure this matches your environment file name
+from parallel_eval import map_episodes
+from policies import reset_policy
+from rolling_metrics import RollingMetrics
+from video_export import EpisodeExporter
 
 # Register the environment (same as in training)
 gym.register(
@@ -12,24 +18,123 @@ gym.register(
     max_episode_steps=200,
 )
 
-def test_trained_model(model_path, num_episodes=3, render=True, episode_lengths=None):
+class EpisodeEnvs:
+    """
+    TrafficEnv of test_trained_model, one per evaluation worker
+
+    Every episode runs in an env whose max_steps is that episode's own
+    length, so it terminates (and draws its traffic) exactly as an env
+    made for that length would. The env is only rebuilt when the length
+    changes from one episode to the next.
+    """
+    
+    def __init__(self, render_mode=None):
+        self.render_mode = render_mode
+        self.env = None
+    
+    def get(self, max_steps):
+        if self.env is None or self.env.unwrapped.max_steps != max_steps:
+            self.close()
+            # Random draws in bounded blocks keep memory flat for soak-length episodes
+            self.env = gym.make("TrafficEnv-v1", render_mode=self.render_mode, max_steps=max_steps,
+                                max_episode_steps=max_steps, fast=self.render_mode is None,
+                                rng_block_size=min(max_steps, 4096))
+        return self.env
+    
+    def close(self):
+        if self.env is not None:
+            self.env.close()
+            self.env = None
+
+def make_test_env(render_mode=None):
+    """EpisodeEnvs used by test_trained_model, built once per evaluation worker"""
+    return EpisodeEnvs(render_mode)
+
+def run_test_episode(model, envs, seed, max_steps, render=False, export_path=None, window=20):
+    """
+    Run one episode of test_trained_model
+    
+    Args:
+        envs: The worker's EpisodeEnvs; the episode runs in a max_steps env
+        export_path: Optional .mp4/.avi file or frame archive directory the
+                     episode's frames are streamed to (see video_export)
+    
+    Returns:
+        (total_reward, step_count, metrics, done) where metrics['rolling'] is
+        the episode's RollingMetrics
+    """
+    env = envs.get(max_steps)
+    obs, _ = env.reset(seed=seed)
+    reset_policy(model)
+    exporter = None
+    if export_path is not None:
+        traffic_env = env.unwrapped
+        exporter = EpisodeExporter(export_path, fps=traffic_env.metadata["render_fps"],
+                                   size=traffic_env.render_size, max_queue=traffic_env.max_queue)
+        exporter.add(*traffic_env.render_state())
+    try:
+        return _run_test_steps(model, env, obs, max_steps, render, exporter, window)
+    finally:
+        if exporter is not None:
+            exporter.close()
+
+def _run_test_steps(model, env, obs, max_steps, render, exporter, window):
+    done = False
+    total_reward = 0
+    step_count = 0
+    metrics = {
+        'vehicles_passed': 0,
+        'phase_changes': 0,
+        'rolling': RollingMetrics(window)
+    }
+    
+    while not done and step_count < max_steps:
+        action, _states = model.predict(obs, deterministic=True)
+        obs, reward, terminated, truncated, info = env.step(action)
+        
+        # Update metrics (exact per-step throughput from the env)
+        total_reward += reward
+        metrics['vehicles_passed'] += info.get('vehicles_passed', 0)
+        metrics['phase_changes'] += info.get('phase_changes', 0)
+        metrics['rolling'].update(info.get('vehicles_passed', 0), info.get('total_queues', 0),
+                                  info.get('max_wait_time', 0))
+        
+        step_count += 1
+        done = terminated or truncated
+        
+        if render:
+            env.render()
+        if exporter is not None:
+            exporter.add(*env.unwrapped.render_state())
+    return total_reward, step_count, metrics, done
+
+def test_trained_model(model_path, num_episodes=3, render=True, episode_lengths=None, seed=None, n_workers=1,
+                       export_dir=None, export_format="frames"):
     """
     Test trained model with customizable episode lengths
     
     Args:
-        model_path: Path to the saved model
+        model_path: Path to the saved model, or any policy policies.load_policy
+                    accepts (e.g. a baseline controller name such as "max_pressure")
         num_episodes: Number of episodes to run
         render: Whether to show visualization
         episode_lengths: List of episode lengths, or None for default (200 steps each)
                         Can be: [100, 150, 300] for different lengths
                                or "random" for random lengths between 50-400
                                or "progressive" for increasing lengths
+        seed: Base seed, episode i is seeded with seed + i
+        n_workers: Processes to shard the episodes over; results are identical
+                   for any worker count (seed defaults to 0 when n_workers > 1)
+        export_dir: Optional directory receiving a replay of every episode,
+                    rendered and written in the background (works headless
+                    and with n_workers > 1)
+        export_format: "frames" (chunked frame archive, NumPy only), or "mp4"
+                       / "avi" (encoded video, needs opencv-python)
     """
-    # Create environment
-    env = gym.make("TrafficEnv-v1", render_mode="human" if render else None)
-    
-    # Load the trained model
-    model = DQN.load(model_path)
+    if render and n_workers > 1:
+        raise ValueError("Rendering needs n_workers=1")
+    if n_workers > 1 and seed is None:
+        seed = 0  # every episode must be seeded for the shards to be reproducible
     
     # Set up episode lengths
     if episode_lengths is None:
@@ -48,42 +153,26 @@ def test_trained_model(model_path, num_episodes=3, render=True, episode_lengths=
     
     print(f"Testing {num_episodes} episodes with lengths: {episode_lengths}")
     
-    for episode in range(num_episodes):
+    # Episodes come back in seed order whatever the number of workers
+    export_paths = [None] * num_episodes
+    if export_dir is not None:
+        suffix = "" if export_format == "frames" else f".{export_format}"
+        export_paths = [os.path.join(export_dir, f"episode_{episode + 1:04d}{suffix}")
+                        for episode in range(num_episodes)]
+    tasks = [(None if seed is None else seed + episode, episode_lengths[episode], render, export_paths[episode])
+             for episode in range(num_episodes)]
+    results = map_episodes(run_test_episode, model_path, tasks, make_test_env,
+                           ("human" if render else None,), n_workers=n_workers)
+    
+    for episode, (total_reward, step_count, metrics, done) in enumerate(results):
         max_steps = episode_lengths[episode]
-        obs, _ = env.reset()
-        done = False
-        total_reward = 0
-        step_count = 0
-        metrics = {
-            'vehicles_passed': 0,
-            'total_queue': [],
-            'max_wait': [],
-            'phase_changes': 0
-        }
-        
         print(f"\n--- Episode {episode + 1} (Max Steps: {max_steps}) ---")
         
-        while not done and step_count < max_steps:
-            action, _states = model.predict(obs, deterministic=True)
-            obs, reward, terminated, truncated, info = env.step(action)
-            
-            # Update metrics
-            total_reward += reward
-            metrics['vehicles_passed'] += info.get('vehicles_passed', 0)
-            metrics['total_queue'].append(info.get('total_queues', 0))
-            metrics['max_wait'].append(info.get('max_wait_time', 0))
-            metrics['phase_changes'] += info.get('phase_changes', 0)
-            
-            step_count += 1
-            done = terminated or truncated
-            
-            if render:
-                env.render()
-        
         # Calculate performance metrics
-        efficiency = (metrics['vehicles_passed'] / step_count) * 100 if step_count > 0 else 0
-        avg_queue = np.mean(metrics['total_queue']) if metrics['total_queue'] else 0
-        max_wait = np.max(metrics['max_wait']) if metrics['max_wait'] else 0
+        rolling = metrics['rolling']
+        efficiency = rolling.efficiency
+        avg_queue = rolling.queue_stats.mean if step_count > 0 else 0
+        max_wait = int(rolling.wait_stats.max) if step_count > 0 else 0
         
         # Print episode summary
         print(f"Episode {episode + 1} Summary (Length: {max_steps} steps):")
@@ -95,59 +184,46 @@ def test_trained_model(model_path, num_episodes=3, render=True, episode_lengths=
         print(f"  Max Wait Time: {max_wait} steps")
         print(f"  Phase Changes: {metrics['phase_changes']}")
         print(f"  Episode Status: {'Completed naturally' if done else 'Reached max steps'}")
+        if export_paths[episode] is not None:
+            print(f"  Replay: {export_paths[episode]}")
         
         # Plot metrics for each episode if requested
         if render and episode == num_episodes - 1:  # Plot only last episode
+            history = rolling.history()
+            steps = history['step']
             plt.figure(figsize=(15, 10))
             
             plt.subplot(4, 1, 1)
-            plt.plot(metrics['total_queue'], 'b-', linewidth=2)
+            plt.plot(steps, history['total_queue'], 'b-', linewidth=2)
             plt.title(f'Queue Length Over Time (Episode {episode + 1}, {step_count} steps)')
             plt.ylabel('Total Vehicles')
             plt.grid(True, alpha=0.3)
             
             plt.subplot(4, 1, 2)
-            plt.plot(metrics['max_wait'], 'r-', linewidth=2)
+            plt.plot(steps, history['max_wait'], 'r-', linewidth=2)
             plt.title('Maximum Wait Time')
             plt.ylabel('Steps')
             plt.grid(True, alpha=0.3)
             
             plt.subplot(4, 1, 3)
-            # Calculate vehicles passed per step
-            vehicles_per_step = []
-            cumulative = 0
-            for i in range(len(metrics['total_queue'])):
-                # This is approximate - actual implementation would need step-by-step tracking
-                if i > 0 and metrics['total_queue'][i] < metrics['total_queue'][i-1]:
-                    vehicles_per_step.append(metrics['total_queue'][i-1] - metrics['total_queue'][i])
-                else:
-                    vehicles_per_step.append(0)
-            
-            plt.bar(range(len(vehicles_per_step)), vehicles_per_step, alpha=0.7, color='green')
-            plt.title('Vehicles Passed Per Step (Approximate)')
+            plt.bar(steps, history['vehicles_passed'], alpha=0.7, color='green')
+            plt.title('Vehicles Passed Per Step')
             plt.ylabel('Vehicles')
             plt.grid(True, alpha=0.3)
             
             plt.subplot(4, 1, 4)
-            # Show efficiency over time (rolling average)
-            if len(metrics['total_queue']) > 10:
-                window_size = min(20, len(metrics['total_queue']) // 4)
-                rolling_efficiency = []
-                for i in range(window_size, len(metrics['total_queue'])):
-                    window_vehicles = sum(vehicles_per_step[i-window_size:i])
-                    efficiency_val = (window_vehicles / window_size) * 100
-                    rolling_efficiency.append(efficiency_val)
-                
-                plt.plot(range(window_size, len(metrics['total_queue'])), rolling_efficiency, 'purple', linewidth=2)
-                plt.title(f'Rolling Efficiency (Window: {window_size} steps)')
-                plt.ylabel('Efficiency %')
-                plt.xlabel('Time Step')
-                plt.grid(True, alpha=0.3)
+            # Show efficiency over time (rolling average, once the window is full)
+            full = steps >= rolling.window
+            plt.plot(steps[full], history['rolling_efficiency'][full], 'purple', linewidth=2)
+            plt.title(f'Rolling Efficiency (Window: {rolling.window} steps)')
+            plt.ylabel('Efficiency %')
+            plt.xlabel('Time Step')
+            plt.grid(True, alpha=0.3)
             
             plt.tight_layout()
             plt.show()
     
-    env.close()
+    return results
 
 # Additional convenience functions
 def test_short_episodes(model_path="dqn_traffic_optimized.zip"):
@@ -158,6 +234,15 @@ def test_long_episodes(model_path="dqn_traffic_optimized.zip"):
     """Test with long episodes (300-500 steps)"""
     test_trained_model(model_path, num_episodes=3, episode_lengths=[300, 400, 500])
 
+def test_soak(model_path="dqn_traffic_optimized.zip", num_steps=1_000_000):
+    """Soak test: one very long episode in linear time and bounded memory"""
+    test_trained_model(model_path, num_episodes=1, render=False, episode_lengths=[num_steps], seed=0)
+
+def test_export_replays(model_path="dqn_traffic_optimized.zip", export_dir="replays", export_format="frames"):
+    """Headless run writing a replay of every episode (e.g. on CI)"""
+    test_trained_model(model_path, num_episodes=6, render=False, episode_lengths=[100, 200, 300, 150, 250, 400],
+                       seed=0, export_dir=export_dir, export_format=export_format)
+
 def test_varied_episodes(model_path="dqn_traffic_optimized.zip"):
     """Test with varied episode lengths"""
     test_trained_model(model_path, num_episodes=6, episode_lengths=[100, 200, 300, 150, 250, 400])
@@ -187,4 +272,6 @@ if __name__ == "__main__":
     print("5. python -c \"from test_agent import *; test_random_episodes()\"")
     print("6. python -c \"from test_agent import *; test_progressive_episodes()\"")
     print("7. python -c \"from test_agent import *; test_trained_model('dqn_traffic_optimized.zip', 3, True, [120, 180, 250])\"")
+    print("8. python -c \"from test_agent import *; test_soak()\"")
+    print("9. python -c \"from test_agent import *; test_export_replays()\"")
     print("="*60)
\ No newline at end of file
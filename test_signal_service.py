@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from policies import load_policy
+from signal_service import SignalClient, SignalService
+
+
+async def _with_service(check, max_delay=0.002):
+    service = await SignalService(load_policy("max_pressure"), port=0, max_delay=max_delay).start()
+    client = await SignalClient.connect(port=service.port)
+    try:
+        return await check(service, client)
+    finally:
+        await client.close()
+        await service.stop()
+
+
+@pytest.mark.parametrize("obs", [[0.1, 0.2, 0.3], [0.1, float("nan"), 0.3, 0.4, 0.0], [[0.1, 0.2], [0.3, 0.4]]])
+def test_malformed_observation_gets_an_error(obs):
+    async def check(service, client):
+        response = await asyncio.wait_for(client.request({"obs": obs}), timeout=5)
+        assert response["id"] is not None
+        assert response["error"].startswith("bad request")
+        # The connection keeps serving well-formed requests
+        assert await asyncio.wait_for(client.phase([0.0, 0.0, 0.5, 0.5, 0.0]), timeout=5) == 1
+
+    asyncio.run(_with_service(check))
+
+
+def test_error_without_id_fails_pending_requests():
+    async def check(service, client):
+        # The batcher holds the request for a second, so the error for the
+        # unparsable line arrives first and can't be matched to a request
+        pending = client.request({"obs": [0.0, 0.0, 0.0, 0.0, 0.0]})
+        client.writer.write(b"not json\n")
+        with pytest.raises(RuntimeError, match="without a request id"):
+            await asyncio.wait_for(pending, timeout=5)
+
+    asyncio.run(_with_service(check, max_delay=1.0))
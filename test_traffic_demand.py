@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from traffic_demand import TraceDemand, open_trace
+from traffic_env02 import ARRIVAL_SCALE, TrafficEnv
+
+
+def _sampled_arrivals(env):
+    # Arrivals row used by the step just taken
+    return env._arrival_block[env._block_pos - 1]
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_trace_rate_matches_sampled_arrivals(fast):
+    # Counts at scale 1 are replayed as is, and every row is distinct
+    trace = np.arange(400, dtype=np.float32).reshape(100, 4)
+    env = TrafficEnv(render_mode=None, fast=fast, max_steps=30, rng_block_size=7, demand=TraceDemand(trace))
+    env.reset(seed=0, options={"trace_offset": 95})  # wraps at the end of the trace
+    assert np.array_equal(env.get_dynamic_arrival_rate(), trace[95])
+    for _ in range(30):
+        env.step(0)
+        assert np.array_equal(env.get_dynamic_arrival_rate(), _sampled_arrivals(env))
+
+
+def test_schedule_rate_matches_sampling_rate():
+    env = TrafficEnv(render_mode=None, max_steps=200, rng_block_size=16)
+    env.reset(seed=0)
+    for step in range(1, 201):
+        env.step(step % 2)
+        sampled_rate = env._rate_table[min(step, len(env._rate_table) - 1)] / ARRIVAL_SCALE
+        assert np.allclose(env.get_dynamic_arrival_rate(), sampled_rate)
+
+
+def test_csv_cache_is_keyed_on_columns(tmp_path):
+    csv_path = tmp_path / "detectors.csv"
+    csv_path.write_text("N,S,E,W,X\n1,2,3,4,5\n6,7,8,9,10\n")
+    assert np.array_equal(open_trace(str(csv_path)), [[1, 2, 3, 4], [6, 7, 8, 9]])
+    # A different column selection must not reuse the cache of the first one
+    assert np.array_equal(open_trace(str(csv_path), columns=["X", "W", "E", "S"]), [[5, 4, 3, 2], [10, 9, 8, 7]])
+    assert np.array_equal(open_trace(str(csv_path), columns=[4, 3, 2, 1]), [[5, 4, 3, 2], [10, 9, 8, 7]])
+    assert np.array_equal(open_trace(str(csv_path)), [[1, 2, 3, 4], [6, 7, 8, 9]])
@@ -0,0 +1,182 @@
+import argparse
+import itertools
+import os
+
+import numpy as np
+
+APPROACHES = ["N", "S", "E", "W"]
+
+
+def _parse_columns(header, columns):
+    """Resolve column names or indices for the four approaches"""
+    if columns is None:
+        return list(range(len(APPROACHES)))
+    if header is None:
+        return [int(column) for column in columns]
+    names = [name.strip() for name in header]
+    return [names.index(column) if column in names else int(column) for column in columns]
+
+
+def convert_csv_trace(csv_path, npy_path=None, columns=None, delimiter=",",
+                      dtype=np.float32, chunk_rows=1_000_000):
+    """
+    Convert a detector-count CSV into a .npy cache that can be memory-mapped
+
+    The CSV is streamed twice (once to count rows, once to fill the output)
+    in chunks of chunk_rows lines, so neither the text nor the parsed array
+    has to fit in RAM.
+
+    Args:
+        csv_path: CSV with one row per time step
+        npy_path: Output path, defaults to csv_path with a .npy suffix
+        columns: Four column names or indices in [N, S, E, W] order,
+                 or None for the first four columns
+        delimiter: CSV field separator
+        dtype: Stored dtype (float32 holds both counts and rates)
+        chunk_rows: Lines parsed per chunk
+
+    Returns:
+        Path of the written .npy file
+    """
+    if npy_path is None:
+        npy_path = os.path.splitext(csv_path)[0] + ".npy"
+
+    with open(csv_path) as f:
+        first_line = f.readline()
+        fields = first_line.strip().split(delimiter)
+        try:
+            [float(field) for field in fields]
+            header = None
+        except ValueError:
+            header = fields
+        num_rows = sum(1 for line in f if line.strip()) + (header is None)
+    column_idx = _parse_columns(header, columns)
+
+    # Write to a temporary file so an interrupted conversion never leaves
+    # a truncated cache behind
+    tmp_path = npy_path + ".tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(num_rows, len(APPROACHES)))
+    with open(csv_path) as f:
+        if header is not None:
+            f.readline()
+        lines = (line for line in f if line.strip())
+        row = 0
+        while True:
+            chunk = list(itertools.islice(lines, chunk_rows))
+            if not chunk:
+                break
+            values = np.loadtxt(chunk, delimiter=delimiter, usecols=column_idx, dtype=dtype, ndmin=2)
+            out[row:row + len(values)] = values
+            row += len(values)
+    out.flush()
+    del out
+    os.replace(tmp_path, npy_path)
+    return npy_path
+
+
+def _columns_suffix(columns):
+    """Cache file suffix for a column selection, empty for the default columns"""
+    if columns is None:
+        return ""
+    names = ("".join(c if c.isalnum() else "_" for c in str(column)) for column in columns)
+    return ".cols-" + "-".join(names)
+
+
+def open_trace(path, columns=None, dtype=np.float32):
+    """
+    Open a per-approach trace as a read-only (T, 4) memory-mapped array
+
+    .npy files are mapped directly. CSV files are converted once into a
+    .npy cache next to them (one per column selection), which is rebuilt
+    only when the CSV is newer. Any other file is read as raw binary of
+    the given dtype with four values per time step.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        cache_path = os.path.splitext(path)[0] + _columns_suffix(columns) + ".npy"
+        if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(path):
+            convert_csv_trace(path, cache_path, columns=columns, dtype=dtype)
+        path = cache_path
+        ext = ".npy"
+
+    if ext == ".npy":
+        trace = np.load(path, mmap_mode="r")
+    else:
+        trace = np.memmap(path, dtype=dtype, mode="r").reshape(-1, len(APPROACHES))
+
+    if trace.ndim != 2 or trace.shape[1] != len(APPROACHES):
+        raise ValueError(f"Trace {path} has shape {trace.shape}, expected (T, {len(APPROACHES)})")
+    return trace
+
+
+class TraceDemand:
+    """
+    Demand source for TrafficEnv that replays a recorded detector trace
+
+    Args:
+        trace: Path accepted by open_trace, or an already opened (T, 4) array
+        kind: "counts" replays the recorded vehicles per step directly,
+              "rates" draws Poisson arrivals with the recorded means
+        scale: Multiplier applied to the trace values
+        start: "random" starts each episode at a random offset,
+               "sequential" continues where the previous episode ended
+    """
+
+    def __init__(self, trace, kind="counts", scale=1.0, start="random"):
+        if kind not in ("counts", "rates"):
+            raise ValueError(f"Unknown trace kind: {kind}")
+        if start not in ("random", "sequential"):
+            raise ValueError(f"Unknown start mode: {start}")
+        self.trace = open_trace(trace) if isinstance(trace, (str, os.PathLike)) else trace
+        self.kind = kind
+        self.scale = scale
+        self.start = start
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self.trace)
+
+    def sample_offset(self, rng, episode_length):
+        """Trace position of the first step of a new episode"""
+        if self.start == "sequential":
+            offset = self._cursor
+            self._cursor = (self._cursor + episode_length) % len(self.trace)
+            return offset
+        return int(rng.integers(0, max(1, len(self.trace) - episode_length + 1)))
+
+    def window(self, position, num_steps):
+        """(num_steps, 4) trace rows from position, wrapping at the end of the trace"""
+        position %= len(self.trace)
+        end = position + num_steps
+        if end <= len(self.trace):
+            return self.trace[position:end]  # view into the memory map
+        return np.concatenate([self.trace[position:], self.window(0, end - len(self.trace))])
+
+    def draw(self, rng, position, num_steps):
+        """Arrivals for num_steps consecutive steps starting at a trace position"""
+        values = self.window(position, num_steps)
+        if not (values >= 0).all():  # also catches NaN
+            raise ValueError(f"Trace has negative or missing demand in steps {position}..{position + num_steps - 1}")
+        if self.kind == "rates":
+            return rng.poisson(values * self.scale)
+        # Counts are rounded, never truncated, scaled or not
+        return np.rint(values * self.scale).astype(np.int64)
+
+    def rate_at(self, position):
+        """Mean arrivals per approach at a trace position"""
+        return self.trace[position % len(self.trace)] * self.scale
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a detector-count CSV into a memory-mappable .npy trace")
+    parser.add_argument("csv_path")
+    parser.add_argument("-o", "--output", default=None)
+    parser.add_argument("--columns", nargs=4, default=None, help="Columns for the N S E W approaches")
+    parser.add_argument("--delimiter", default=",")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    output = convert_csv_trace(args.csv_path, args.output, columns=args.columns,
+                               delimiter=args.delimiter, chunk_rows=args.chunk_rows)
+    trace = open_trace(output)
+    print(f"Wrote {output}: {trace.shape[0]:,} steps x {trace.shape[1]} approaches ({trace.dtype})")
@@ -3,42 +3,130 @@ from gymnasium import spaces
 import numpy as np
 import matplotlib.pyplot as plt
 
+from traffic_renderer import TrafficRenderer
+from vehicle_queues import VehicleQueue
+
+
+# Arrival rates per approach [N, S, E, W] for each demand regime of an episode
+ARRIVAL_REGIMES = np.array([
+    [1.5, 1.5, 2.5, 2.5],  # More EW traffic
+    [2.5, 2.5, 1.5, 1.5],  # More NS traffic
+    [2.0, 2.0, 2.0, 2.0],  # Balanced heavy traffic
+    [1.0, 1.0, 1.0, 1.0],  # Balanced light traffic
+])
+REGIME_BOUNDARIES = np.array([50, 100, 150])
+ARRIVAL_SCALE = 1.2  # Slightly increased traffic
+
+
+def dynamic_arrival_rates(step_counts):
+    """Vectorized get_dynamic_arrival_rate: one row of rates per step count"""
+    regimes = np.searchsorted(REGIME_BOUNDARIES, step_counts, side="right")
+    return ARRIVAL_REGIMES[regimes]
+
 
 class TrafficEnv(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 4}
 
-    def __init__(self, render_mode="human"):
+    def __init__(self, render_mode="human", fast=False, max_steps=200, rng_block_size=None, demand=None,
+                 render_size=256, render_delay=0.1, vehicle_level=False, profiler=None,
+                 reward_components=True):
         super().__init__()
         self.render_mode = render_mode
         self.action_space = spaces.Discrete(2)  # 0: NS green, 1: EW green
         self.observation_space = spaces.Box(low=0, high=100, shape=(5,), dtype=np.float32)
         self.max_queue = 10
-        self.max_steps = 200
+        self.max_steps = max_steps
+
+        # Demand schedule: arrival rates per step, precomputed so a step only
+        # indexes into it. Rates are constant after the last regime boundary,
+        # so lookups clamp to the last row and the table doesn't grow with max_steps
+        schedule_steps = np.arange(REGIME_BOUNDARIES[-1] + 1)
+        self.arrival_schedule = dynamic_arrival_rates(schedule_steps)
+        self._rate_table = self.arrival_schedule * ARRIVAL_SCALE
+        # Arrivals and discharge counts are drawn from self.np_random in
+        # blocks of this many steps (one block per episode by default)
+        self.rng_block_size = rng_block_size or self.max_steps
+        # Optional recorded demand (traffic_demand.TraceDemand) replacing the schedule
+        self.demand = demand
+        self.trace_offset = 0
+
+        # Fast mode: same transitions and rewards, computed with scalar
+        # arithmetic on lookup tables
+        self.fast = fast
+        self._wait_power = (np.arange(64)**1.5).tolist()  # wait**1.5, grown when longer waits occur
+        # With reward_components=False info leaves out the per-term reward
+        # breakdown, which callers that only train on the reward never read
+        self.reward_components = reward_components
+        # Vehicle-level mode: arrival step of every queued vehicle, for exact
+        # per-vehicle delays (info["vehicle_delays"], vehicles.delay_summary()
+        # for the current episode). Transitions and rewards are unchanged.
+        self.vehicles = VehicleQueue(self.max_queue) if vehicle_level else None
+        # Optional profiling.StageProfiler timing the stages of sampled steps
+        # ("env.arrivals", "env.discharge", "env.reward", "env.info", ...)
+        self.profiler = profiler
         self.reset()
 
+        # Frames are drawn with NumPy into one reused buffer (traffic_renderer),
+        # created on the first render
+        self.render_size = render_size
+        self.render_delay = render_delay  # seconds each human-mode frame is shown
+        self.renderer = None
+        self._image = None
+
         if self.render_mode == "human":
             plt.ion()
             self.fig, self.ax = plt.subplots(figsize=(5, 5))
 
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
+        if self.demand is not None:
+            options = options or {}
+            self.trace_offset = options.get("trace_offset")
+            if self.trace_offset is None:
+                self.trace_offset = self.demand.sample_offset(self.np_random, self.max_steps)
         self.queues = np.zeros(4, dtype=np.int32)  # [N, S, E, W]
         self.wait_times = np.zeros(4, dtype=np.int32)
         self.current_phase = 0  # 0: NS green, 1: EW green
         self.traffic_light_state = "NS_green"
         self.step_count = 0
+        if self.vehicles is not None:
+            self.vehicles.reset()
+            self.vehicles.reset_statistics()
+        self._draw_random_block()
         return self._get_obs(), {}
 
     def get_dynamic_arrival_rate(self):
-        # More realistic dynamic traffic pattern
-        if 0 <= self.step_count < 50:
-            return np.array([1.5, 1.5, 2.5, 2.5])  # More EW traffic
-        elif 50 <= self.step_count < 100:
-            return np.array([2.5, 2.5, 1.5, 1.5])  # More NS traffic
-        elif 100 <= self.step_count < 150:
-            return np.array([2.0, 2.0, 2.0, 2.0])  # Balanced heavy traffic
+        # More realistic dynamic traffic pattern, see ARRIVAL_REGIMES.
+        # Rate of the step just taken (of the first step before any): step s
+        # samples schedule row s, or trace row trace_offset + s - 1
+        if self.demand is not None:
+            return self.demand.rate_at(self.trace_offset + max(self.step_count, 1) - 1)
+        return self.arrival_schedule[min(self.step_count, len(self.arrival_schedule) - 1)]
+
+    def _draw_random_block(self):
+        """Draw arrivals and discharge offsets for the next rng_block_size steps"""
+        first_step = self.step_count + 1
+        if self.demand is not None:
+            self._arrival_block = self.demand.draw(
+                self.np_random, self.trace_offset + first_step - 1, self.rng_block_size
+            )
         else:
-            return np.array([1.0, 1.0, 1.0, 1.0])  # Balanced light traffic
+            steps = np.arange(first_step, first_step + self.rng_block_size)
+            rates = self._rate_table[np.minimum(steps, len(self._rate_table) - 1)]
+            self._arrival_block = self.np_random.poisson(rates)
+        # randint(base, base + 3) is base plus an offset uniform in {0, 1, 2},
+        # so the offsets can be drawn before the queue state is known
+        self._discharge_block = self.np_random.integers(0, 3, size=(self.rng_block_size, 2))
+        self._arrival_rows = self._arrival_block.tolist()
+        self._discharge_rows = self._discharge_block.tolist()
+        self._block_pos = 0
+
+    def _next_block_row(self):
+        if self._block_pos == self.rng_block_size:
+            self._draw_random_block()
+        row = self._block_pos
+        self._block_pos += 1
+        return row
 
     def _get_obs(self):
         # Normalized observation space (0-1 range)
@@ -46,6 +134,11 @@ class TrafficEnv(gym.Env):
         return np.concatenate((normalized_queues.astype(np.float32), [np.float32(self.current_phase)]))
 
     def step(self, action):
+        timer = self.profiler.sample() if self.profiler is not None else None
+        if self.fast:
+            return self._fast_step(action, timer)
+
+        row = self._next_block_row()
         self.step_count += 1
 
         # Phase change penalty (smaller penalty that decays with justification)
@@ -53,28 +146,33 @@ class TrafficEnv(gym.Env):
         self.current_phase = action
         self.traffic_light_state = "NS_green" if action == 0 else "EW_green"
 
-        # Dynamic vehicle arrivals - more realistic distribution
-        dynamic_rate = self.get_dynamic_arrival_rate()
-        arrivals = np.random.poisson(dynamic_rate * 1.2)  # Slightly increased traffic
+        # Dynamic vehicle arrivals - drawn ahead from the demand schedule
+        arrivals = self._arrival_block[row]
+        queued_before = self.queues
         self.queues = np.minimum(self.queues + arrivals, self.max_queue)
+        queued = self.queues.tolist() if self.vehicles is not None else None
+        if timer is not None:
+            timer.lap("env.arrivals")
 
         # Vehicle passing - more vehicles can pass when queues are longer
         if self.current_phase == 0:  # NS green
             base_passing = 2 + int(self.queues[0] > 5) + int(self.queues[1] > 5)
-            passed = np.random.randint(base_passing, base_passing + 3, size=2)
+            passed = base_passing + self._discharge_block[row]
             self.queues[0] = max(0, self.queues[0] - passed[0])
             self.queues[1] = max(0, self.queues[1] - passed[1])
             self.wait_times[0:2] = 0
             self.wait_times[2:4] += 1
         else:  # EW green
             base_passing = 2 + int(self.queues[2] > 5) + int(self.queues[3] > 5)
-            passed = np.random.randint(base_passing, base_passing + 3, size=2)
+            passed = base_passing + self._discharge_block[row]
             self.queues[2] = max(0, self.queues[2] - passed[0])
             self.queues[3] = max(0, self.queues[3] - passed[1])
             self.wait_times[2:4] = 0
             self.wait_times[0:2] += 1
 
         vehicles_passed = passed[0] + passed[1]
+        if timer is not None:
+            timer.lap("env.discharge")
         
         # New reward components
         throughput_reward = 5.0 * vehicles_passed  # Strong reward for moving vehicles
@@ -108,6 +206,8 @@ class TrafficEnv(gym.Env):
             + efficiency_bonus
             + balance_bonus
         )
+        if timer is not None:
+            timer.lap("env.reward")
 
         terminated = self.step_count >= self.max_steps
         truncated = False
@@ -116,7 +216,9 @@ class TrafficEnv(gym.Env):
             "total_queues": np.sum(self.queues),
             "max_wait_time": np.max(self.wait_times),
             "phase_changes": int(phase_change_cost > 0),
-            "reward_components": {
+        }
+        if self.reward_components:
+            info["reward_components"] = {
                 "throughput": throughput_reward,
                 "queue_penalty": -queue_penalty,
                 "wait_penalty": -wait_penalty,
@@ -124,41 +226,148 @@ class TrafficEnv(gym.Env):
                 "efficiency_bonus": efficiency_bonus,
                 "balance_bonus": balance_bonus
             }
-        }
+        if timer is not None:
+            timer.lap("env.info")
+        if self.vehicles is not None:
+            self._track_vehicles(queued, queued_before.tolist(), self.queues.tolist(), info)
+            if timer is not None:
+                timer.lap("env.vehicles")
         
-        return self._get_obs(), reward, terminated, truncated, info
+        obs = self._get_obs()
+        if timer is not None:
+            timer.lap("env.observation")
+        return obs, reward, terminated, truncated, info
+
+    def _track_vehicles(self, queued, queued_before, queued_after, info):
+        """Move vehicles through the timestamp queues and report their delays"""
+        vehicles = self.vehicles
+        admitted = [q - before for q, before in zip(queued, queued_before)]
+        discharged = [q - after for q, after in zip(queued, queued_after)]
+        vehicles.enqueue(admitted, self.step_count)
+        # Steps waited by each vehicle that left, oldest first
+        info["vehicle_delays"] = vehicles.dequeue(discharged, self.step_count)
+        info["max_vehicle_wait"] = max(vehicles.oldest_wait(self.step_count))
+
+    def _fast_step(self, action, timer=None):
+        """step() without NumPy work on length-4 arrays; reads the same random draws"""
+        action = int(action)
+        row = self._next_block_row()
+        self.step_count += 1
+
+        phase_change_cost = 0.5 if action != self.current_phase else 0
+        self.current_phase = action
+        self.traffic_light_state = "NS_green" if action == 0 else "EW_green"
+
+        arrivals = self._arrival_rows[row]
+        max_queue = self.max_queue
+        q0, q1, q2, q3 = queued_before = self.queues.tolist()
+        q0 = min(q0 + arrivals[0], max_queue)
+        q1 = min(q1 + arrivals[1], max_queue)
+        q2 = min(q2 + arrivals[2], max_queue)
+        q3 = min(q3 + arrivals[3], max_queue)
+        queued = (q0, q1, q2, q3)
+        if timer is not None:
+            timer.lap("env.arrivals")
+
+        w0, w1, w2, w3 = self.wait_times.tolist()
+        offset0, offset1 = self._discharge_rows[row]
+        if action == 0:  # NS green
+            base_passing = 2 + (q0 > 5) + (q1 > 5)
+            p0, p1 = base_passing + offset0, base_passing + offset1
+            q0 = max(0, q0 - p0)
+            q1 = max(0, q1 - p1)
+            w0, w1, w2, w3 = 0, 0, w2 + 1, w3 + 1
+        else:  # EW green
+            base_passing = 2 + (q2 > 5) + (q3 > 5)
+            p0, p1 = base_passing + offset0, base_passing + offset1
+            q2 = max(0, q2 - p0)
+            q3 = max(0, q3 - p1)
+            w0, w1, w2, w3 = w0 + 1, w1 + 1, 0, 0
+        self.queues[:] = (q0, q1, q2, q3)
+        self.wait_times[:] = (w0, w1, w2, w3)
+        if timer is not None:
+            timer.lap("env.discharge")
+
+        vehicles_passed = p0 + p1
+        throughput_reward = 5.0 * vehicles_passed
+        queue_penalty = 0.1 * (
+            max(0, q0 - 5)**2 + max(0, q1 - 5)**2 + max(0, q2 - 5)**2 + max(0, q3 - 5)**2
+        )
+        wait_power = self._wait_power
+        if max(w0, w1, w2, w3) >= len(wait_power):
+            size = max(2 * len(wait_power), max(w0, w1, w2, w3) + 1)
+            wait_power = self._wait_power = (np.arange(size)**1.5).tolist()
+        wait_penalty = 0.05 * (wait_power[w0] + wait_power[w1] + wait_power[w2] + wait_power[w3])
+
+        ns_queue = q0 + q1
+        ew_queue = q2 + q3
+        if phase_change_cost > 0:
+            if (action == 0 and ns_queue > ew_queue + 3) or (action == 1 and ew_queue > ns_queue + 3):
+                phase_change_cost = 0
+        efficiency_bonus = 2.0 if vehicles_passed >= 6 else 0
+        balance_bonus = 1.0 / (1.0 + abs(ns_queue - ew_queue))
+
+        reward = (
+            throughput_reward
+            - queue_penalty
+            - wait_penalty
+            - phase_change_cost
+            + efficiency_bonus
+            + balance_bonus
+        )
+        if timer is not None:
+            timer.lap("env.reward")
+
+        terminated = self.step_count >= self.max_steps
+        info = {
+            "vehicles_passed": vehicles_passed,
+            "total_queues": ns_queue + ew_queue,
+            "max_wait_time": max(w0, w1, w2, w3),
+            "phase_changes": int(phase_change_cost > 0),
+        }
+        if self.reward_components:
+            info["reward_components"] = {
+                "throughput": throughput_reward,
+                "queue_penalty": -queue_penalty,
+                "wait_penalty": -wait_penalty,
+                "phase_change": -phase_change_cost,
+                "efficiency_bonus": efficiency_bonus,
+                "balance_bonus": balance_bonus
+            }
+        if timer is not None:
+            timer.lap("env.info")
+        if self.vehicles is not None:
+            self._track_vehicles(queued, queued_before, (q0, q1, q2, q3), info)
+            if timer is not None:
+                timer.lap("env.vehicles")
+
+        obs = np.array((q0 / max_queue, q1 / max_queue, q2 / max_queue, q3 / max_queue, action), dtype=np.float32)
+        if timer is not None:
+            timer.lap("env.observation")
+        return obs, reward, terminated, False, info
 
     def render(self):
         if self.render_mode == "rgb_array":
-            # For rgb_array mode, create figure without displaying
-            fig, ax = plt.subplots(figsize=(5, 5))
-            self._render_traffic_state(ax)
-            fig.canvas.draw()
-            # Convert to RGB array
-            buf = fig.canvas.buffer_rgba()
-            w, h = fig.canvas.get_width_height()
-            rgb_array = np.frombuffer(buf, dtype=np.uint8).reshape((h, w, 4))[:, :, :3]
-            plt.close(fig)
-            return rgb_array
-        
+            # Drawn into the renderer's reused buffer: copy frames you keep
+            return self._draw_frame()
+
         elif self.render_mode == "human":
-            self._render_traffic_state(self.ax)
-            plt.pause(0.1)
-
-    def _render_traffic_state(self, ax):
-        ax.clear()
-        directions = ['N', 'S', 'E', 'W']
-        colors = ['red', 'red', 'green', 'green'] if self.traffic_light_state == "NS_green" else ['green', 'green',
-                                                                                                    'red', 'red']
-        positions = [(0.5, 0.8), (0.5, 0.2), (0.8, 0.5), (0.2, 0.5)]
-
-        for i, (pos, qlen, color) in enumerate(zip(positions, self.queues, colors)):
-            ax.text(pos[0], pos[1], f"{directions[i]}: {qlen}\nWait: {self.wait_times[i]}",
-                     color=color, fontsize=12, ha='center', va='center')
-
-        ax.set_title(f"Step {self.step_count} - Light: {self.traffic_light_state}\n"
-                      f"Total Queue: {np.sum(self.queues)} | Max Wait: {np.max(self.wait_times)}")
-        ax.axis('off')
+            frame = self._draw_frame()
+            if self._image is None:
+                self._image = self.ax.imshow(frame)
+                self.ax.axis('off')
+            else:
+                self._image.set_data(frame)
+            plt.pause(self.render_delay)
+
+    def render_state(self):
+        """Snapshot of what a frame shows, as TrafficRenderer.draw arguments (see video_export)"""
+        return self.queues.tolist(), self.wait_times.tolist(), self.current_phase, self.step_count
+
+    def _draw_frame(self):
+        if self.renderer is None:
+            self.renderer = TrafficRenderer(self.render_size, self.max_queue)
+        return self.renderer.draw(*self.render_state())
 
     def close(self):
         if self.render_mode == "human":
@@ -0,0 +1,177 @@
+import gymnasium as gym
+from gymnasium import spaces
+import numpy as np
+import scipy.sparse as sp
+
+from traffic_env02 import ARRIVAL_SCALE, REGIME_BOUNDARIES, dynamic_arrival_rates
+from vec_traffic_env import APPROACH_PHASE, batched_reward
+
+# Direction of travel (row, col) of vehicles queued on each approach [N, S, E, W]:
+# the N queue holds southbound vehicles that entered from the north side
+TRAVEL_DIRECTIONS = np.array([[1, 0], [-1, 0], [0, -1], [0, 1]])
+
+
+def _entry_approach(directions):
+    """Approach a vehicle joins when it enters a junction travelling in `directions`"""
+    # southbound -> N, northbound -> S, westbound -> E, eastbound -> W
+    return np.select(
+        [directions[:, 0] == 1, directions[:, 0] == -1, directions[:, 1] == -1],
+        [0, 1, 2],
+        default=3,
+    )
+
+
+def grid_routing(rows, cols, turn_probs=(0.7, 0.15, 0.15)):
+    """
+    Sparse routing matrix for a rows x cols grid of four-approach junctions
+
+    Entry [4*i + a, 4*j + b] is the fraction of vehicles discharged from
+    approach a of junction i that join approach b of junction j. Rows sum
+    to less than one on the edge of the grid, where vehicles leave the
+    network.
+
+    Args:
+        rows, cols: Grid size, junction i sits at (i // cols, i % cols)
+        turn_probs: (straight, left, right) turning fractions
+    """
+    num_junctions = rows * cols
+    junction = np.repeat(np.arange(num_junctions), 4)
+    approach = np.tile(np.arange(4), num_junctions)
+    row, col = junction // cols, junction % cols
+    heading = TRAVEL_DIRECTIONS[approach]
+
+    # Left and right of a heading (dr, dc) with rows growing southwards
+    turns = [
+        heading,
+        np.stack([-heading[:, 1], heading[:, 0]], axis=1),
+        np.stack([heading[:, 1], -heading[:, 0]], axis=1),
+    ]
+
+    src, dst, weights = [], [], []
+    for direction, prob in zip(turns, turn_probs):
+        next_row, next_col = row + direction[:, 0], col + direction[:, 1]
+        inside = (next_row >= 0) & (next_row < rows) & (next_col >= 0) & (next_col < cols)
+        next_junction = next_row * cols + next_col
+        src.append(np.flatnonzero(inside))
+        dst.append(4 * next_junction[inside] + _entry_approach(direction[inside]))
+        weights.append(np.full(inside.sum(), prob))
+
+    size = 4 * num_junctions
+    return sp.csr_matrix(
+        (np.concatenate(weights), (np.concatenate(src), np.concatenate(dst))), shape=(size, size)
+    )
+
+
+class TrafficNetworkEnv(gym.Env):
+    """
+    A network of TrafficEnv junctions connected by a sparse routing matrix
+
+    Every junction uses TrafficEnv's queue, phase and reward logic. Vehicles
+    discharged by one junction join the queues of its downstream neighbours
+    on the next step; approaches with no upstream junction receive the
+    regime demand from traffic_env02. All junctions advance in one
+    vectorized update.
+
+    Actions are one phase per junction (MultiDiscrete) and observations are
+    the (M, 5) stack of per-junction TrafficEnv observations. The returned
+    reward is the network total; per-junction rewards and metrics are in
+    info as (M,) arrays.
+
+    Args:
+        routing: (4M, 4M) sparse routing matrix, see grid_routing
+        interior_demand: Share of the external demand that also appears
+                         on approaches fed by an upstream junction
+    """
+    metadata = {"render_modes": []}
+
+    def __init__(self, routing, max_queue=10, max_steps=200, interior_demand=0.25, seed=None):
+        super().__init__()
+        routing = sp.csr_matrix(routing)
+        if routing.shape[0] != routing.shape[1] or routing.shape[0] % 4:
+            raise ValueError(f"Routing matrix must be (4M, 4M), got {routing.shape}")
+        self.num_junctions = routing.shape[0] // 4
+        # Transposed once so a step is a single sparse mat-vec of discharges
+        self._inflow_matrix = routing.T.tocsr()
+        self.max_queue = max_queue
+        self.max_steps = max_steps
+
+        self.action_space = spaces.MultiDiscrete(np.full(self.num_junctions, 2))
+        self.observation_space = spaces.Box(
+            low=0, high=100, shape=(self.num_junctions, 5), dtype=np.float32
+        )
+
+        # Rates are constant after the last regime boundary; lookups clamp to the last row
+        self._rate_table = dynamic_arrival_rates(np.arange(REGIME_BOUNDARIES[-1] + 1)) * ARRIVAL_SCALE
+        has_upstream = np.asarray(routing.sum(axis=0)).ravel() > 0
+        self._demand_scale = np.where(has_upstream, interior_demand, 1.0).reshape(self.num_junctions, 4)
+
+        self.reset(seed=seed)
+
+    @classmethod
+    def grid(cls, rows, cols, turn_probs=(0.7, 0.15, 0.15), **kwargs):
+        """Network of rows x cols junctions, see grid_routing"""
+        return cls(grid_routing(rows, cols, turn_probs), **kwargs)
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        shape = (self.num_junctions, 4)
+        self.queues = np.zeros(shape, dtype=np.int64)  # [N, S, E, W] per junction
+        self.wait_times = np.zeros(shape, dtype=np.int64)
+        self.in_transit = np.zeros(shape, dtype=np.int64)
+        self.current_phase = np.zeros(self.num_junctions, dtype=np.int64)
+        self.step_count = 0
+        return self._get_obs(), {}
+
+    def _get_obs(self):
+        obs = np.empty((self.num_junctions, 5), dtype=np.float32)
+        np.divide(self.queues, self.max_queue, out=obs[:, :4])
+        obs[:, 4] = self.current_phase
+        return obs
+
+    def step(self, action):
+        actions = np.asarray(action, dtype=np.int64).reshape(self.num_junctions)
+        self.step_count += 1
+        rng = self.np_random
+
+        phase_changed = actions != self.current_phase
+        self.current_phase = actions.copy()
+        green = APPROACH_PHASE[None, :] == actions[:, None]
+
+        # External demand plus the vehicles routed here on the previous step
+        rates = self._rate_table[min(self.step_count, len(self._rate_table) - 1)] * self._demand_scale
+        arrivals = rng.poisson(rates) + self.in_transit
+        np.minimum(self.queues + arrivals, self.max_queue, out=self.queues)
+
+        # Same discharge rule as TrafficEnv; only vehicles actually queued move on
+        base_passing = 2 + np.sum((self.queues > 5) & green, axis=1)
+        passed = base_passing[:, None] + rng.integers(0, 3, size=(self.num_junctions, 2))
+        discharge = np.zeros_like(self.queues)
+        discharge[green] = passed.ravel()
+        moved = np.minimum(discharge, self.queues)
+        self.queues -= moved
+        self.wait_times += 1
+        self.wait_times[green] = 0
+
+        # Route discharged vehicles; fractional flows are rounded stochastically
+        flow = self._inflow_matrix @ moved.ravel()
+        whole = np.floor(flow)
+        routed = whole + (rng.random(flow.shape) < flow - whole)
+        self.in_transit = routed.astype(np.int64).reshape(self.num_junctions, 4)
+
+        vehicles_passed = passed.sum(axis=1)
+        rewards, components, phase_changes = batched_reward(
+            self.queues, self.wait_times, actions, phase_changed, vehicles_passed
+        )
+
+        terminated = self.step_count >= self.max_steps
+        info = {
+            "junction_rewards": rewards,
+            "vehicles_passed": vehicles_passed,
+            "vehicles_moved": moved.sum(axis=1),
+            "vehicles_in_transit": int(self.in_transit.sum()),
+            "total_queues": self.queues.sum(axis=1),
+            "max_wait_time": self.wait_times.max(axis=1),
+            "phase_changes": phase_changes.astype(np.int64),
+            "reward_components": components,
+        }
+        return self._get_obs(), float(rewards.sum()), terminated, False, info
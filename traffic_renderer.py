@@ -0,0 +1,180 @@
+import numpy as np
+
+# 3x5 bitmap font, one string of 0/1 pixels per row
+_FONT = {
+    "0": ["111", "101", "101", "101", "111"],
+    "1": ["010", "110", "010", "010", "111"],
+    "2": ["111", "001", "111", "100", "111"],
+    "3": ["111", "001", "111", "001", "111"],
+    "4": ["101", "101", "111", "001", "001"],
+    "5": ["111", "100", "111", "001", "111"],
+    "6": ["111", "100", "111", "101", "111"],
+    "7": ["111", "001", "010", "010", "010"],
+    "8": ["111", "101", "111", "101", "111"],
+    "9": ["111", "101", "111", "001", "111"],
+    "N": ["101", "111", "111", "111", "101"],
+    "S": ["111", "100", "111", "001", "111"],
+    "E": ["111", "100", "111", "100", "111"],
+    "W": ["101", "101", "111", "111", "101"],
+    "Q": ["111", "101", "101", "111", "001"],
+    ":": ["000", "010", "000", "010", "000"],
+    "/": ["001", "001", "010", "100", "100"],
+    " ": ["000", "000", "000", "000", "000"],
+}
+
+BACKGROUND = (34, 85, 45)
+ROAD = (70, 70, 74)
+JUNCTION = (95, 95, 100)
+CAR = (235, 200, 60)
+RED = (220, 45, 45)
+GREEN = (50, 205, 80)
+TEXT = (240, 240, 240)
+
+
+class TrafficRenderer:
+    """
+    Draws TrafficEnv states straight into a reusable RGB buffer
+
+    Everything that does not change between frames is prepared once: the
+    roads and signals (one background per phase), a strip of car blocks per
+    approach and an RGB tile per character of a small bitmap font. A frame
+    is then a copy of the background, one slice copy per approach for the
+    queued cars (one block per vehicle) and one per line of counters (step,
+    queue/wait per approach, total queue/max wait). No figure or frame
+    array is created per frame: draw returns the same buffer every time, so
+    copy a frame that has to outlive the next draw.
+
+    Args:
+        size: Frame width and height in pixels
+        max_queue: Vehicles per approach the lanes have room for
+    """
+
+    def __init__(self, size=256, max_queue=10):
+        self.size = size
+        self.max_queue = max_queue
+        self.scale = max(1, size // 128)
+        self.frame = np.empty((size, size, 3), dtype=np.uint8)
+
+        road = size // 4
+        self.low = (size - road) // 2  # junction box is [low, high) on both axes
+        self.high = self.low + road
+        self.lane = road // 2
+        self.gap = self.scale
+        self.lamp = 2 * self.scale  # signal lamp depth, on the stop line
+        self.slot = max(2, (self.low - self.lamp - self.gap) // max_queue)  # road length per vehicle
+
+        roads = np.empty_like(self.frame)
+        roads[:] = BACKGROUND
+        roads[:, self.low:self.high] = ROAD
+        roads[self.low:self.high, :] = ROAD
+        roads[self.low:self.high, self.low:self.high] = JUNCTION
+        self._cars = self._car_strips()
+        self._backgrounds = []
+        for phase in range(2):
+            background = roads.copy()
+            for direction, (y0, y1, x0, x1) in enumerate(self._signal_boxes()):
+                background[y0:y1, x0:x1] = GREEN if (direction < 2) == (phase == 0) else RED
+            self._backgrounds.append(background)
+        # Text is drawn on the grass, so each glyph is a ready-made RGB tile
+        # (with one pixel column of spacing) per text color
+        self._tiles = {color: {char: self._glyph_tile(rows, color) for char, rows in _FONT.items()}
+                       for color in (TEXT, GREEN, RED)}
+
+    def _glyph_tile(self, rows, color):
+        mask = np.kron(np.array([[int(p) for p in row] + [0] for row in rows], dtype=bool),
+                       np.ones((self.scale, self.scale), dtype=bool))
+        tile = np.empty(mask.shape + (3,), dtype=np.uint8)
+        tile[:] = BACKGROUND
+        tile[mask] = color
+        return tile
+
+    def _car_strips(self):
+        """
+        Per approach [N, S, E, W] and queue length, the frame box the queued
+        cars cover and the matching view of a prepared strip of car blocks,
+        filled from the stop line outwards
+        """
+        lane, gap, slot = self.lane, self.gap, self.slot
+        # Queues start behind the signal lamps
+        low, high = self.low - self.lamp, self.high + self.lamp
+        length = min(self.max_queue * slot, low)
+        strips = []
+        for direction in range(4):
+            # Strip along the road, stop line at index 0: rows = distance, cols = lane width
+            strip = np.empty((length, lane, 3), dtype=np.uint8)
+            strip[:] = ROAD
+            for k in range(self.max_queue):
+                strip[k * slot + gap:min((k + 1) * slot, length), gap:lane - gap] = CAR
+            boxes = []
+            for queue in range(self.max_queue + 1):
+                n = min(queue * slot, length)
+                if direction == 0:  # N: above the junction, left lane, growing upwards
+                    boxes.append(((slice(low - n, low), slice(self.low, self.low + lane)), strip[:n][::-1]))
+                elif direction == 1:  # S: below the junction, right lane, growing downwards
+                    boxes.append(((slice(high, high + n), slice(self.high - lane, self.high)), strip[:n]))
+                elif direction == 2:  # E: right of the junction, upper lane, growing rightwards
+                    boxes.append(((slice(self.low, self.low + lane), slice(high, high + n)),
+                                  strip[:n].transpose(1, 0, 2)))
+                else:  # W: left of the junction, lower lane, growing leftwards
+                    boxes.append(((slice(self.high - lane, self.high), slice(low - n, low)),
+                                  strip[:n][::-1].transpose(1, 0, 2)))
+            strips.append(boxes)
+        return strips
+
+    def _signal_boxes(self):
+        """(y0, y1, x0, x1) of the signal lamp of each approach, on its stop line"""
+        low, high, lane, t = self.low, self.high, self.lane, self.lamp
+        return [
+            (low - t, low, low, low + lane),  # N
+            (high, high + t, high - lane, high),  # S
+            (low, low + lane, high, high + t),  # E
+            (high - lane, high, low - t, low),  # W
+        ]
+
+    def _text(self, frame, x, y, text, color):
+        tiles = self._tiles[color]
+        tile_w = 4 * self.scale
+        text = text[:max(0, (self.size - x) // tile_w)]  # clip at the right edge
+        if text:
+            line = np.concatenate([tiles[char] for char in text], axis=1)
+            frame[y:y + line.shape[0], x:x + line.shape[1]] = line
+
+    def draw(self, queues, wait_times, phase, step, out=None):
+        """
+        Draw one state
+
+        Args:
+            queues, wait_times: Per approach [N, S, E, W]
+            phase: 0 (NS green) or 1 (EW green)
+            step: Step counter shown in the corner
+            out: Optional (size, size, 3) uint8 array to draw into instead
+                 of the renderer's own frame, e.g. a slot of a video buffer
+
+        Returns:
+            The drawn frame (out, or the renderer's reused frame)
+        """
+        frame = self.frame if out is None else out
+        phase = int(phase)
+        np.copyto(frame, self._backgrounds[phase])
+        queues = [min(max(int(q), 0), self.max_queue) for q in queues]
+        wait_times = [int(w) for w in wait_times]
+
+        for direction, boxes in enumerate(self._cars):
+            box, cars = boxes[queues[direction]]
+            frame[box] = cars
+
+        margin = 2 * self.scale
+        line = 7 * self.scale
+        low, high = self.low, self.high
+        self._text(frame, margin, margin, str(step), TEXT)
+        label_positions = [
+            (margin, low - line),  # N: upper left
+            (high + margin, high + margin),  # S: lower right
+            (high + margin, low - line),  # E: upper right
+            (margin, high + margin),  # W: lower left
+        ]
+        for direction, (x, y) in enumerate(label_positions):
+            color = GREEN if (direction < 2) == (phase == 0) else RED
+            self._text(frame, x, y, f"{'NSEW'[direction]}:{queues[direction]}/{wait_times[direction]}", color)
+        self._text(frame, margin, self.size - line, f"Q:{sum(queues)}/{max(wait_times)}", TEXT)
+        return frame
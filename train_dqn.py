@@ -1,6 +1,18 @@
+import argparse
+import os
+import time
+
+import torch
 from stable_baselines3 import DQN
 from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3.common.callbacks import EvalCallback
+from stable_baselines3.common.callbacks import BaseCallback, CallbackList, EvalCallback
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecMonitor
+
+from checkpointing import TrainingCheckpointCallback, load_checkpoint, read_checkpoint
+from profiling import ProfilingCallback, StageProfiler
+from replay_buffers import CompactReplayBuffer, MemmapReplayBuffer
+from shm_vec_env import ShmVecEnv
+from vec_traffic_env import VecTrafficEnv
 
 # Register the environment
 from gymnasium.envs.registration import register
@@ -9,25 +21,13 @@ register(
     entry_point="traffic_env02:TrafficEnv",
 )
 
-# Create environment
-env = make_vec_env("TrafficEnv-v1", n_envs=1)
-
-# Evaluation callback
-eval_callback = EvalCallback(
-    env,
-    best_model_save_path="./best_model/",
-    log_path="./logs/",
-    eval_freq=5000,
-    deterministic=True,
-    render=False
-)
+VEC_ENV_BACKENDS = ["dummy", "subproc", "shm", "batched"]
 
-# Create model
-model = DQN(
-    "MlpPolicy",
-    env,
+# DQN hyperparameters
+DQN_PARAMS = dict(
     learning_rate=0.0005,   # Slightly higher
     buffer_size=100000,     # Larger buffer
+    replay_buffer_class=CompactReplayBuffer,  # 10 bytes per transition
     learning_starts=10000,  # More initial exploration
     batch_size=256,         # Larger batches
     gamma=0.98,             # Slightly longer horizon
@@ -35,12 +35,175 @@ model = DQN(
     target_update_interval=2000,
     exploration_fraction=0.3,
     exploration_final_eps=0.05,
-    verbose=1,
-    tensorboard_log="./traffic_light_tensorboard/"
 )
 
-# Train
-model.learn(total_timesteps=500_000, callback=eval_callback)
-model.save("dqn_traffic_optimized")
 
-env.close()
\ No newline at end of file
+def make_env(vec_env="dummy", n_envs=1, seed=None, n_workers=None):
+    """
+    Create a vectorized TrafficEnv
+
+    Args:
+        vec_env: "dummy" steps the envs in this process, "subproc" runs one
+                 worker process per env, "shm" runs n_workers processes
+                 that share memory with the learner, "batched" uses
+                 VecTrafficEnv
+        n_envs: Number of environments
+        seed: Base seed, env i is seeded with seed + i
+        n_workers: Worker processes for the "shm" backend
+    """
+    if vec_env == "batched":
+        return VecMonitor(VecTrafficEnv(n_envs, seed=seed))
+    if vec_env == "shm":
+        return VecMonitor(ShmVecEnv(n_envs, n_workers=n_workers, seed=seed))
+    if vec_env not in VEC_ENV_BACKENDS:
+        raise ValueError(f"Unknown vec env backend: {vec_env}")
+    return make_vec_env(
+        "TrafficEnv-v1",
+        n_envs=n_envs,
+        seed=seed,
+        vec_env_cls=SubprocVecEnv if vec_env == "subproc" else DummyVecEnv,
+        env_kwargs={"render_mode": None},
+    )
+
+
+def build_model(env, seed=None, tensorboard_log="./traffic_light_tensorboard/", verbose=1, **overrides):
+    """DQN with the project hyperparameters, any of which can be overridden"""
+    params = {**DQN_PARAMS, **overrides}
+    return DQN("MlpPolicy", env, seed=seed, verbose=verbose, tensorboard_log=tensorboard_log, **params)
+
+
+class ThroughputCallback(BaseCallback):
+    """Report env steps/sec and gradient updates/sec while training"""
+
+    def __init__(self, log_interval=10000, verbose=0):
+        super().__init__(verbose)
+        self.log_interval = log_interval
+
+    def _on_training_start(self):
+        self._last_time = time.perf_counter()
+        self._last_steps = self.num_timesteps
+        self._last_updates = self.model._n_updates
+        self._last_log = self.num_timesteps
+
+    def _on_step(self):
+        if self.num_timesteps - self._last_log < self.log_interval:
+            return True
+        self._last_log = self.num_timesteps
+
+        now = time.perf_counter()
+        elapsed = max(now - self._last_time, 1e-9)
+        steps_per_sec = (self.num_timesteps - self._last_steps) / elapsed
+        updates_per_sec = (self.model._n_updates - self._last_updates) / elapsed
+        self._last_time, self._last_steps, self._last_updates = now, self.num_timesteps, self.model._n_updates
+
+        self.logger.record("throughput/env_steps_per_sec", steps_per_sec)
+        self.logger.record("throughput/gradient_updates_per_sec", updates_per_sec)
+        if self.verbose > 0:
+            print(f"[{self.num_timesteps:,} steps] {steps_per_sec:,.0f} env steps/sec, "
+                  f"{updates_per_sec:,.1f} gradient updates/sec")
+        return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train a DQN traffic light controller")
+    parser.add_argument("--total-timesteps", type=int, default=500_000)
+    parser.add_argument("--n-envs", type=int, default=1, help="Number of rollout workers")
+    parser.add_argument("--vec-env", choices=VEC_ENV_BACKENDS, default="dummy")
+    parser.add_argument("--n-workers", type=int, default=None,
+                        help="Worker processes for the shm backend (default: one per core)")
+    parser.add_argument("--n-eval-envs", type=int, default=1, help="Size of the separate eval env pool")
+    parser.add_argument("--eval-vec-env", choices=VEC_ENV_BACKENDS, default=None,
+                        help="Defaults to the training backend")
+    parser.add_argument("--eval-freq", type=int, default=5000, help="Env steps between evaluations")
+    parser.add_argument("--n-eval-episodes", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--eval-seed", type=int, default=None, help="Defaults to seed + 10000")
+    parser.add_argument("--gradient-steps", type=int, default=1,
+                        help="Gradient steps per rollout, -1 for one per collected transition")
+    parser.add_argument("--torch-threads", type=int, default=None)
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--throughput-interval", type=int, default=10000)
+    parser.add_argument("--save-path", default="dqn_traffic_optimized")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="Keep a resumable checkpoint (and a memory-mapped replay buffer) here")
+    parser.add_argument("--checkpoint-freq", type=int, default=50000, help="Env steps between checkpoints")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint in --checkpoint-dir")
+    parser.add_argument("--tensorboard-log", default="./traffic_light_tensorboard/")
+    parser.add_argument("--profile-every", type=int, default=None,
+                        help="Time the training stages of one call in this many (off by default); "
+                             "TrafficEnv's own stages are only timed with --vec-env dummy")
+    parser.add_argument("--profile-report", default=None, help="Write the stage timings to this JSON file")
+    return parser.parse_args(argv)
+
+
+def train(args):
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+    eval_seed = args.seed + 10000 if args.eval_seed is None else args.eval_seed
+
+    # Create environments; evaluation runs on its own pool, never the training envs
+    env = make_env(args.vec_env, args.n_envs, seed=args.seed, n_workers=args.n_workers)
+    eval_env = make_env(args.eval_vec_env or args.vec_env, args.n_eval_envs, seed=eval_seed,
+                        n_workers=args.n_workers)
+
+    # Evaluation callback (eval_freq counts vectorized steps)
+    eval_callback = EvalCallback(
+        eval_env,
+        best_model_save_path="./best_model/",
+        log_path="./logs/",
+        eval_freq=max(args.eval_freq // args.n_envs, 1),
+        n_eval_episodes=args.n_eval_episodes,
+        deterministic=True,
+        render=False
+    )
+    callbacks = [eval_callback, ThroughputCallback(args.throughput_interval, verbose=1)]
+
+    resume = args.resume and args.checkpoint_dir and read_checkpoint(args.checkpoint_dir) is not None
+    if resume:
+        # Continue from the checkpoint: weights, optimizer, schedule, RNGs and replay buffer
+        model, checkpoint = load_checkpoint(
+            args.checkpoint_dir, env, tensorboard_log=args.tensorboard_log, device=args.device
+        )
+        eval_callback.best_mean_reward = checkpoint.get("best_mean_reward", eval_callback.best_mean_reward)
+        print(f"Resuming from {args.checkpoint_dir} at {model.num_timesteps:,} steps")
+    else:
+        # Create model
+        overrides = {}
+        if args.checkpoint_dir:
+            overrides = dict(
+                replay_buffer_class=MemmapReplayBuffer,
+                replay_buffer_kwargs=dict(path=os.path.join(args.checkpoint_dir, "replay_buffer")),
+            )
+        model = build_model(
+            env,
+            seed=args.seed,
+            tensorboard_log=args.tensorboard_log,
+            gradient_steps=args.gradient_steps,
+            device=args.device,
+            **overrides,
+        )
+    if args.profile_every:
+        callbacks.append(ProfilingCallback(
+            StageProfiler(args.profile_every), args.throughput_interval, args.profile_report,
+            eval_callback=eval_callback, verbose=1,
+        ))
+    if args.checkpoint_dir:
+        callbacks.append(TrainingCheckpointCallback(
+            args.checkpoint_dir, args.checkpoint_freq, eval_callback=eval_callback, verbose=1
+        ))
+
+    # Train
+    model.learn(
+        total_timesteps=args.total_timesteps - model.num_timesteps,
+        callback=CallbackList(callbacks),
+        reset_num_timesteps=not resume,
+    )
+    model.save(args.save_path)
+
+    env.close()
+    eval_env.close()
+    return model
+
+
+if __name__ == "__main__":
+    train(parse_args())
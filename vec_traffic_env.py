@@ -0,0 +1,210 @@
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
+from traffic_env02 import ARRIVAL_SCALE, REGIME_BOUNDARIES, dynamic_arrival_rates
+from vehicle_queues import VehicleQueues
+
+# Phase that gives each approach [N, S, E, W] a green light
+APPROACH_PHASE = np.array([0, 0, 1, 1])
+
+
+def batched_reward(queues, wait_times, actions, phase_changed, vehicles_passed):
+    """
+    Vectorized TrafficEnv reward for a batch of intersections
+
+    Args:
+        queues: (N, 4) queue lengths after arrivals and discharge
+        wait_times: (N, 4) wait counters after the phase update
+        actions: (N,) phase chosen this step
+        phase_changed: (N,) bool, True where the action switched the phase
+        vehicles_passed: (N,) vehicles discharged this step
+
+    Returns:
+        (reward, components, phase_changes): components holds the per-term
+        arrays reported in TrafficEnv's info["reward_components"] and
+        phase_changes flags the switches that were penalized
+    """
+    throughput_reward = 5.0 * vehicles_passed
+    queue_penalty = 0.1 * np.sum(np.maximum(0, queues - 5)**2, axis=1)
+    wait_penalty = 0.05 * np.sum(wait_times**1.5, axis=1)
+
+    # A phase change is free when the new green side has 3+ more vehicles
+    ns_queue = queues[:, 0] + queues[:, 1]
+    ew_queue = queues[:, 2] + queues[:, 3]
+    justified = np.where(actions == 0, ns_queue > ew_queue + 3, ew_queue > ns_queue + 3)
+    phase_changes = phase_changed & ~justified
+    phase_change_cost = 0.5 * phase_changes
+
+    efficiency_bonus = 2.0 * (vehicles_passed >= 6)
+    balance_bonus = 1.0 / (1.0 + np.abs(ns_queue - ew_queue))
+
+    reward = (
+        throughput_reward
+        - queue_penalty
+        - wait_penalty
+        - phase_change_cost
+        + efficiency_bonus
+        + balance_bonus
+    )
+    components = {
+        "throughput": throughput_reward,
+        "queue_penalty": -queue_penalty,
+        "wait_penalty": -wait_penalty,
+        "phase_change": -phase_change_cost,
+        "efficiency_bonus": efficiency_bonus,
+        "balance_bonus": balance_bonus,
+    }
+    return reward, components, phase_changes
+
+
+class VecTrafficEnv(VecEnv):
+    """
+    N copies of TrafficEnv stepped together as array operations
+
+    The state of every intersection lives in (N, 4) / (N,) arrays, so one
+    step_wait call does arrivals, discharge, reward and auto-reset for the
+    whole batch. Per-step metrics that TrafficEnv reports in its info dict
+    are exposed as arrays in `batch_info` instead of N nested dicts.
+
+    Args:
+        num_envs: Number of intersections
+        max_queue: Queue cap per approach
+        max_steps: Episode length, either one value or an (N,) array of
+                   per-env lengths
+        seed: Seed of the shared random generator
+        vehicle_level: Track the arrival step of every queued vehicle
+                       (self.vehicles) for exact per-vehicle delays; the
+                       delay statistics accumulate over all episodes
+    """
+
+    def __init__(self, num_envs, max_queue=10, max_steps=200, seed=None, vehicle_level=False):
+        self.render_mode = None
+        observation_space = spaces.Box(low=0, high=100, shape=(5,), dtype=np.float32)
+        action_space = spaces.Discrete(2)  # 0: NS green, 1: EW green
+        super().__init__(num_envs, observation_space, action_space)
+
+        self.max_queue = max_queue
+        self.max_steps = max_steps if np.isscalar(max_steps) else np.asarray(max_steps, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        # Arrival rate for every step count of an episode, looked up by index
+        # Rates are constant after the last regime boundary; lookups clamp to the last row
+        self.rate_table = dynamic_arrival_rates(np.arange(REGIME_BOUNDARIES[-1] + 1)) * ARRIVAL_SCALE
+
+        self.queues = np.zeros((num_envs, 4), dtype=np.int32)  # [N, S, E, W]
+        self.wait_times = np.zeros((num_envs, 4), dtype=np.int32)
+        self.current_phase = np.zeros(num_envs, dtype=np.int64)
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+        self.vehicles = VehicleQueues(num_envs, max_queue) if vehicle_level else None
+        self.batch_info = {}
+        self._actions = np.zeros(num_envs, dtype=np.int64)
+
+    def _reset_rows(self, rows):
+        self.queues[rows] = 0
+        self.wait_times[rows] = 0
+        self.current_phase[rows] = 0
+        self.step_count[rows] = 0
+        if self.vehicles is not None:
+            self.vehicles.reset_rows(rows)
+
+    def _get_obs(self):
+        obs = np.empty((self.num_envs, 5), dtype=np.float32)
+        np.divide(self.queues, self.max_queue, out=obs[:, :4])
+        obs[:, 4] = self.current_phase
+        return obs
+
+    def reset(self):
+        if self._seeds[0] is not None:
+            self.rng = np.random.default_rng(self._seeds[0])
+        self._reset_seeds()
+        self._reset_options()
+        self._reset_rows(slice(None))
+        self.batch_info = {}
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+
+    def step_wait(self):
+        actions = self._actions
+        self.step_count += 1
+
+        phase_changed = actions != self.current_phase
+        self.current_phase = actions.copy()
+        green = APPROACH_PHASE[None, :] == actions[:, None]
+
+        # Arrivals for every approach of every intersection in one draw
+        rates = self.rate_table[np.minimum(self.step_count, len(self.rate_table) - 1)]
+        arrivals = self.rng.poisson(rates)
+        queued_before = self.queues.copy() if self.vehicles is not None else None
+        np.minimum(self.queues + arrivals, self.max_queue, out=self.queues)
+        queued = self.queues.copy() if self.vehicles is not None else None
+
+        # Discharge on the green pair, faster when its queues are longer
+        base_passing = 2 + np.sum((self.queues > 5) & green, axis=1)
+        passed = base_passing[:, None] + self.rng.integers(0, 3, size=(self.num_envs, 2))
+        discharge = np.zeros_like(self.queues)
+        discharge[green] = passed.ravel()
+        np.maximum(self.queues - discharge, 0, out=self.queues)
+        self.wait_times += 1
+        self.wait_times[green] = 0
+
+        vehicles_passed = passed.sum(axis=1)
+        rewards, components, phase_changes = batched_reward(
+            self.queues, self.wait_times, actions, phase_changed, vehicles_passed
+        )
+        self.batch_info = {
+            "vehicles_passed": vehicles_passed,
+            "total_queues": self.queues.sum(axis=1),
+            "max_wait_time": self.wait_times.max(axis=1),
+            "phase_changes": phase_changes.astype(np.int64),
+            "reward_components": components,
+        }
+        if self.vehicles is not None:
+            self.vehicles.enqueue(queued - queued_before, self.step_count)
+            delays = self.vehicles.dequeue(queued - self.queues, self.step_count)
+            self.batch_info["vehicle_delays"] = delays  # (N, 4, K) delays of departing vehicles, -1 padded
+            self.batch_info["max_vehicle_wait"] = self.vehicles.oldest_wait(self.step_count).max(axis=1)
+
+        dones = self.step_count >= self.max_steps
+        obs = self._get_obs()
+        infos = [{} for _ in range(self.num_envs)]
+        if dones.any():
+            done_rows = np.flatnonzero(dones)
+            for row in done_rows:
+                infos[row]["terminal_observation"] = obs[row].copy()
+            self._reset_rows(done_rows)
+            obs[done_rows, :4] = 0.0
+            obs[done_rows, 4] = 0.0
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def close(self):
+        pass
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        return [seed] * self.num_envs
+
+    def get_attr(self, attr_name, indices=None):
+        value = getattr(self, attr_name)
+        indices = list(self._get_indices(indices))
+        if isinstance(value, np.ndarray) and value.shape[:1] == (self.num_envs,):
+            return [value[i] for i in indices]
+        return [value for _ in indices]
+
+    def set_attr(self, attr_name, value, indices=None):
+        current = getattr(self, attr_name, None)
+        if isinstance(current, np.ndarray) and current.shape[:1] == (self.num_envs,):
+            current[list(self._get_indices(indices))] = value
+        else:
+            setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        method = getattr(self, method_name)
+        return [method(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+    def get_images(self):
+        return [None for _ in range(self.num_envs)]
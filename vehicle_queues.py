@@ -0,0 +1,211 @@
+import numpy as np
+
+
+class VehicleQueues:
+    """
+    Arrival timestamps of every queued vehicle, for a batch of intersections
+
+    Each approach of each env is a fixed-capacity circular buffer of arrival
+    steps: (N, A, capacity) integers plus a head index and a length per
+    approach. Arrivals are written after the tail and discharged vehicles
+    are taken from the head, for all envs and approaches in one set of
+    array operations, so a vehicle's delay is known exactly when it leaves.
+    A step only touches the slots that change (the first max(counts) slots
+    after the tail or from the head), with no per-vehicle Python work. Delays of
+    discharged vehicles are accumulated per env (count, sum, max) and in a
+    histogram with one bin per step, which gives the full delay
+    distribution without keeping the delays themselves.
+
+    Queues are first-in first-out and the count model caps every queue at
+    max_queue, so capacity = max_queue never overflows.
+
+    Args:
+        num_envs: Number of intersections N
+        capacity: Vehicles per approach buffer (the env's max_queue)
+        num_approaches: Approaches per intersection A
+        max_delay: Delays at or above this go to the last histogram bin
+    """
+
+    def __init__(self, num_envs, capacity, num_approaches=4, max_delay=1024):
+        self.num_envs = num_envs
+        self.capacity = capacity
+        self.max_delay = max_delay
+        # Buffers are addressed through the flat view: approach (n, a) owns
+        # entries [(n * A + a) * capacity, ... + capacity)
+        self.arrival_steps = np.zeros((num_envs, num_approaches, capacity), dtype=np.int64)
+        self._flat = self.arrival_steps.reshape(-1)
+        self._base = (np.arange(num_envs * num_approaches) * capacity).reshape(num_envs, num_approaches, 1)
+        self.head = np.zeros((num_envs, num_approaches), dtype=np.int64)
+        self.length = np.zeros((num_envs, num_approaches), dtype=np.int64)
+        self.delay_count = np.zeros(num_envs, dtype=np.int64)
+        self.delay_sum = np.zeros(num_envs, dtype=np.int64)
+        self.delay_max = np.zeros(num_envs, dtype=np.int64)
+        self.delay_histogram = np.zeros(max_delay + 1, dtype=np.int64)  # pooled over the envs
+
+    def reset_rows(self, rows):
+        """Empty the queues of some envs; the delay statistics are kept"""
+        self.head[rows] = 0
+        self.length[rows] = 0
+
+    def reset_statistics(self):
+        self.delay_count[:] = 0
+        self.delay_sum[:] = 0
+        self.delay_max[:] = 0
+        self.delay_histogram[:] = 0
+
+    def _window(self, start, counts):
+        """
+        Flat indices of the first max(counts) buffer slots from start, (N, A, K),
+        and the mask of the slots within each approach's count
+        """
+        k = np.arange(int(counts.max()) if counts.size else 0)
+        slots = start[:, :, None] + k
+        np.subtract(slots, self.capacity, out=slots, where=slots >= self.capacity)  # start, k < capacity
+        slots += self._base
+        return slots, k < counts[:, :, None]
+
+    def enqueue(self, counts, steps):
+        """
+        Append counts[n, a] vehicles arriving at steps[n] (or one step for all envs)
+
+        The caller admits at most capacity - length vehicles per approach.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        tail = self.head + self.length
+        np.subtract(tail, self.capacity, out=tail, where=tail >= self.capacity)
+        slots, new = self._window(tail, counts)
+        self._flat[slots[new]] = np.broadcast_to(np.reshape(steps, (-1, 1, 1)), new.shape)[new]
+        self.length += counts
+
+    def dequeue(self, counts, steps):
+        """
+        Remove the counts[n, a] oldest vehicles of each approach at steps[n]
+
+        Returns:
+            (N, A, K) delays of the vehicles that left, oldest first, with -1
+            in the slots beyond each approach's count
+        """
+        counts = np.minimum(np.asarray(counts, dtype=np.int64), self.length)
+        slots, leaving = self._window(self.head, counts)
+        delays = np.where(leaving, np.reshape(steps, (-1, 1, 1)) - self._flat.take(slots), -1)
+        self.head += counts
+        np.subtract(self.head, self.capacity, out=self.head, where=self.head >= self.capacity)
+        self.length -= counts
+
+        self.delay_count += counts.sum(axis=1)
+        if delays.size:
+            self.delay_sum += np.where(leaving, delays, 0).sum(axis=(1, 2))
+            np.maximum(self.delay_max, delays.max(axis=(1, 2)), out=self.delay_max)
+            self.delay_histogram += np.bincount(np.minimum(delays[leaving], self.max_delay),
+                                                minlength=self.max_delay + 1)
+        return delays
+
+    def oldest_wait(self, steps):
+        """(N, A) steps the first queued vehicle of each approach has waited, 0 when empty"""
+        first = self._flat.take(self.head + self._base[:, :, 0])
+        return np.where(self.length > 0, np.reshape(steps, (-1, 1)) - first, 0)
+
+    def delay_summary(self, rows=None):
+        """
+        Exact delay distribution of the vehicles discharged so far
+
+        Args:
+            rows: Envs whose count, mean and max are pooled, all by default
+                  (the quantiles always come from the histogram of all envs)
+
+        Returns:
+            Dict of vehicles, mean, p50, p95, p99 and max delay (in steps)
+        """
+        rows = slice(None) if rows is None else rows
+        return delay_summary(np.sum(self.delay_count[rows]), np.sum(self.delay_sum[rows]),
+                             np.max(self.delay_max[rows]), self.delay_histogram)
+
+
+class VehicleQueue:
+    """
+    VehicleQueues for a single intersection, in plain Python
+
+    Same circular timestamp buffers and delay statistics, kept in lists so
+    that TrafficEnv's scalar step does not pay NumPy call overhead on
+    length-4 arrays. Delays of vehicles beyond max_delay go to the last
+    histogram bin.
+    """
+
+    def __init__(self, capacity, num_approaches=4, max_delay=1024):
+        self.capacity = capacity
+        self.max_delay = max_delay
+        self.arrival_steps = [[0] * capacity for _ in range(num_approaches)]
+        self.head = [0] * num_approaches
+        self.length = [0] * num_approaches
+        self.delay_histogram = [0] * (max_delay + 1)
+        self.reset_statistics()
+
+    def reset(self):
+        """Empty the queues; the delay statistics are kept"""
+        self.head = [0] * len(self.head)
+        self.length = [0] * len(self.length)
+
+    def reset_statistics(self):
+        self.delay_count = 0
+        self.delay_sum = 0
+        self.delay_max = 0
+        self.delay_histogram = [0] * (self.max_delay + 1)
+
+    def enqueue(self, counts, step):
+        """Append counts[a] vehicles arriving at step; at most capacity - length per approach"""
+        capacity = self.capacity
+        for a, count in enumerate(counts):
+            buffer = self.arrival_steps[a]
+            tail = self.head[a] + self.length[a]
+            for k in range(tail, tail + count):
+                buffer[k % capacity] = step
+            self.length[a] += count
+
+    def dequeue(self, counts, step):
+        """Remove the counts[a] oldest vehicles of each approach; returns their delays"""
+        capacity = self.capacity
+        histogram = self.delay_histogram
+        delays = []
+        for a, count in enumerate(counts):
+            count = min(count, self.length[a])
+            buffer = self.arrival_steps[a]
+            head = self.head[a]
+            for k in range(head, head + count):
+                delays.append(step - buffer[k % capacity])
+            self.head[a] = (head + count) % capacity
+            self.length[a] -= count
+        for delay in delays:
+            histogram[min(delay, self.max_delay)] += 1
+        if delays:
+            self.delay_count += len(delays)
+            self.delay_sum += sum(delays)
+            self.delay_max = max(self.delay_max, max(delays))
+        return delays
+
+    def oldest_wait(self, step):
+        """Per approach, steps the first queued vehicle has waited (0 when empty)"""
+        return [step - buffer[head] if length else 0
+                for buffer, head, length in zip(self.arrival_steps, self.head, self.length)]
+
+    def delay_summary(self):
+        return delay_summary(self.delay_count, self.delay_sum, self.delay_max, np.array(self.delay_histogram))
+
+
+def delay_summary(count, total, maximum, histogram):
+    """Count, mean, p50/p95/p99 and max of the delays behind a one-bin-per-step histogram"""
+    count = int(count)
+    if count == 0:
+        return {"vehicles": 0}
+    cumulative = np.cumsum(histogram)
+
+    def quantile(q):
+        return int(np.searchsorted(cumulative, q * (count - 1), side="right"))
+
+    return {
+        "vehicles": count,
+        "mean": float(total / count),
+        "p50": quantile(0.5),
+        "p95": quantile(0.95),
+        "p99": quantile(0.99),
+        "max": int(maximum),
+    }
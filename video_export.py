@@ -0,0 +1,199 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+from traffic_renderer import TrafficRenderer
+
+META_FILE = "meta.json"
+VIDEO_CODECS = {".mp4": "mp4v", ".avi": "MJPG"}
+
+
+class FrameArchiveWriter:
+    """
+    Frame sequence stored as compressed chunks of frames in a directory
+
+    Frames are copied into a preallocated chunk and every full chunk is
+    written as `frames_<n>.npz`, so memory stays at chunk_size frames.
+    meta.json is rewritten after each chunk, as in step_recorder.
+
+    Args:
+        path: Directory of the archive, created if missing
+        fps: Playback rate stored in meta.json
+        size: Frame width and height
+        chunk_size: Frames per chunk file
+    """
+
+    def __init__(self, path, fps, size, chunk_size=256):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.fps = fps
+        self.chunk_size = chunk_size
+        self.num_frames = 0
+        self.num_chunks = 0
+        self._chunk = np.empty((chunk_size, size, size, 3), dtype=np.uint8)
+        self._pos = 0
+
+    def next_frame(self):
+        """Buffer the next frame is drawn into"""
+        return self._chunk[self._pos]
+
+    def commit_frame(self):
+        self._pos += 1
+        if self._pos == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._pos:
+            np.savez_compressed(os.path.join(self.path, f"frames_{self.num_chunks:06d}.npz"),
+                                frames=self._chunk[:self._pos])
+            self.num_frames += self._pos
+            self.num_chunks += 1
+            self._pos = 0
+        meta = {"num_frames": self.num_frames, "num_chunks": self.num_chunks, "fps": self.fps,
+                "frame_shape": list(self._chunk.shape[1:])}
+        tmp_path = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def close(self):
+        self.flush()
+
+
+class FrameArchive:
+    """Read a FrameArchiveWriter directory one chunk at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.num_frames = meta["num_frames"]
+        self.num_chunks = meta["num_chunks"]
+        self.fps = meta["fps"]
+
+    def __len__(self):
+        return self.num_frames
+
+    def chunks(self):
+        for i in range(self.num_chunks):
+            with np.load(os.path.join(self.path, f"frames_{i:06d}.npz")) as data:
+                yield data["frames"]
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from chunk
+
+
+class VideoFileWriter:
+    """Encoded video file (.mp4 or .avi) written with OpenCV"""
+
+    def __init__(self, path, fps, size):
+        import cv2
+
+        self._cv2 = cv2
+        codec = VIDEO_CODECS[os.path.splitext(path)[1].lower()]
+        self._writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (size, size))
+        if not self._writer.isOpened():
+            raise IOError(f"Could not open {path} for writing with codec {codec}")
+        self._frame = np.empty((size, size, 3), dtype=np.uint8)
+        self._bgr = np.empty_like(self._frame)
+        self.num_frames = 0
+
+    def next_frame(self):
+        return self._frame
+
+    def commit_frame(self):
+        self._bgr[:] = self._frame[:, :, ::-1]  # OpenCV expects BGR
+        self._writer.write(self._bgr)
+        self.num_frames += 1
+
+    def close(self):
+        self._writer.release()
+
+
+def open_frame_writer(path, fps=4, size=256):
+    """VideoFileWriter for .mp4/.avi paths, FrameArchiveWriter (a directory) otherwise"""
+    if os.path.splitext(path)[1].lower() in VIDEO_CODECS:
+        return VideoFileWriter(path, fps, size)
+    return FrameArchiveWriter(path, fps, size)
+
+
+class EpisodeExporter:
+    """
+    Stream the states of an episode to a video or frame archive in the background
+
+    The simulation only queues a small snapshot of each state (see
+    TrafficEnv.render_state); a background thread draws the frames with
+    TrafficRenderer and encodes or compresses them, so the episode never
+    waits for rendering or disk I/O and no frames are held in memory
+    beyond the writer's chunk. Errors in the thread are raised by the next
+    add or by close.
+
+    Args:
+        path: Output .mp4/.avi file, or a directory for a frame archive
+        fps: Playback frame rate
+        size: Frame width and height
+        max_queue: TrafficEnv.max_queue (vehicles drawn per approach)
+        max_pending: States queued before add blocks
+    """
+
+    def __init__(self, path, fps=4, size=256, max_queue=10, max_pending=4096):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.fps = fps
+        self.size = size
+        self.max_queue = max_queue
+        self.num_frames = 0
+        self._states = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, queues, wait_times, phase, step):
+        """Queue one state for rendering; arguments as TrafficRenderer.draw"""
+        if self._error is not None:
+            raise self._error
+        self._states.put((queues, wait_times, phase, step))
+
+    def _run(self):
+        renderer = None
+        writer = None
+        try:
+            renderer = TrafficRenderer(self.size, self.max_queue)
+            writer = open_frame_writer(self.path, self.fps, self.size)
+            while True:
+                state = self._states.get()
+                if state is None:
+                    break
+                renderer.draw(*state, out=writer.next_frame())
+                writer.commit_frame()
+                self.num_frames += 1
+        except Exception as e:
+            self._error = e
+            # Keep draining so add never blocks on a dead exporter
+            while self._states.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def close(self):
+        """Finish writing the queued frames"""
+        if self._thread is None:
+            return
+        self._states.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()